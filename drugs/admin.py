@@ -1,9 +1,155 @@
+import json
+import time
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin import helpers
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+
+from . import bulk, history
+from .forms import PriceAdjustmentForm
 from .models import (
-    CustomUser, Drug, PharmacyNetwork, Pharmacy, Availability,
-    Analogue, PriceHistory, UserSubscription
+    CustomUser, Drug, City, PharmacyNetwork, Pharmacy, Availability,
+    Analogue, PriceHistory, UserSubscription, NetworkFeed, FeedRun,
+    ExternalId, UnmatchedCode, PartnerToken, IngestBatch
 )
+from .reference import get_cities, get_networks
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц: вместо точного COUNT(*) берет оценку планировщика.
+
+    На PostgreSQL без фильтров используется pg_class.reltuples (у секционированной
+    таблицы - сумма по секциям), с фильтрами - оценка строк из EXPLAIN. Если оценка
+    меньше ADMIN_ESTIMATED_COUNT_THRESHOLD, считается точное значение: на небольших
+    выборках COUNT дешев, а номера страниц точны.
+    На других СУБД оценки нет, и пагинатор ведет себя как обычный.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = self._estimate()
+        if estimate is not None and estimate >= getattr(settings, 'ADMIN_ESTIMATED_COUNT_THRESHOLD', 100000):
+            return estimate
+        return super().count
+
+    def _estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                # Секционированную таблицу (история цен) autovacuum не анализирует,
+                # ее reltuples всегда -1: оценка - сумма по секциям из pg_inherits.
+                # -1 у секции - она еще ни разу не анализировалась
+                table = queryset.model._meta.db_table
+                cursor.execute(
+                    'SELECT SUM(GREATEST(c.reltuples, 0))::bigint, BOOL_OR(c.reltuples >= 0) FROM pg_class c '
+                    "WHERE (c.oid = %s::regclass AND c.relkind <> 'p') "
+                    'OR c.oid IN (SELECT i.inhrelid FROM pg_inherits i WHERE i.inhparent = %s::regclass)',
+                    [table, table],
+                )
+                estimate, analyzed = cursor.fetchone()
+                return estimate if analyzed else None
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CityListFilter(admin.SimpleListFilter):
+    """
+    Фильтр по городу со списком из кэша справочников (reference.get_cities)
+    вместо DISTINCT-выборки городов на каждое открытие списка.
+    """
+    title = 'Город'
+    parameter_name = 'city'
+    city_field = 'city_id'
+
+    def lookups(self, request, model_admin):
+        return [(str(city_id), name) for city_id, name in get_cities()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.city_field: self.value()})
+        return queryset
+
+
+class PharmacyCityListFilter(CityListFilter):
+    city_field = 'pharmacy__city_id'
+
+
+class PharmacyNetworkListFilter(admin.SimpleListFilter):
+    """Фильтр по аптечной сети со списком из кэша справочников"""
+    title = 'Аптечная сеть'
+    parameter_name = 'network'
+
+    def lookups(self, request, model_admin):
+        return [(str(network_id), name) for network_id, name in get_networks()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(pharmacy__network_id=self.value())
+        return queryset
+
+
+class RecordedPeriodListFilter(admin.SimpleListFilter):
+    """
+    По умолчанию история цен показывается за последние PRICE_HISTORY_HOT_MONTHS
+    месяцев: на PostgreSQL запрос читает только их секции. Старые месяцы -
+    по выбору "Вся основная таблица". Месяцы, выгруженные в архив, и на SQLite
+    месяцы, перенесенные в таблицы по месяцам (drugs.history), в админке не
+    видны - их читает history.load_archive.
+    """
+    title = 'период'
+    parameter_name = 'period'
+
+    def lookups(self, request, model_admin):
+        return [('all', 'Вся основная таблица')]
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.value() is None,
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': f'Последние {history.hot_months()} мес.',
+        }
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.value() == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        if self.value() != 'all':
+            return queryset.filter(recorded_at__gte=history.hot_cutoff())
+        return queryset
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Базовый класс для таблиц на миллионы строк: оценочный счетчик строк
+    и без второго COUNT(*) по всей таблице ради "показать все".
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def run_bulk(self, request, operation, queryset, *args):
+        """
+        Выполняет операцию из drugs.bulk над выборкой и сообщает итог.
+        Для выбора "все по фильтру" обновление идет частями по id, прогресс пишется в лог.
+        """
+        started = time.monotonic()
+        updated = operation(queryset, *args)
+        self.message_user(request, f'Обновлено записей: {updated} за {time.monotonic() - started:.1f} с')
 
 
 @admin.register(CustomUser)
@@ -43,9 +189,9 @@ class DrugAdmin(admin.ModelAdmin):
     """Административная панель для препаратов"""
     list_display = ('trade_name', 'mnn', 'form', 'dosage', 'manufacturer', 'created_at')
     list_filter = ('form', 'manufacturer', 'created_at')
-    search_fields = ('trade_name', 'mnn', 'manufacturer', 'atx_code')
+    search_fields = ('trade_name', 'mnn', 'manufacturer', 'atx_code', '=fingerprint')
     ordering = ('trade_name',)
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'fingerprint')
     fieldsets = (
         ('Основная информация', {
             'fields': ('trade_name', 'mnn', 'form', 'dosage', 'manufacturer')
@@ -54,16 +200,25 @@ class DrugAdmin(admin.ModelAdmin):
             'fields': ('atx_code', 'description')
         }),
         ('Системная информация', {
-            'fields': ('created_at', 'updated_at'),
+            'fields': ('fingerprint', 'created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
 
 
+@admin.register(City)
+class CityAdmin(admin.ModelAdmin):
+    """Административная панель для городов"""
+    list_display = ('name', 'normalized_name')
+    search_fields = ('name', 'normalized_name')
+    ordering = ('name',)
+    readonly_fields = ('normalized_name',)
+
+
 @admin.register(PharmacyNetwork)
 class PharmacyNetworkAdmin(admin.ModelAdmin):
     """Административная панель для аптечных сетей"""
-    list_display = ('name', 'website', 'phone', 'is_active')
+    list_display = ('name', 'website', 'phone', 'freshness_hours', 'is_active')
     list_filter = ('is_active',)
     search_fields = ('name', 'website', 'phone')
     ordering = ('name',)
@@ -74,22 +229,61 @@ class PharmacyAdmin(admin.ModelAdmin):
     """Административная панель для аптек"""
     list_display = ('name', 'network', 'city', 'address', 'phone')
     list_filter = ('network', 'city')
-    search_fields = ('name', 'address', 'city', 'phone')
-    ordering = ('city', 'name')
+    search_fields = ('name', 'address', 'city__name', 'phone')
+    ordering = ('city__name', 'name')
     raw_id_fields = ('network',)
+    list_select_related = ('network', 'city')
 
 
 @admin.register(Availability)
-class AvailabilityAdmin(admin.ModelAdmin):
+class AvailabilityAdmin(LargeTableAdmin):
     """Административная панель для наличия препаратов"""
     list_display = ('drug', 'pharmacy', 'price', 'quantity', 'is_available', 'last_updated')
-    list_filter = ('is_available', 'last_updated', 'pharmacy__city')
-    search_fields = ('drug__trade_name', 'drug__mnn', 'pharmacy__name', 'pharmacy__city')
+    list_filter = ('is_available', 'last_updated', PharmacyCityListFilter, PharmacyNetworkListFilter)
+    list_select_related = ('drug', 'pharmacy')
+    actions = ('adjust_prices', 'mark_in_stock', 'mark_out_of_stock')
+    search_fields = ('drug__trade_name', 'drug__mnn', 'pharmacy__name', 'pharmacy__city__name')
     ordering = ('-last_updated',)
     raw_id_fields = ('drug', 'pharmacy')
     readonly_fields = ('last_updated',)
     list_editable = ('price', 'quantity', 'is_available')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Ручная правка цены тоже попадает в историю
+        if 'price' in form.changed_data:
+            PriceHistory.objects.create(availability=obj, price=obj.price)
+
+    @admin.action(description='Изменить цены на процент', permissions=['change'])
+    def adjust_prices(self, request, queryset):
+        form = PriceAdjustmentForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            self.run_bulk(request, bulk.adjust_prices, queryset, form.cleaned_data['percent'])
+            return None
+
+        select_across = request.POST.get('select_across') == '1'
+        selected = request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)
+        return TemplateResponse(request, 'admin/drugs/availability/adjust_prices.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Изменение цен',
+            'opts': self.model._meta,
+            'form': form,
+            'selection_count': queryset.count() if select_across else len(selected),
+            # Django требует отмеченные строки даже при выборе "все по фильтру"
+            'selected': selected,
+            'select_across': '1' if select_across else '0',
+            'action': 'adjust_prices',
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
+    @admin.action(description='Отметить: в наличии', permissions=['change'])
+    def mark_in_stock(self, request, queryset):
+        self.run_bulk(request, bulk.set_in_stock, queryset, True)
+
+    @admin.action(description='Отметить: нет в наличии', permissions=['change'])
+    def mark_out_of_stock(self, request, queryset):
+        self.run_bulk(request, bulk.set_in_stock, queryset, False)
+
 
 @admin.register(Analogue)
 class AnalogueAdmin(admin.ModelAdmin):
@@ -103,24 +297,115 @@ class AnalogueAdmin(admin.ModelAdmin):
 
 
 @admin.register(PriceHistory)
-class PriceHistoryAdmin(admin.ModelAdmin):
+class PriceHistoryAdmin(LargeTableAdmin):
     """Административная панель для истории цен"""
     list_display = ('availability', 'price', 'recorded_at')
-    list_filter = ('recorded_at',)
+    # date_hierarchy не используется: он строит список лет/месяцев через
+    # DISTINCT по всей таблице; фильтр по дате дает те же срезы без запросов
+    list_filter = (RecordedPeriodListFilter, 'recorded_at')
     search_fields = ('availability__drug__trade_name', 'availability__pharmacy__name')
     ordering = ('-recorded_at',)
     raw_id_fields = ('availability',)
     readonly_fields = ('recorded_at',)
-    date_hierarchy = 'recorded_at'
+    list_select_related = ('availability__drug', 'availability__pharmacy')
 
 
 @admin.register(UserSubscription)
-class UserSubscriptionAdmin(admin.ModelAdmin):
+class UserSubscriptionAdmin(LargeTableAdmin):
     """Административная панель для подписок пользователей"""
     list_display = ('user', 'drug', 'city', 'max_price', 'is_active', 'created_at')
-    list_filter = ('is_active', 'created_at', 'city')
-    search_fields = ('user__email', 'user__first_name', 'user__last_name', 'drug__trade_name', 'drug__mnn', 'city')
+    list_filter = ('is_active', 'created_at', CityListFilter)
+    search_fields = ('user__email', 'user__first_name', 'user__last_name', 'drug__trade_name', 'drug__mnn', 'city__name')
     ordering = ('-created_at',)
     raw_id_fields = ('user', 'drug')
+    list_select_related = ('user', 'drug', 'city')
     readonly_fields = ('created_at',)
-    list_editable = ('is_active',)
\ No newline at end of file
+    list_editable = ('is_active',)
+    actions = ('activate_subscriptions', 'deactivate_subscriptions')
+
+    @admin.action(description='Включить выбранные подписки', permissions=['change'])
+    def activate_subscriptions(self, request, queryset):
+        self.run_bulk(request, bulk.set_subscriptions_active, queryset, True)
+
+    @admin.action(description='Отключить выбранные подписки', permissions=['change'])
+    def deactivate_subscriptions(self, request, queryset):
+        self.run_bulk(request, bulk.set_subscriptions_active, queryset, False)
+
+@admin.register(NetworkFeed)
+class NetworkFeedAdmin(admin.ModelAdmin):
+    """Административная панель для выгрузок сетей (планировщик drugs.feeds)"""
+    list_display = ('network', 'url', 'source', 'interval_minutes', 'priority', 'rate_limit', 'next_run_at', 'locked_until', 'is_active')
+    list_filter = ('is_active',)
+    search_fields = ('network__name', 'url')
+    ordering = ('priority', 'network__name')
+    raw_id_fields = ('network',)
+    list_select_related = ('network',)
+    readonly_fields = ('locked_until', 'locked_by')
+
+
+@admin.register(FeedRun)
+class FeedRunAdmin(admin.ModelAdmin):
+    """Административная панель для загрузок выгрузок"""
+    list_display = ('feed', 'status', 'started_at', 'finished_at', 'rows', 'rejected', 'speed', 'lag_seconds')
+    list_filter = ('status', 'started_at')
+    search_fields = ('feed__network__name',)
+    ordering = ('-started_at',)
+    list_select_related = ('feed__network',)
+    readonly_fields = ('feed', 'status', 'scheduled_at', 'started_at', 'finished_at', 'rows', 'rejected', 'error')
+
+    @admin.display(description='Строк/с')
+    def speed(self, obj):
+        return f'{obj.rows_per_second:.0f}'
+
+    @admin.display(description='Задержка, с')
+    def lag_seconds(self, obj):
+        return f'{obj.lag:.0f}'
+
+
+@admin.register(ExternalId)
+class ExternalIdAdmin(LargeTableAdmin):
+    """Административная панель для внешних кодов препаратов и аптек"""
+    list_display = ('source', 'kind', 'code', 'drug', 'pharmacy', 'created_at')
+    list_filter = ('source', 'kind')
+    search_fields = ('code', 'drug__trade_name', 'pharmacy__name')
+    ordering = ('source', 'kind', 'code')
+    raw_id_fields = ('drug', 'pharmacy')
+    list_select_related = ('drug', 'pharmacy')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(UnmatchedCode)
+class UnmatchedCodeAdmin(admin.ModelAdmin):
+    """Коды из загрузок без соответствия (сверка: reconcile_external_ids)"""
+    list_display = ('source', 'kind', 'code', 'rows', 'first_seen', 'last_seen')
+    list_filter = ('source', 'kind')
+    search_fields = ('code',)
+    ordering = ('-rows',)
+    readonly_fields = ('source', 'kind', 'code', 'rows', 'first_seen', 'last_seen')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(PartnerToken)
+class PartnerTokenAdmin(admin.ModelAdmin):
+    """Ключи партнеров: выпускаются командой issue_partner_token, здесь - просмотр и отключение"""
+    list_display = ('name', 'network', 'source', 'prefix', 'is_active', 'created_at', 'last_used_at')
+    list_filter = ('is_active',)
+    search_fields = ('name', 'network__name', 'source', 'prefix')
+    ordering = ('network__name', 'name')
+    list_select_related = ('network',)
+    readonly_fields = ('network', 'source', 'prefix', 'key_hash', 'created_at', 'last_used_at')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(IngestBatch)
+class IngestBatchAdmin(LargeTableAdmin):
+    """Принятые пачки остатков от партнеров"""
+    list_display = ('token', 'key', 'created_at', 'rows', 'rejected')
+    search_fields = ('key', 'token__name')
+    ordering = ('-created_at',)
+    list_select_related = ('token__network',)
+    readonly_fields = ('token', 'key', 'created_at', 'rows', 'rejected', 'response')
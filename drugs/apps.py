@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class DrugsConfig(AppConfig):
     name = 'drugs'
+
+    def ready(self):
+        from . import instrumentation
+        from . import signals  # noqa: F401
+
+        if instrumentation.is_enabled():
+            instrumentation.install()
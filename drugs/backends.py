@@ -1,17 +1,79 @@
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.conf import settings
+
+
+class LoginThrottle:
+    """
+    Ограничение частоты попыток входа по IP и по паре (аккаунт, IP) (счетчики
+    в кэше). Проверка выполняется до хэширования пароля, поэтому перебор паролей
+    не нагружает CPU работой PBKDF2. Счетчик аккаунта общий для всех IP только
+    без запроса (IP неизвестен): иначе любой, кто знает email, блокировал бы
+    вход владельцу несколькими неверными паролями.
+    """
+
+    def __init__(self, request, email):
+        self.window = getattr(settings, 'LOGIN_THROTTLE_WINDOW', 300)
+        self.keys = []
+        ip = request.META.get('REMOTE_ADDR') if request is not None else None
+        if ip:
+            self.keys.append((f'login-throttle:ip:{ip}', getattr(settings, 'LOGIN_THROTTLE_IP_LIMIT', 20)))
+        if email:
+            self.account_key = f'login-throttle:account:{email}:{ip}' if ip else f'login-throttle:account:{email}'
+            self.keys.append((self.account_key, getattr(settings, 'LOGIN_THROTTLE_ACCOUNT_LIMIT', 5)))
+        else:
+            self.account_key = None
+
+    def is_blocked(self):
+        counters = cache.get_many([key for key, limit in self.keys])
+        return any(counters.get(key, 0) >= limit for key, limit in self.keys)
+
+    def register_failure(self):
+        for key, limit in self.keys:
+            # add создает счетчик с таймаутом окна, incr не продлевает его
+            if not cache.add(key, 1, self.window):
+                try:
+                    cache.incr(key)
+                except ValueError:
+                    cache.set(key, 1, self.window)
+
+    def reset_account(self):
+        if self.account_key:
+            cache.delete(self.account_key)
 
 
 class EmailBackend(ModelBackend):
     """Кастомный backend аутентификации по email"""
-    
+
     def authenticate(self, request, username=None, password=None, **kwargs):
         UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        # Email хранится в нижнем регистре, поиск идет по уникальному индексу
+        email = UserModel.objects.normalize_email(username)
+        throttle = LoginThrottle(request, email)
+        if throttle.is_blocked():
+            if request is not None:
+                request.login_throttled = True
+            # PermissionDenied останавливает перебор остальных backend'ов
+            raise PermissionDenied
+
         try:
-            user = UserModel.objects.get(email=username)
+            user = UserModel.objects.get(email=email)
         except UserModel.DoesNotExist:
+            # Хэшируем пароль и для несуществующего пользователя, чтобы время
+            # ответа не выдавало, зарегистрирован ли email
+            UserModel().set_password(password)
+            throttle.register_failure()
             return None
-        else:
-            if user.check_password(password) and self.user_can_authenticate(user):
-                return user
+
+        if user.check_password(password) and self.user_can_authenticate(user):
+            throttle.reset_account()
+            return user
+        throttle.register_failure()
         return None
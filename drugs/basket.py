@@ -0,0 +1,281 @@
+import heapq
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Analogue, Availability
+
+INF = float('inf')
+
+# Сколько препаратов можно положить в одну корзину
+BASKET_MAX_ITEMS = 20
+
+# До скольких позиций ищется разбиение на две аптеки: перебор подмножеств
+# растет как 2^(позиций в аптеке), для больших корзин - только одна аптека
+BASKET_SPLIT_MAX_ITEMS = 8
+
+# Сколько самых дешевых аптек по каждой позиции участвует в поиске пары:
+# перебор подмножеств идет по ним, а не по всем аптекам города
+BASKET_SPLIT_CANDIDATES = 10
+
+
+class CityPriceMatrix:
+    """
+    Матрица цен "аптека × препарат" одного города в компактном виде.
+
+    Аптеки пронумерованы (pharmacy_ids[i] - id аптеки с индексом i). По каждому
+    препарату хранятся два параллельных массива: индексы аптек (array('I'))
+    и цены (array('d')). Матрица разреженная: память пропорциональна числу
+    предложений, а не произведению аптек на препараты.
+    """
+
+    def __init__(self, city_id):
+        self.city_id = city_id
+        self.built_at = time.monotonic()
+        self.pharmacy_ids = []
+        self.columns = {}
+
+        index = {}
+        rows = Availability.objects.filter(
+            pharmacy__city_id=city_id,
+            is_available=True,
+        ).order_by('drug_id', 'pharmacy_id').values_list('drug_id', 'pharmacy_id', 'price')
+        for drug_id, pharmacy_id, price in rows.iterator(chunk_size=5000):
+            position = index.get(pharmacy_id)
+            if position is None:
+                position = index[pharmacy_id] = len(self.pharmacy_ids)
+                self.pharmacy_ids.append(pharmacy_id)
+            column = self.columns.get(drug_id)
+            if column is None:
+                column = self.columns[drug_id] = (array('I'), array('d'))
+            column[0].append(position)
+            column[1].append(float(price))
+
+    def item_prices(self, alternatives):
+        """
+        Цены позиции корзины по аптекам: {индекс аптеки: (цена, id препарата)}.
+        Позицию закрывает любой из alternatives (препарат или его аналоги) -
+        берется самый дешевый в этой аптеке.
+        """
+        prices = {}
+        for drug_id in alternatives:
+            column = self.columns.get(drug_id)
+            if column is None:
+                continue
+            for position, price in zip(*column):
+                current = prices.get(position)
+                if current is None or price < current[0]:
+                    prices[position] = (price, drug_id)
+        return prices
+
+
+class MatrixCache:
+    """Матрицы цен по городам в памяти процесса (LRU, с временем жизни)"""
+
+    def __init__(self):
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, city_id):
+        ttl = getattr(settings, 'BASKET_MATRIX_TTL', 300)
+        with self._lock:
+            matrix = self._matrices.get(city_id)
+            if matrix is not None and time.monotonic() - matrix.built_at < ttl:
+                self._matrices.move_to_end(city_id)
+                return matrix
+        matrix = CityPriceMatrix(city_id)
+        with self._lock:
+            self._matrices[city_id] = matrix
+            while len(self._matrices) > getattr(settings, 'BASKET_MATRIX_CITIES', 50):
+                self._matrices.popitem(last=False)
+        return matrix
+
+    def clear(self):
+        with self._lock:
+            self._matrices.clear()
+
+
+matrices = MatrixCache()
+
+
+def analogue_groups(drug_ids):
+    """{id препарата: множество id, которыми его можно заменить (включая сам препарат)}"""
+    groups = {drug_id: {drug_id} for drug_id in drug_ids}
+    for original_id, analogue_id in Analogue.objects.filter(is_active=True).filter(
+        Q(original_id__in=drug_ids) | Q(analogue_id__in=drug_ids)
+    ).values_list('original_id', 'analogue_id'):
+        if original_id in groups:
+            groups[original_id].add(analogue_id)
+        if analogue_id in groups:
+            groups[analogue_id].add(original_id)
+    return groups
+
+
+def _best_by_subset(vectors):
+    """
+    Для каждого подмножества позиций корзины (битовая маска) - самая дешевая
+    аптека, где есть все позиции подмножества: (суммы, аптеки) по маскам.
+
+    Каждая аптека перебирает только подмножества своих позиций, суммы строятся
+    удвоением списка (2^c сложений для аптеки с c позициями корзины).
+    """
+    holdings = {}
+    for bit, prices in enumerate(vectors):
+        for position, (price, drug_id) in prices.items():
+            holdings.setdefault(position, []).append((1 << bit, price))
+
+    size = 1 << len(vectors)
+    best = [INF] * size
+    owner = [None] * size
+    for position, items in holdings.items():
+        sums = [0.0]
+        masks = [0]
+        for bit, price in items:
+            sums += [value + price for value in sums]
+            masks += [mask | bit for mask in masks]
+        for mask, value in zip(masks, sums):
+            if value < best[mask]:
+                best[mask] = value
+                owner[mask] = position
+    return best, owner
+
+
+def _single(vectors):
+    """Самая дешевая аптека со всей корзиной без перебора подмножеств: (сумма, аптека) или None"""
+    best = None
+    for position in min(vectors, key=len):
+        total = 0.0
+        for prices in vectors:
+            offer = prices.get(position)
+            if offer is None:
+                break
+            total += offer[0]
+        else:
+            if best is None or total < best[0]:
+                best = (total, position)
+    return best
+
+
+def _candidates(vectors, per_item):
+    """
+    Аптеки для поиска пары: по каждой позиции per_item самых дешевых, без
+    аптек, которые другая аптека из этого набора перекрывает целиком (есть
+    все их позиции, и каждая не дороже). Пара, в которой нет аптеки из
+    первых per_item ни по одной позиции, не рассматривается - на реальных
+    ценах (дешевые аптеки дешевы по многим позициям) такая пара практически не бывает
+    лучшей, а перебор по всем аптекам города занимает сотни миллисекунд.
+    """
+    selected = set()
+    for prices in vectors:
+        selected.update(heapq.nsmallest(per_item, prices, key=lambda position: prices[position][0]))
+    profiles = {
+        position: tuple(prices[position][0] if position in prices else INF for prices in vectors)
+        for position in selected
+    }
+    # Перекрыть аптеку может только аптека с не большей суммой (отсутствующая
+    # позиция считается дороже любой цены): проверяются по возрастанию суммы
+    missing = max(price for profile in profiles.values() for price in profile if price < INF) + 1
+    ordered = sorted(profiles, key=lambda position: (
+        sum(min(price, missing) for price in profiles[position]), position,
+    ))
+    kept = []
+    for position in ordered:
+        profile = profiles[position]
+        if not any(all(a <= b for a, b in zip(profiles[other], profile)) for other in kept):
+            kept.append(position)
+    return set(kept)
+
+
+def _plan(vectors, split, per_item=BASKET_SPLIT_CANDIDATES):
+    """
+    Самая дешевая аптека со всей корзиной и самая дешевая пара аптек.
+
+    Пара (A, B) с покупкой каждой позиции там, где дешевле, стоит не меньше
+    best[S] + best[~S] для S - позиций, купленных в A; и эта сумма достигается.
+    Поэтому минимум по всем разбиениям масок дает точный оптимум без перебора пар.
+    Пара ищется среди _candidates (per_item=None - среди всех аптек, точно),
+    single - всегда среди всех.
+    Возвращает (single, pair): (сумма, аптека) и (сумма, аптека A, аптека B) или None.
+    """
+    single = _single(vectors)
+    if not split:
+        return single, None
+
+    if per_item is not None:
+        selected = _candidates(vectors, per_item)
+        vectors = [
+            {position: offer for position, offer in prices.items() if position in selected}
+            for prices in vectors
+        ]
+    best, owner = _best_by_subset(vectors)
+    full = len(best) - 1
+    pair = None
+    limit = single[0] if single is not None else INF
+    for mask in range(1, full):
+        total = best[mask] + best[full ^ mask]
+        # Одна и та же аптека в обеих частях - это не дешевле single
+        if total < limit and owner[mask] != owner[full ^ mask]:
+            limit = total
+            pair = (total, owner[mask], owner[full ^ mask])
+    return single, pair
+
+
+def optimize(city_id, drug_ids, allow_analogues=False):
+    """
+    Подбор аптек для корзины препаратов в городе.
+
+    Возвращает словарь:
+      single  - самая дешевая аптека со всей корзиной: {'total', 'pharmacy_id', 'items'} или None;
+      split   - самая дешевая пара аптек, если она дешевле single (ищется для корзин
+                до BASKET_SPLIT_MAX_ITEMS позиций): {'total', 'pharmacy_ids', 'items'} или None;
+      missing - id препаратов, которых (с аналогами) нет ни в одной аптеке города.
+    items - [{'drug_id': запрошенный, 'chosen_drug_id': купленный, 'pharmacy_id', 'price'}].
+    """
+    matrix = matrices.get(city_id)
+    groups = analogue_groups(drug_ids) if allow_analogues else {drug_id: {drug_id} for drug_id in drug_ids}
+    vectors = [matrix.item_prices(groups[drug_id]) for drug_id in drug_ids]
+
+    result = {'single': None, 'split': None, 'missing': [
+        drug_id for drug_id, prices in zip(drug_ids, vectors) if not prices
+    ]}
+    if result['missing'] or not vectors:
+        return result
+
+    def items(positions):
+        chosen = []
+        for drug_id, prices in zip(drug_ids, vectors):
+            price, chosen_drug_id, position = min(
+                prices[position] + (position,) for position in positions if position in prices
+            )
+            chosen.append({
+                'drug_id': drug_id,
+                'chosen_drug_id': chosen_drug_id,
+                'pharmacy_id': matrix.pharmacy_ids[position],
+                'price': Decimal(str(price)).quantize(Decimal('0.01')),
+            })
+        return chosen
+
+    def total(chosen):
+        return sum((item['price'] for item in chosen), Decimal('0.00'))
+
+    single, split = _plan(vectors, split=1 < len(drug_ids) <= BASKET_SPLIT_MAX_ITEMS)
+    if single is not None:
+        chosen = items([single[1]])
+        result['single'] = {
+            'total': total(chosen),
+            'pharmacy_id': matrix.pharmacy_ids[single[1]],
+            'items': chosen,
+        }
+    if split is not None:
+        chosen = items(split[1:])
+        result['split'] = {
+            'total': total(chosen),
+            'pharmacy_ids': [matrix.pharmacy_ids[position] for position in split[1:]],
+            'items': chosen,
+        }
+    return result
@@ -0,0 +1,152 @@
+import logging
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.db.models import DateTimeField, DecimalField, ExpressionWrapper, F, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from . import outbox
+from .freshness import stale_querysets
+from .models import Availability, AvailabilityEvent, PriceHistory, UserSubscription
+from .signals import availability_bulk_changed
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк обновляется одним UPDATE: короткие транзакции не блокируют
+# таблицу надолго, а прогресс виден по ходу выполнения
+CHUNK_SIZE = 5000
+
+# Цена после снижения не опускается ниже копейки
+MIN_PRICE = Decimal('0.01')
+
+
+def iter_id_ranges(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Делит выборку на диапазоны id по chunk_size строк: (первый id, последний id, строк).
+    Идентификаторы читаются одним потоковым запросом.
+    """
+    ids = queryset.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size)
+    chunk = []
+    for object_id in ids:
+        chunk.append(object_id)
+        if len(chunk) == chunk_size:
+            yield chunk[0], chunk[-1], len(chunk)
+            chunk = []
+    if chunk:
+        yield chunk[0], chunk[-1], len(chunk)
+
+
+def _run_chunked(queryset, apply, progress=None, chunk_size=CHUNK_SIZE):
+    """
+    Применяет apply(часть выборки) к каждому диапазону id в отдельной транзакции.
+    progress(обработано, всего) вызывается после каждой части.
+    """
+    using = router.db_for_write(queryset.model)
+    queryset = queryset.using(using)
+    total = queryset.count()
+    done = updated = 0
+    for first_id, last_id, size in iter_id_ranges(queryset, chunk_size):
+        with transaction.atomic(using=using):
+            updated += apply(queryset.filter(id__gte=first_id, id__lte=last_id))
+        done += size
+        logger.info('%s: обработано %s из %s', queryset.model.__name__, done, total)
+        if progress:
+            progress(done, total)
+    return updated
+
+
+def record_price_history(queryset, recorded_at=None):
+    """
+    Записывает текущие цены выборки Availability в PriceHistory
+    одним INSERT ... SELECT, без чтения строк в Python.
+    """
+    recorded_at = recorded_at or timezone.now()
+    select = queryset.order_by().annotate(
+        recorded=Value(recorded_at, output_field=DateTimeField())
+    ).values('id', 'price', 'recorded')
+    sql, params = select.query.sql_with_params()
+    history = PriceHistory._meta
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {history.db_table} (availability_id, price, recorded_at) {sql}',
+            params,
+        )
+        return cursor.rowcount
+
+
+def _drug_ids(queryset):
+    return set(queryset.order_by().values_list('drug_id', flat=True).distinct())
+
+
+def adjust_prices(queryset, percent, progress=None):
+    """
+    Меняет цены выборки Availability на percent процентов (отрицательное значение - скидка).
+    Новые цены записываются в историю и журнал изменений (drugs.outbox),
+    кэши получают сигнал availability_bulk_changed.
+    Возвращает количество обновленных строк.
+    """
+    factor = Decimal(100 + percent) / 100
+    new_price = Greatest(
+        Round(
+            ExpressionWrapper(F('price') * factor, output_field=DecimalField(max_digits=10, decimal_places=2)),
+            2,
+        ),
+        Value(MIN_PRICE),
+    )
+    drug_ids = set()
+
+    def apply(chunk):
+        now = timezone.now()
+        drug_ids.update(_drug_ids(chunk))
+        outbox.record_queryset(chunk, AvailabilityEvent.PRICE_CHANGED, price=new_price, old_price=F('price'))
+        updated = chunk.update(price=new_price, last_updated=now)
+        record_price_history(chunk, recorded_at=now)
+        return updated
+
+    updated = _run_chunked(queryset, apply, progress)
+    availability_bulk_changed.send(sender=Availability, drug_ids=drug_ids)
+    return updated
+
+
+def set_in_stock(queryset, is_available, progress=None, touch=True):
+    """
+    Отмечает выборку Availability как имеющуюся/отсутствующую в наличии.
+    touch=False оставляет last_updated как есть (снятие устаревших предложений:
+    дата последнего обновления от аптеки не должна меняться).
+    """
+    drug_ids = set()
+
+    def apply(chunk):
+        chunk = chunk.exclude(is_available=is_available)
+        drug_ids.update(_drug_ids(chunk))
+        outbox.record_queryset(chunk, AvailabilityEvent.UPDATED, is_available=Value(is_available))
+        if touch:
+            return chunk.update(is_available=is_available, last_updated=timezone.now())
+        return chunk.update(is_available=is_available)
+
+    updated = _run_chunked(queryset, apply, progress)
+    availability_bulk_changed.send(sender=Availability, drug_ids=drug_ids)
+    return updated
+
+
+def sweep_stale(progress=None):
+    """
+    Снимает с наличия предложения, не обновлявшиеся дольше срока актуальности
+    своей сети (PharmacyNetwork.freshness_hours или STOCK_FRESHNESS_HOURS).
+    Возвращает количество снятых строк.
+    """
+    return sum(
+        set_in_stock(queryset, False, progress, touch=False)
+        for queryset in stale_querysets()
+    )
+
+
+def set_subscriptions_active(queryset, is_active, progress=None):
+    """Включает/отключает выборку подписок"""
+    assert queryset.model is UserSubscription
+    return _run_chunked(
+        queryset,
+        lambda chunk: chunk.exclude(is_active=is_active).update(is_active=is_active),
+        progress,
+    )
@@ -0,0 +1,343 @@
+import heapq
+import logging
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Avg, Count, Min, Q
+
+from . import outbox
+from .freshness import mark_stale
+from .models import Analogue, Availability, Drug, DrugCard
+from .routers import keep_pin, use_primary
+
+logger = logging.getLogger(__name__)
+
+# Сколько аналогов показывается на странице препарата
+ANALOGUES_LIMIT = 10
+
+# Сколько предложений показывается сразу; следующие подгружаются страницами
+# того же размера (drug_offers), поэтому карточка хранит по каждому городу
+# не больше OFFERS_PAGE_SIZE самых дешевых предложений
+OFFERS_PAGE_SIZE = 50
+
+# Версия формата данных: карточки старого формата пересобираются при чтении
+CARD_VERSION = 4
+
+# Сколько секунд после сохранения собранной при чтении карточки другие
+# чтения того же препарата ее не сохраняют (только отдают свою сборку)
+CARD_BUILD_LOCK_SECONDS = 30
+
+OFFER_FIELDS = (
+    'id', 'price', 'quantity', 'last_updated',
+    'pharmacy_id', 'pharmacy__name', 'pharmacy__address',
+    'pharmacy__city_id', 'pharmacy__city__name', 'pharmacy__network_id', 'pharmacy__network__name',
+)
+
+
+def _price(value):
+    return str(value) if value is not None else None
+
+
+def offers_queryset(drug_id):
+    """Предложения в наличии от дешевых к дорогим, строками values_list(*OFFER_FIELDS)"""
+    return Availability.objects.filter(
+        drug_id=drug_id,
+        is_available=True,
+    ).order_by('price', 'id').values_list(*OFFER_FIELDS)
+
+
+def offer_dict(row):
+    """Строка offers_queryset в виде, который ожидает шаблон строк таблицы"""
+    offer_id, price, quantity, last_updated, pharmacy_id, name, address, city_id, city, network_id, network = row
+    return {
+        'id': offer_id,
+        'price': price,
+        'quantity': quantity,
+        'last_updated': last_updated,
+        'pharmacy': {
+            'id': pharmacy_id,
+            'name': name,
+            'address': address,
+            'city_id': city_id,
+            'city': city,
+            'network': {'id': network_id, 'name': network} if network is not None else None,
+        },
+    }
+
+
+def encode_cursor(offer):
+    return f"{offer['price']}_{offer['id']}"
+
+
+def offer_page(drug_id, after=None, limit=OFFERS_PAGE_SIZE):
+    """
+    Страница предложений после курсора "цена_id" (keyset-пагинация по индексу
+    drug, is_available, price, id): стоимость не зависит от номера страницы.
+    Возвращает (предложения, курсор следующей страницы или None).
+    """
+    offers = offers_queryset(drug_id)
+    if after:
+        price, offer_id = after.rsplit('_', 1)
+        price, offer_id = Decimal(price), int(offer_id)
+        offers = offers.filter(Q(price__gt=price) | Q(price=price, id__gt=offer_id))
+    page = [offer_dict(row) for row in offers[:limit + 1]]
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return mark_stale(page[:limit]), next_cursor
+
+
+def analogue_ids(drug_id):
+    """Аналоги препарата (связь в обе стороны)"""
+    ids = set()
+    for original_id, analogue_id in Analogue.objects.filter(
+        Q(original_id=drug_id) | Q(analogue_id=drug_id)
+    ).values_list('original_id', 'analogue_id'):
+        ids.add(analogue_id if original_id == drug_id else original_id)
+    return ids
+
+
+def _cheapest_analogue(drug_id):
+    """
+    Самый дешевый активный аналог в наличии (не ниже ANALOGUE_MIN_SIMILARITY):
+    его предлагает страница препарата, которого нет в аптеках. При равной цене
+    выбирается более похожий. Возвращает словарь или None.
+    """
+    scores = {}
+    for original_id, partner_id, score in Analogue.objects.filter(
+        Q(original_id=drug_id) | Q(analogue_id=drug_id),
+        is_active=True,
+        similarity_score__gte=getattr(settings, 'ANALOGUE_MIN_SIMILARITY', 0.0),
+    ).values_list('original_id', 'analogue_id', 'similarity_score'):
+        scores[partner_id if original_id == drug_id else original_id] = score
+    if not scores:
+        return None
+
+    candidates = Drug.objects.filter(id__in=scores).annotate(
+        in_stock_price=Min('availability__price', filter=Q(availability__is_available=True))
+    ).filter(in_stock_price__isnull=False).values_list('id', 'trade_name', 'mnn', 'in_stock_price')
+    best = min(candidates, key=lambda row: (row[3], -scores[row[0]], row[0]), default=None)
+    if best is None:
+        return None
+    return {
+        'id': best[0],
+        'trade_name': best[1],
+        'mnn': best[2],
+        'min_price': _price(best[3].quantize(Decimal('0.01'))),
+        'similarity_score': scores[best[0]],
+    }
+
+
+def build_card(drug_id):
+    """
+    Собирает данные карточки: поля препарата, агрегаты цен, самые дешевые
+    предложения в наличии по городам (с общим числом предложений в городе)
+    аналоги с минимальной ценой и самый дешевый аналог в наличии.
+    Возвращает None, если препарата нет.
+    """
+    drug = Drug.objects.annotate(
+        min_price=Min('availability__price'),
+        avg_price=Avg('availability__price'),
+        pharmacy_count=Count('availability', distinct=True),
+    ).filter(id=drug_id).first()
+    if drug is None:
+        return None
+
+    cities = {}
+    offer_count = 0
+    for row in offers_queryset(drug_id).iterator(chunk_size=2000):
+        offer = offer_dict(row)
+        pharmacy = offer['pharmacy']
+        group = cities.setdefault(pharmacy['city_id'], {
+            'city_id': pharmacy['city_id'],
+            'city': pharmacy['city'],
+            'offer_count': 0,
+            'offers': [],
+        })
+        group['offer_count'] += 1
+        offer_count += 1
+        if len(group['offers']) < OFFERS_PAGE_SIZE:
+            offer['price'] = _price(offer['price'])
+            offer['last_updated'] = offer['last_updated'].isoformat()
+            group['offers'].append(offer)
+
+    analogues = []
+    ids = analogue_ids(drug_id)
+    if ids:
+        for analogue in Drug.objects.filter(id__in=ids).annotate(
+            min_price=Min('availability__price')
+        ).order_by('trade_name')[:ANALOGUES_LIMIT]:
+            analogues.append({
+                'id': analogue.id,
+                'trade_name': analogue.trade_name,
+                'mnn': analogue.mnn,
+                'min_price': _price(analogue.min_price),
+            })
+
+    cheapest_analogue = _cheapest_analogue(drug_id)
+
+    return {
+        'version': CARD_VERSION,
+        'drug': {
+            'id': drug.id,
+            'trade_name': drug.trade_name,
+            'mnn': drug.mnn,
+            'form': drug.form,
+            'dosage': drug.dosage,
+            'manufacturer': drug.manufacturer,
+            'atx_code': drug.atx_code,
+            'description': drug.description,
+            'created_at': drug.created_at.isoformat(),
+            'min_price': _price(drug.min_price),
+            'avg_price': _price(drug.avg_price),
+            'pharmacy_count': drug.pharmacy_count,
+            'offer_count': offer_count,
+        },
+        'cities': sorted(cities.values(), key=lambda group: group['city']),
+        'analogues': analogues,
+        'cheapest_analogue': cheapest_analogue,
+    }
+
+
+def rebuild_cards(drug_ids):
+    """Пересобирает карточки препаратов и сохраняет их одним upsert"""
+    cards = []
+    missing = []
+    for drug_id in drug_ids:
+        data = build_card(drug_id)
+        if data is None:
+            missing.append(drug_id)
+        else:
+            cards.append(DrugCard(drug_id=drug_id, data=data))
+    DrugCard.objects.bulk_create(
+        cards,
+        update_conflicts=True,
+        unique_fields=['drug'],
+        update_fields=['data', 'built_at'],
+    )
+    if missing:
+        DrugCard.objects.filter(drug_id__in=missing).delete()
+    return len(cards)
+
+
+def invalidate_cards(drug_ids):
+    """
+    Удаляет устаревшие карточки одним DELETE: самих препаратов и препаратов,
+    у которых они указаны аналогами (там показывается их минимальная цена).
+    drug_ids - список id или подзапрос .values('drug_id').
+    """
+    DrugCard.objects.filter(
+        Q(drug_id__in=drug_ids)
+        | Q(drug_id__in=Analogue.objects.filter(original_id__in=drug_ids).values('analogue_id'))
+        | Q(drug_id__in=Analogue.objects.filter(analogue_id__in=drug_ids).values('original_id'))
+    ).delete()
+
+
+def _rebuild_if_missing(drug_id):
+    # Несколько изменений одного препарата в транзакции дают одну сборку:
+    # следующие вызовы находят уже собранную карточку
+    with use_primary():
+        if not DrugCard.objects.filter(drug_id=drug_id).exists():
+            rebuild_cards([drug_id])
+
+
+def schedule_rebuild(drug_id):
+    """
+    Карточка удаляется в текущей транзакции (откатится вместе с ней),
+    а пересобирается после коммита. Если пересборка не успела, карточку
+    соберет первое чтение.
+    """
+    invalidate_cards([drug_id])
+    transaction.on_commit(lambda: _rebuild_if_missing(drug_id))
+
+
+@outbox.consumer('drug-cards')
+def rebuild_changed_cards(events):
+    """
+    Заранее пересобирает карточки препаратов из журнала изменений наличия:
+    массовые операции только удаляют карточки, и без этого их собирало бы первое чтение
+    """
+    drug_ids = {event.drug_id for event in events}
+    with use_primary():
+        existing = set(DrugCard.objects.filter(drug_id__in=drug_ids).values_list('drug_id', flat=True))
+        rebuild_cards(sorted(drug_ids - existing))
+
+
+def _store_card(drug_id, data):
+    """
+    Сохраняет собранную при чтении карточку. Сохраняет только одно из
+    параллельных чтений (блокировка в общем кэше), и запись не закрепляет
+    запрос за primary: иначе обычный просмотр страницы отправлял бы
+    следующие чтения клиента мимо реплик.
+    """
+    # Блокировка не снимается, а истекает: сохраненную карточку читают сами,
+    # а чтения, начавшиеся до сохранения, не перезаписывают ее повторно
+    if not cache.add(f'drug_card_build:{drug_id}', 1, CARD_BUILD_LOCK_SECONDS):
+        return
+    with keep_pin():
+        DrugCard.objects.bulk_create(
+            [DrugCard(drug_id=drug_id, data=data)],
+            update_conflicts=True,
+            unique_fields=['drug'],
+            update_fields=['data', 'built_at'],
+        )
+
+
+def get_card(drug_id):
+    """
+    Данные карточки одним чтением по ключу. Отсутствующая карточка собирается
+    на месте и отдается из этой сборки; сохраняется она для следующих чтений
+    (_store_card).
+    """
+    data = DrugCard.objects.filter(drug_id=drug_id).values_list('data', flat=True).first()
+    if data is None or data.get('version') != CARD_VERSION:
+        # Сборка читает primary: карточка с отстающей реплики осталась бы устаревшей
+        # до следующего изменения. use_primary не закрепляет за primary весь запрос.
+        with use_primary():
+            data = build_card(drug_id)
+        if data is not None:
+            _store_card(drug_id, data)
+    return data
+
+
+def card_context(data):
+    """Контекст шаблона drug_detail из данных карточки"""
+    drug = dict(data['drug'])
+    drug['created_at'] = datetime.fromisoformat(drug['created_at'])
+    for field in ('min_price', 'avg_price'):
+        if drug[field] is not None:
+            drug[field] = Decimal(drug[field])
+
+    # Цены - Decimal, как у полей модели (шаблон выводит их с локализацией).
+    # Устаревание зависит от времени чтения, поэтому отмечается здесь, а не при сборке
+    for group in data['cities']:
+        for offer in group['offers']:
+            offer['price'] = Decimal(offer['price'])
+            offer['last_updated'] = datetime.fromisoformat(offer['last_updated'])
+        mark_stale(group['offers'])
+    for analogue in data['analogues']:
+        if analogue['min_price'] is not None:
+            analogue['min_price'] = Decimal(analogue['min_price'])
+    cheapest_analogue = data['cheapest_analogue']
+    if cheapest_analogue is not None:
+        cheapest_analogue = dict(cheapest_analogue, min_price=Decimal(cheapest_analogue['min_price']))
+
+    # Первая страница - самые дешевые предложения всех городов; в каждом городе
+    # карточка хранит OFFERS_PAGE_SIZE первых, поэтому слияния достаточно
+    availabilities = list(islice(heapq.merge(
+        *(group['offers'] for group in data['cities']),
+        key=itemgetter('price', 'id'),
+    ), OFFERS_PAGE_SIZE))
+    has_more = drug['offer_count'] > len(availabilities)
+    return {
+        'drug': drug,
+        'cities': data['cities'],
+        'availabilities': availabilities,
+        'offer_count': drug['offer_count'],
+        'next_cursor': encode_cursor(availabilities[-1]) if has_more else None,
+        'analogues': data['analogues'],
+        'cheapest_analogue': cheapest_analogue,
+    }
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .models import Drug, Pharmacy, PharmacyNetwork
+
+logger = logging.getLogger(__name__)
+
+
+class Record:
+    """
+    Компактная запись каталога: только нужные поля в __slots__, без состояния модели.
+    Поля заполняются по порядку из строки values_list.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.id}>'
+
+
+class DrugRecord(Record):
+    __slots__ = ('id', 'trade_name', 'mnn', 'form', 'dosage', 'manufacturer')
+
+    def __str__(self):
+        return f"{self.trade_name} ({self.mnn})"
+
+
+class PharmacyRecord(Record):
+    # city - название города (как str(pharmacy.city) у модели)
+    __slots__ = ('id', 'name', 'address', 'city_id', 'city', 'network_id')
+
+    def __str__(self):
+        return f"{self.name} ({self.address})"
+
+
+class NetworkRecord(Record):
+    __slots__ = ('id', 'name')
+
+    def __str__(self):
+        return self.name
+
+
+class CatalogCache:
+    """
+    LRU-кэш строк справочной таблицы в памяти процесса.
+
+    Поиск по id не обращается ни к БД, ни к общему кэшу; промахи по нескольким
+    id догружаются одним запросом. Размер ограничен CATALOG_CACHE_SIZE записями.
+    Изменения в этом процессе сбрасывают кэш сразу (сигналы), другие процессы
+    узнают о них по счетчику версии в общем кэше, который проверяется не чаще
+    раза в CATALOG_VERSION_CHECK_SECONDS. Счетчик общий только с REDIS_URL;
+    в любом случае кэш сбрасывается раз в CATALOG_MAX_AGE_SECONDS.
+    """
+
+    def __init__(self, name, model, fields, record_class):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.record_class = record_class
+        self.version_key = f'catalog:version:{name}'
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self._cleared_at = time.monotonic()
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'CATALOG_CACHE_SIZE', 5000)
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < getattr(settings, 'CATALOG_VERSION_CHECK_SECONDS', 1):
+            return
+        self._checked_at = now
+        version = cache.get(self.version_key, 0)
+        # Без общего кэша (LocMemCache) версия из другого процесса сюда не
+        # доходит: записи все равно перечитываются не реже CATALOG_MAX_AGE_SECONDS
+        expired = now - self._cleared_at > getattr(settings, 'CATALOG_MAX_AGE_SECONDS', 300)
+        if version != self._version or expired:
+            with self._lock:
+                self._records.clear()
+            self._version = version
+            self._cleared_at = now
+
+    def _load(self, ids):
+        rows = self.model.objects.filter(id__in=ids).values_list(*self.fields)
+        return {row[0]: self.record_class(*row) for row in rows}
+
+    def _store(self, records):
+        with self._lock:
+            self._records.update(records)
+            while len(self._records) > self.maxsize:
+                self._records.popitem(last=False)
+
+    def get_many(self, ids):
+        """{id: запись} для найденных id"""
+        self._check_version()
+        found = {}
+        missing = []
+        with self._lock:
+            for object_id in ids:
+                record = self._records.get(object_id)
+                if record is None:
+                    missing.append(object_id)
+                else:
+                    self._records.move_to_end(object_id)
+                    found[object_id] = record
+        if missing:
+            loaded = self._load(missing)
+            self._store(loaded)
+            found.update(loaded)
+        return found
+
+    def get(self, object_id):
+        """Запись по id или None"""
+        return self.get_many([object_id]).get(object_id)
+
+    def warm(self):
+        """Загружает первые CATALOG_CACHE_SIZE строк таблицы"""
+        self._check_version()
+        rows = self.model.objects.order_by('id').values_list(*self.fields)[:self.maxsize]
+        self._store({row[0]: self.record_class(*row) for row in rows})
+
+    def invalidate(self):
+        """Сбрасывает кэш в этом процессе и увеличивает версию для остальных"""
+        with self._lock:
+            self._records.clear()
+        if not cache.add(self.version_key, 1, None):
+            try:
+                cache.incr(self.version_key)
+            except ValueError:
+                cache.set(self.version_key, 1, None)
+        self._version = cache.get(self.version_key)
+        self._checked_at = self._cleared_at = time.monotonic()
+
+
+drugs = CatalogCache(
+    'drugs', Drug,
+    ('id', 'trade_name', 'mnn', 'form', 'dosage', 'manufacturer'),
+    DrugRecord,
+)
+pharmacies = CatalogCache(
+    'pharmacies', Pharmacy,
+    ('id', 'name', 'address', 'city_id', 'city__name', 'network_id'),
+    PharmacyRecord,
+)
+networks = CatalogCache('networks', PharmacyNetwork, ('id', 'name'), NetworkRecord)
+
+
+def warm_all():
+    for catalog in (drugs, pharmacies, networks):
+        try:
+            catalog.warm()
+        except Exception as e:
+            # Например, база еще не мигрирована: кэш заполнится по мере запросов
+            logger.warning('Не удалось прогреть каталог %s: %s', catalog.name, e)
+    connections.close_all()
+
+
+def warm_on_start():
+    """
+    Прогрев каталога при старте воркера (asgi.py/wsgi.py). Выполняется в фоновом
+    потоке: под ASGI модуль приложения импортируется уже внутри event loop,
+    где синхронные запросы к БД запрещены, и старт не ждет загрузки.
+    """
+    if getattr(settings, 'CATALOG_WARM_ON_START', True):
+        threading.Thread(target=warm_all, name='catalog-warmup', daemon=True).start()
@@ -0,0 +1,172 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+
+from . import cards, history, outbox
+from .idmaps import external_ids
+from .models import (
+    Analogue, Availability, AvailabilityEvent, Drug, ExternalId, PriceHistory, UserSubscription,
+)
+from .normalization import fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Сколько препаратов пересчитывается одним bulk_update
+CHUNK_SIZE = 5000
+
+# Поля препарата, которые у основной карточки заполняются из дублей, если пусты
+FILL_FIELDS = ('atx_code', 'description')
+
+
+def refresh_fingerprints(chunk_size=CHUNK_SIZE):
+    """Пересчитывает Drug.fingerprint по текущим правилам нормализации; возвращает число измененных"""
+    changed = []
+    total = 0
+    rows = Drug.objects.values_list('id', 'fingerprint', 'trade_name', 'form', 'dosage', 'manufacturer')
+    for drug_id, current, *fields in rows.iterator(chunk_size=chunk_size):
+        key = fingerprint(*fields)
+        if key != current:
+            changed.append(Drug(id=drug_id, fingerprint=key))
+        if len(changed) == chunk_size:
+            Drug.objects.bulk_update(changed, ['fingerprint'])
+            total += len(changed)
+            changed = []
+    Drug.objects.bulk_update(changed, ['fingerprint'])
+    return total + len(changed)
+
+
+def duplicate_groups():
+    """Группы дублей: [id основного препарата, id дублей...] - основной с наименьшим id"""
+    keys = (
+        Drug.objects.exclude(fingerprint='').values('fingerprint')
+        .annotate(count=Count('id')).filter(count__gt=1).values_list('fingerprint', flat=True)
+    )
+    groups = {}
+    for key, drug_id in Drug.objects.filter(fingerprint__in=keys).order_by('id').values_list('fingerprint', 'id'):
+        groups.setdefault(key, []).append(drug_id)
+    return list(groups.values())
+
+
+def _replace(value, mapping):
+    return mapping.get(value, value)
+
+
+def _merge_availability(target_id, duplicate_ids):
+    """
+    Предложения дублей переходят к основному препарату. Если в аптеке есть
+    предложения нескольких препаратов группы, остается самое свежее, история
+    цен остальных переносится к нему (кроме уже выгруженной в архивные файлы -
+    там остаются id удаленных предложений).
+    """
+    group = [target_id, *duplicate_ids]
+    kept = {}
+    losers = {}
+    rows = Availability.objects.filter(drug_id__in=group).order_by('pharmacy_id', '-last_updated', 'id')
+    for availability_id, pharmacy_id in rows.values_list('id', 'pharmacy_id'):
+        if pharmacy_id in kept:
+            losers[availability_id] = kept[pharmacy_id]
+        else:
+            kept[pharmacy_id] = availability_id
+    if losers:
+        PriceHistory.objects.filter(availability_id__in=list(losers)).update(availability_id=Case(
+            *[When(availability_id=loser, then=Value(winner)) for loser, winner in losers.items()],
+            output_field=IntegerField(),
+        ))
+        # SQLite: старые месяцы лежат вне основной таблицы (drugs.history)
+        history.repoint_availability(losers)
+        # Удаление по одной строке с сигналами: события DELETED в журнале
+        Availability.objects.filter(id__in=list(losers)).delete()
+    moved = Availability.objects.filter(drug_id__in=duplicate_ids)
+    outbox.record_queryset(moved, AvailabilityEvent.UPDATED, drug_id=Value(target_id))
+    return moved.update(drug_id=target_id), len(losers)
+
+
+def _merge_analogues(target_id, duplicate_ids):
+    """
+    Связи аналогов дублей переходят к основному препарату. Связь препарата
+    группы с самим собой удаляется, из совпадающих связей остается одна
+    с наибольшим коэффициентом схожести (активна, если активна любая).
+    """
+    mapping = dict.fromkeys(duplicate_ids, target_id)
+    group = [target_id, *duplicate_ids]
+    rows = list(Analogue.objects.filter(Q(original_id__in=group) | Q(analogue_id__in=group)))
+    best = {}
+    for row in sorted(rows, key=lambda row: (-row.similarity_score, row.id)):
+        pair = (_replace(row.original_id, mapping), _replace(row.analogue_id, mapping))
+        if pair[0] == pair[1]:
+            continue
+        if pair in best:
+            best[pair][1] = best[pair][1] or row.is_active
+        else:
+            best[pair] = [row, row.is_active]
+    keep = {row.id for row, _ in best.values()}
+    Analogue.objects.filter(id__in=[row.id for row in rows if row.id not in keep]).delete()
+    for (original_id, analogue_id), (row, is_active) in best.items():
+        if (row.original_id, row.analogue_id, row.is_active) != (original_id, analogue_id, is_active):
+            Analogue.objects.filter(id=row.id).update(original_id=original_id, analogue_id=analogue_id, is_active=is_active)
+    return len(rows) - len(keep)
+
+
+def _merge_subscriptions(target_id, duplicate_ids):
+    """
+    Подписки на дубли переходят к основному препарату. Если пользователь
+    подписан в одном городе на несколько препаратов группы, остается одна
+    подписка: активна, если активна любая, с самой мягкой максимальной ценой
+    (без ограничения, если хотя бы у одной его нет).
+    """
+    group = [target_id, *duplicate_ids]
+    rows = UserSubscription.objects.filter(drug_id__in=group).order_by(
+        Case(When(drug_id=target_id, then=Value(0)), default=Value(1)), 'id',
+    )
+    merged = {}
+    for subscription in rows:
+        merged.setdefault((subscription.user_id, subscription.city_id), []).append(subscription)
+    removed = []
+    for subscriptions in merged.values():
+        kept, *others = subscriptions
+        if not others:
+            continue
+        active = [item for item in subscriptions if item.is_active] or subscriptions
+        prices = [item.max_price for item in active]
+        kept.is_active = any(item.is_active for item in subscriptions)
+        kept.max_price = None if None in prices else max(prices)
+        UserSubscription.objects.filter(id=kept.id).update(is_active=kept.is_active, max_price=kept.max_price)
+        removed.extend(item.id for item in others)
+    UserSubscription.objects.filter(id__in=removed).delete()
+    UserSubscription.objects.filter(drug_id__in=duplicate_ids).update(drug_id=target_id)
+    return len(removed)
+
+
+def merge_drugs(target_id, duplicate_ids):
+    """
+    Объединяет дубли с основным препаратом в одной транзакции: предложения
+    (с историей цен), аналоги, подписки и внешние коды переходят к нему,
+    пустые поля основной карточки заполняются из дублей, дубли удаляются.
+    Возвращает статистику: сколько предложений перенесено и сколько связей удалено.
+    """
+    duplicate_ids = [drug_id for drug_id in duplicate_ids if drug_id != target_id]
+    with transaction.atomic():
+        target = Drug.objects.select_for_update().get(id=target_id)
+        duplicates = list(Drug.objects.select_for_update().filter(id__in=duplicate_ids).order_by('id'))
+        moved, collapsed = _merge_availability(target_id, duplicate_ids)
+        stats = {
+            'availability': moved,
+            'availability_collapsed': collapsed,
+            'analogues_removed': _merge_analogues(target_id, duplicate_ids),
+            'subscriptions_removed': _merge_subscriptions(target_id, duplicate_ids),
+            'external_ids': ExternalId.objects.filter(drug_id__in=duplicate_ids).update(drug_id=target_id),
+        }
+        empty = [name for name in FILL_FIELDS if not getattr(target, name)]
+        for name in empty:
+            value = next((getattr(drug, name) for drug in duplicates if getattr(drug, name)), None)
+            if value:
+                setattr(target, name, value)
+        if empty:
+            target.save()
+        # Карточки дублей удаляются вместе с ними, карточка основного и его аналогов - здесь
+        cards.invalidate_cards([target_id])
+        Drug.objects.filter(id__in=duplicate_ids).delete()
+        transaction.on_commit(external_ids.invalidate)
+    logger.info('Препарат %s: объединены дубли %s (%s)', target_id, duplicate_ids, stats)
+    return stats
@@ -0,0 +1,294 @@
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import ingest
+from .idmaps import external_ids, record_unmatched
+from .models import FeedRun, NetworkFeed
+
+logger = logging.getLogger(__name__)
+
+# Сколько ошибок строк сохраняется в FeedRun.error
+ERRORS_KEPT = 20
+
+
+class LeaseLost(Exception):
+    """Блокировка сети истекла и перехвачена другим обработчиком: загрузка прерывается"""
+
+
+class TokenBucket:
+    """
+    Ограничение скорости записи строк/с. Запас - одна секунда: пачка больше
+    него просто ждет дольше. rate=0 или None - без ограничения.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate or 0)
+        self.updated = time.monotonic()
+
+    def take(self, count):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, float(self.rate))
+        self.updated = now
+        self.tokens -= count
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+
+def lease_seconds():
+    return getattr(settings, 'FEED_LEASE_SECONDS', 300)
+
+
+def owner_name():
+    """Уникальное имя обработчика для поля NetworkFeed.locked_by"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def acquire(feed_id, owner, now=None):
+    """
+    Блокирует сеть за обработчиком owner на FEED_LEASE_SECONDS: условный UPDATE
+    проходит, только если блокировки нет или она истекла. Атомарен в любой СУБД
+    и между процессами, поэтому две загрузки одной сети не пересекаются.
+    """
+    now = now or timezone.now()
+    return NetworkFeed.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+        id=feed_id,
+    ).update(locked_until=now + timedelta(seconds=lease_seconds()), locked_by=owner) == 1
+
+
+def renew(feed_id, owner):
+    """Продлевает блокировку перед каждой пачкой; False - блокировка потеряна"""
+    return NetworkFeed.objects.filter(id=feed_id, locked_by=owner).update(
+        locked_until=timezone.now() + timedelta(seconds=lease_seconds()),
+    ) == 1
+
+
+def release(feed_id, owner, next_run_at):
+    NetworkFeed.objects.filter(id=feed_id, locked_by=owner).update(
+        locked_until=None, locked_by='', next_run_at=next_run_at,
+    )
+
+
+def due_feeds(now=None, exclude=()):
+    """
+    Загрузки, время которых подошло, в порядке очереди: по приоритету, затем
+    по времени в расписании. Загрузка, просроченная больше чем на свой интервал,
+    поднимается в начало очереди независимо от приоритета - низкоприоритетные
+    сети не голодают за высокоприоритетными.
+    """
+    now = now or timezone.now()
+    feeds = list(
+        NetworkFeed.objects.filter(is_active=True, network__is_active=True, next_run_at__lte=now)
+        .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+        .exclude(id__in=list(exclude))
+        .only('id', 'network_id', 'priority', 'interval_minutes', 'next_run_at')
+    )
+
+    def key(feed):
+        starving = now - feed.next_run_at > timedelta(minutes=feed.interval_minutes)
+        return (0 if starving else 1, feed.priority, feed.next_run_at)
+
+    return sorted(feeds, key=key)
+
+
+def _next_run(feed, scheduled_at, failed, now):
+    interval = timedelta(minutes=feed.interval_minutes)
+    if failed:
+        retry = timedelta(minutes=getattr(settings, 'FEED_RETRY_MINUTES', 5))
+        return now + min(retry, interval)
+    # По расписанию, а если загрузка шла дольше интервала - через интервал от конца
+    next_run_at = scheduled_at + interval
+    return next_run_at if next_run_at > now else now + interval
+
+
+def _load(feed, run, owner, batch_size):
+    """
+    Читает выгрузку построчно и применяет пачками; счетчики пишет в run.
+    При ограничении скорости пачка уменьшается до rate * FEED_LEASE_SECONDS / 2 строк.
+    Если у выгрузки указан источник кодов, словарь кодов загружается
+    заранее целиком (drugs.idmaps), коды без соответствия попадают в сверку.
+    """
+    rate = feed.rate_limit or getattr(settings, 'FEED_DEFAULT_RATE_LIMIT', 0)
+    bucket = TokenBucket(rate)
+    if rate:
+        # Ожидание после пачки (пачка / rate) не дольше половины блокировки:
+        # иначе блокировка истечет между продлениями и сеть заберет другой обработчик
+        batch_size = max(1, min(batch_size, int(rate * lease_seconds() / 2)))
+    using = router.db_for_write(FeedRun)
+    source_map = external_ids.get(feed.source) if feed.source else None
+    parse = ingest.parse_code_row if source_map is not None else ingest.parse_id_row
+    unmatched = Counter()
+    errors = []
+    rows = []
+
+    def flush():
+        with transaction.atomic(using=using):
+            # Продление в той же транзакции, что и запись: пачка не применится,
+            # если сеть уже загружает другой обработчик
+            if not renew(feed.id, owner):
+                raise LeaseLost(f'Блокировка выгрузки {feed.id} потеряна')
+            if source_map is not None:
+                offers = ingest.resolve_codes(rows, feed.network_id, source_map, errors, unmatched)
+            else:
+                offers = ingest.resolve_ids(rows, feed.network_id, errors)
+            if offers:
+                ingest.apply_offers(offers, using)
+            run.rows += len(offers)
+            run.rejected = len(errors)
+            run.save(update_fields=['rows', 'rejected'])
+        bucket.take(len(rows))
+        rows.clear()
+
+    timeout = getattr(settings, 'FEED_TIMEOUT', 60)
+    with urllib.request.urlopen(feed.url, timeout=timeout) as response:
+        for line, record, error in ingest.iter_records(ingest.open_stream(response)):
+            if error is None:
+                try:
+                    rows.append((line, *parse(record)))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                errors.append((line, error))
+                run.rejected = len(errors)
+            if len(rows) >= batch_size:
+                flush()
+        if rows:
+            flush()
+    if unmatched:
+        record_unmatched(feed.source, unmatched)
+    return errors
+
+
+def run_feed(feed_id, force=False, batch_size=ingest.BATCH_SIZE):
+    """
+    Одна загрузка выгрузки сети. Возвращает FeedRun или None, если сеть
+    уже загружает другой обработчик (или время загрузки не подошло, без force).
+    """
+    owner = owner_name()
+    now = timezone.now()
+    if not force and not NetworkFeed.objects.filter(id=feed_id, next_run_at__lte=now).exists():
+        return None
+    if not acquire(feed_id, owner, now):
+        return None
+    feed = NetworkFeed.objects.select_related('network').get(id=feed_id)
+    run = FeedRun.objects.create(feed=feed, scheduled_at=min(feed.next_run_at, now), started_at=now)
+    failed = False
+    try:
+        errors = _load(feed, run, owner, batch_size)
+        run.status = FeedRun.SUCCESS
+        run.error = '\n'.join(f'строка {line}: {error}' for line, error in sorted(errors)[:ERRORS_KEPT])
+    except Exception as e:
+        failed = True
+        logger.exception('Ошибка загрузки выгрузки сети %s', feed.network)
+        run.status = FeedRun.FAILED
+        run.error = f'{type(e).__name__}: {e}'
+    run.finished_at = timezone.now()
+    run.save()
+    release(feed.id, owner, _next_run(feed, run.scheduled_at, failed, run.finished_at))
+    logger.info(
+        'Выгрузка %s: %s, строк %s (отклонено %s), %.0f строк/с, задержка %.0f с',
+        feed.network, run.status, run.rows, run.rejected, run.rows_per_second, run.lag,
+    )
+    return run
+
+
+class Scheduler:
+    """
+    Пул обработчиков загрузок. Каждая сеть занимает не больше одного потока
+    (блокировка NetworkFeed), поэтому крупная сеть не вытесняет мелкие, пока
+    потоков больше одного; свободные потоки получают следующие сети из очереди
+    due_feeds. Несколько планировщиков (процессов) могут работать одновременно.
+    """
+
+    def __init__(self, workers=None, batch_size=ingest.BATCH_SIZE):
+        self.workers = workers or getattr(settings, 'FEED_WORKERS', 4)
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='feed')
+        self.running = {}
+        self._lock = threading.Lock()
+
+    def _run(self, feed_id):
+        try:
+            return run_feed(feed_id, batch_size=self.batch_size)
+        finally:
+            # Соединения потока пула закрываются: поток может долго простаивать
+            connections.close_all()
+            with self._lock:
+                self.running.pop(feed_id, None)
+
+    def tick(self):
+        """Запускает подошедшие загрузки на свободных потоках; возвращает их число"""
+        with self._lock:
+            free = self.workers - len(self.running)
+            running = set(self.running)
+        if free <= 0:
+            return 0
+        feeds = due_feeds(exclude=running)[:free]
+        with self._lock:
+            # Под блокировкой: поток не уберет сеть из running раньше, чем она туда попадет
+            for feed in feeds:
+                self.running[feed.id] = self.pool.submit(self._run, feed.id)
+        return len(feeds)
+
+    def wait(self):
+        """Ждет завершения запущенных загрузок"""
+        with self._lock:
+            futures = list(self.running.values())
+        for future in futures:
+            future.result()
+
+    def serve(self, interval=5.0, once=False):
+        """Опрашивает расписание каждые interval секунд; once - один проход до пустой очереди"""
+        try:
+            while True:
+                started = self.tick()
+                if once and not started and not self.running:
+                    break
+                time.sleep(interval if not once else 0.1)
+        finally:
+            self.pool.shutdown(wait=True)
+
+
+def report(now=None):
+    """
+    Состояние загрузок по сетям: последняя загрузка (строк, строк/с, задержка
+    старта относительно расписания), возраст данных и отставание от расписания.
+    """
+    now = now or timezone.now()
+    result = []
+    for feed in NetworkFeed.objects.select_related('network').order_by('priority', 'network__name'):
+        last = feed.runs.order_by('-started_at').first()
+        success = feed.runs.filter(status=FeedRun.SUCCESS).order_by('-started_at').first()
+        result.append({
+            'network': feed.network.name,
+            'feed_id': feed.id,
+            'priority': feed.priority,
+            'is_active': feed.is_active,
+            'running': bool(feed.locked_until and feed.locked_until > now),
+            'status': last.status if last else None,
+            'rows': last.rows if last else 0,
+            'rejected': last.rejected if last else 0,
+            'rows_per_second': last.rows_per_second if last else 0.0,
+            'start_lag': last.lag if last else None,
+            # Сколько секунд данные сети не обновлялись успешно
+            'data_age': (now - success.finished_at).total_seconds() if success and success.finished_at else None,
+            # Насколько очередная загрузка уже опаздывает
+            'overdue': max((now - feed.next_run_at).total_seconds(), 0.0) if feed.is_active else 0.0,
+        })
+    return result
@@ -1,10 +1,27 @@
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
 from django.core.exceptions import ValidationError
-from .models import CustomUser, UserSubscription, Drug, Pharmacy
+from django.urls import reverse
+from .models import CustomUser, UserSubscription, Drug
+from .reference import get_city_choices, get_drug_label
 from decimal import Decimal
 
 
+class DrugAutocompleteWidget(forms.Widget):
+    """
+    Поле выбора препарата с автодополнением.
+    В отличие от <select> не выводит весь каталог: варианты подгружаются
+    с эндпоинта drugs:drug_autocomplete по мере ввода.
+    """
+    template_name = 'drugs/widgets/drug_autocomplete.html'
+    
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['label'] = get_drug_label(value) if value else ''
+        context['widget']['autocomplete_url'] = reverse('drugs:drug_autocomplete')
+        return context
+
+
 class UserRegistrationForm(forms.ModelForm):
     """Форма регистрации пользователя"""
     password1 = forms.CharField(
@@ -33,7 +50,7 @@ class UserRegistrationForm(forms.ModelForm):
         }
     
     def clean_email(self):
-        email = self.cleaned_data.get('email')
+        email = CustomUser.objects.normalize_email(self.cleaned_data.get('email'))
         if CustomUser.objects.filter(email=email).exists():
             raise ValidationError('Пользователь с таким email уже существует')
         return email
@@ -74,6 +91,17 @@ class UserLoginForm(AuthenticationForm):
     def clean_username(self):
         username = self.cleaned_data.get('username')
         return username.lower()
+    
+    def clean(self):
+        try:
+            return super().clean()
+        except ValidationError:
+            if self.request is not None and getattr(self.request, 'login_throttled', False):
+                raise ValidationError(
+                    'Слишком много попыток входа. Попробуйте позже.',
+                    code='too_many_attempts',
+                )
+            raise
 
 
 class SubscriptionForm(forms.ModelForm):
@@ -83,7 +111,7 @@ class SubscriptionForm(forms.ModelForm):
         model = UserSubscription
         fields = ['drug', 'city', 'max_price']
         widgets = {
-            'drug': forms.Select(attrs={'class': 'form-select'}),
+            'drug': DrugAutocompleteWidget(attrs={'class': 'form-control'}),
             'city': forms.Select(attrs={'class': 'form-select'}),
             'max_price': forms.NumberInput(attrs={
                 'class': 'form-control', 
@@ -100,10 +128,8 @@ class SubscriptionForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Получаем уникальные города из базы данных
-        cities = Pharmacy.objects.values_list('city', flat=True).distinct().order_by('city')
-        city_choices = [('', 'Все города')] + [(city, city) for city in cities if city]
-        self.fields['city'].widget.choices = city_choices
+        # Города берем из кэша справочников (сбрасывается при изменении аптек)
+        self.fields['city'].widget.choices = get_city_choices()
         
         # Настраиваем поле цены
         self.fields['max_price'].widget.attrs['step'] = '1'
@@ -138,10 +164,8 @@ class SubscriptionEditForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Получаем уникальные города из базы данных
-        cities = Pharmacy.objects.values_list('city', flat=True).distinct().order_by('city')
-        city_choices = [('', 'Все города')] + [(city, city) for city in cities if city]
-        self.fields['city'].widget.choices = city_choices
+        # Города берем из кэша справочников (сбрасывается при изменении аптек)
+        self.fields['city'].widget.choices = get_city_choices()
         
         # Настраиваем поле цены
         self.fields['max_price'].widget.attrs['step'] = '1'
@@ -150,4 +174,21 @@ class SubscriptionEditForm(forms.ModelForm):
         max_price = self.cleaned_data.get('max_price')
         if max_price is not None and max_price <= 0:
             raise ValidationError('Цена должна быть положительной')
-        return max_price
\ No newline at end of file
+        return max_price
+
+class PriceAdjustmentForm(forms.Form):
+    """Форма массового изменения цен в админке"""
+    percent = forms.DecimalField(
+        label='Изменение цены, %',
+        max_digits=6,
+        decimal_places=2,
+        min_value=Decimal('-99'),
+        max_value=Decimal('1000'),
+        help_text='Например, 10 - поднять цены на 10%, -5 - снизить на 5%',
+    )
+
+    def clean_percent(self):
+        percent = self.cleaned_data['percent']
+        if percent == 0:
+            raise ValidationError('Укажите ненулевое изменение')
+        return percent
@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Availability
+from .reference import get_network_freshness
+
+
+def default_sla():
+    """Срок актуальности остатков для сетей без своего значения"""
+    return timedelta(hours=getattr(settings, 'STOCK_FRESHNESS_HOURS', 72))
+
+
+def sla(network_id):
+    hours = get_network_freshness().get(network_id)
+    return timedelta(hours=hours) if hours is not None else default_sla()
+
+
+def is_stale(last_updated, network_id, now=None):
+    """Предложение не обновлялось дольше срока актуальности своей сети"""
+    return last_updated < (now or timezone.now()) - sla(network_id)
+
+
+def _groups(now):
+    """
+    Условия по группам сетей: [(условие на сеть, граница свежести)].
+    Первая группа - сети без своего срока, дальше по одной на каждую сеть со своим.
+    """
+    overrides = get_network_freshness()
+    groups = [(~Q(pharmacy__network_id__in=list(overrides)), now - default_sla())]
+    for network_id, hours in sorted(overrides.items()):
+        groups.append((Q(pharmacy__network_id=network_id), now - timedelta(hours=hours)))
+    return groups
+
+
+def fresh_q(now=None):
+    """Условие на Availability: предложение обновлялось в пределах срока своей сети"""
+    condition = Q()
+    for network, cutoff in _groups(now or timezone.now()):
+        condition |= network & Q(last_updated__gte=cutoff)
+    return condition
+
+
+def stale_querysets(now=None):
+    """
+    Устаревшие предложения в наличии по группам сетей. Каждая выборка - диапазон
+    по частичному индексу availability_fresh_idx (last_updated при is_available).
+    """
+    for network, cutoff in _groups(now or timezone.now()):
+        yield Availability.objects.filter(network, is_available=True, last_updated__lt=cutoff)
+
+
+def mark_stale(offers, now=None):
+    """Отмечает offer['stale'] у предложений в виде offer_dict (drugs.cards)"""
+    now = now or timezone.now()
+    for offer in offers:
+        network = offer['pharmacy']['network']
+        offer['stale'] = is_stale(offer['last_updated'], network['id'] if network else None, now)
+    return offers
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 с числом итераций из настроек (PASSWORD_HASH_ITERATIONS).
+
+    Алгоритм совпадает со стандартным, поэтому существующие хэши проверяются
+    как обычно, а при следующем входе пересчитываются с новым числом итераций.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', PBKDF2PasswordHasher.iterations)
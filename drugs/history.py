@@ -0,0 +1,368 @@
+"""
+Хранение истории цен по месяцам.
+
+PostgreSQL: drugs_pricehistory секционирована по recorded_at (миграция 0010),
+по секции drugs_pricehistory_pYYYYMM на месяц. Запросы с условием на
+recorded_at читают только нужные секции.
+
+SQLite: секционирования нет. В основной таблице остаются последние
+PRICE_HISTORY_HOT_MONTHS месяцев, более старые месяцы переносятся
+в таблицы drugs_pricehistory_pYYYYMM с той же структурой.
+
+Месяцы старше PRICE_HISTORY_DB_MONTHS выгружаются в архив
+(PRICE_HISTORY_ARCHIVE_DIR/pricehistory-YYYY-MM.csv.gz) и удаляются из БД;
+файлы старше PRICE_HISTORY_RETENTION_MONTHS удаляются. Архив читается
+только через load_archive.
+
+Строки вне основной таблицы (таблицы по месяцам SQLite, архивные файлы)
+ORM не видит: их читает load_archive (так делает export_snapshot),
+а объединение дублей переносит их через repoint_availability. Фильтр
+админки показывает только основную таблицу. При удалении строки наличия
+ее история в таблицах по месяцам удаляется внешним ключом с каскадом;
+архивные файлы не меняются и хранят историю удаленных предложений.
+"""
+import csv
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, router, transaction
+
+from .catalog import Record
+from .models import Availability, PriceHistory
+
+logger = logging.getLogger(__name__)
+
+# На сколько месяцев вперед заранее создаются секции PostgreSQL
+PARTITIONS_AHEAD = 2
+
+ARCHIVE_COLUMNS = ('id', 'availability_id', 'price', 'recorded_at')
+ARCHIVE_FILE_RE = re.compile(r'^pricehistory-(\d{4})-(\d{2})\.csv\.gz$')
+
+
+class HistoryRecord(Record):
+    """Запись архива истории цен (только для чтения)"""
+    __slots__ = ARCHIVE_COLUMNS
+
+
+def hot_months():
+    return getattr(settings, 'PRICE_HISTORY_HOT_MONTHS', 3)
+
+
+def db_months():
+    return max(getattr(settings, 'PRICE_HISTORY_DB_MONTHS', 12), hot_months())
+
+
+def retention_months():
+    """0 - архивные файлы хранятся бессрочно"""
+    return getattr(settings, 'PRICE_HISTORY_RETENTION_MONTHS', 36)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'PRICE_HISTORY_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'archive' / 'pricehistory'))
+
+
+def month_start(value):
+    """Начало месяца (UTC), в который попадает value"""
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def hot_cutoff(now=None):
+    """Начало "горячего" периода: последние PRICE_HISTORY_HOT_MONTHS месяцев, включая текущий"""
+    return add_months(month_start(now or datetime.now(dt_timezone.utc)), 1 - hot_months())
+
+
+def month_table(month):
+    return f'{PriceHistory._meta.db_table}_p{month:%Y%m}'
+
+
+def archive_path(month):
+    return archive_dir() / f'pricehistory-{month:%Y-%m}.csv.gz'
+
+
+def _connection():
+    return connections[router.db_for_write(PriceHistory)]
+
+
+def _is_postgres(connection):
+    return connection.vendor == 'postgresql'
+
+
+def month_tables(connection=None):
+    """Месяцы, лежащие в отдельных таблицах (секции PostgreSQL / таблицы SQLite): {месяц: таблица}"""
+    connection = connection or _connection()
+    prefix = f'{PriceHistory._meta.db_table}_p'
+    if _is_postgres(connection):
+        # Секции Django-интроспекция не показывает: список берется из pg_inherits
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = %s::regclass',
+                [PriceHistory._meta.db_table],
+            )
+            names = [row[0] for row in cursor.fetchall()]
+    else:
+        names = connection.introspection.table_names()
+    months = {}
+    for name in names:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            months[datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=dt_timezone.utc)] = name
+    return months
+
+
+def ensure_partitions(now=None, ahead=PARTITIONS_AHEAD):
+    """
+    PostgreSQL: создает секции текущего и следующих месяцев. Строки, успевшие
+    попасть в секцию по умолчанию (секции не было), переносятся в новую секцию.
+    Возвращает созданные месяцы.
+    """
+    connection = _connection()
+    if not _is_postgres(connection):
+        return []
+    existing = month_tables(connection)
+    quote = connection.ops.quote_name
+    parent = quote(PriceHistory._meta.db_table)
+    default = quote(f'{PriceHistory._meta.db_table}_default')
+    created = []
+    month = month_start(now or datetime.now(dt_timezone.utc))
+    for _ in range(ahead + 1):
+        if month not in existing:
+            bounds = [month, add_months(month, 1)]
+            table = quote(month_table(month))
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(f'CREATE TABLE {table} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM {default} WHERE recorded_at >= %s AND recorded_at < %s RETURNING *) '
+                    f'INSERT INTO {table} SELECT * FROM moved',
+                    bounds,
+                )
+                cursor.execute(f'ALTER TABLE {parent} ATTACH PARTITION {table} FOR VALUES FROM (%s) TO (%s)', bounds)
+            created.append(month)
+        month = add_months(month, 1)
+    return created
+
+
+def split_cold_months(now=None):
+    """
+    SQLite: переносит месяцы старше горячего периода из основной таблицы
+    в таблицы по месяцам (месяц за транзакцию). Возвращает {месяц: строк}.
+    """
+    connection = _connection()
+    if _is_postgres(connection):
+        return {}
+    cutoff = hot_cutoff(now)
+    history = PriceHistory.objects.using(connection.alias)
+    moved = {}
+    while True:
+        first = history.filter(recorded_at__lt=cutoff).order_by('recorded_at').values_list('recorded_at', flat=True).first()
+        if first is None:
+            return moved
+        month = month_start(first)
+        rows = history.filter(recorded_at__gte=month, recorded_at__lt=add_months(month, 1))
+        table = connection.ops.quote_name(month_table(month))
+        select, params = rows.order_by().values_list(*ARCHIVE_COLUMNS).query.sql_with_params()
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            # Внешний ключ с каскадом: при удалении строки наличия ее история
+            # удаляется и из таблиц по месяцам (ORM их не видит)
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                'id integer NOT NULL PRIMARY KEY, '
+                f'availability_id bigint NOT NULL REFERENCES {connection.ops.quote_name(Availability._meta.db_table)} (id) '
+                'ON DELETE CASCADE, '
+                'price decimal NOT NULL, recorded_at datetime NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {connection.ops.quote_name(month_table(month) + "_availability")} '
+                f'ON {table} (availability_id)'
+            )
+            cursor.execute(f'INSERT OR IGNORE INTO {table} ({", ".join(ARCHIVE_COLUMNS)}) {select}', params)
+            moved[month] = rows.delete()[0]
+        logger.info('История цен за %s: перенесено строк %s', f'{month:%Y-%m}', moved[month])
+
+
+def repoint_availability(mapping, using=None):
+    """
+    SQLite: переносит строки истории в таблицах по месяцам на другие строки
+    наличия, mapping - {старый availability_id: новый} (объединение дублей,
+    drugs.dedup). Основную таблицу (и секции PostgreSQL) обновляет вызывающий
+    через ORM. Архивные файлы не меняются: в них остаются старые id.
+    Возвращает число перенесенных строк.
+    """
+    connection = connections[using or router.db_for_write(PriceHistory)]
+    if _is_postgres(connection) or not mapping:
+        return 0
+    cases = ' '.join(['WHEN %s THEN %s'] * len(mapping))
+    placeholders = ', '.join(['%s'] * len(mapping))
+    params = [value for pair in mapping.items() for value in pair] + list(mapping)
+    moved = 0
+    with connection.cursor() as cursor:
+        for table in month_tables(connection).values():
+            cursor.execute(
+                f'UPDATE {connection.ops.quote_name(table)} SET availability_id = CASE availability_id {cases} END '
+                f'WHERE availability_id IN ({placeholders})',
+                params,
+            )
+            moved += cursor.rowcount
+    return moved
+
+
+def _parse_time(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value
+
+
+def _parse_price(value):
+    # SQLite хранит decimal как число с плавающей точкой
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def _table_rows(connection, table, availability_ids=None):
+    sql = f'SELECT {", ".join(ARCHIVE_COLUMNS)} FROM {connection.ops.quote_name(table)}'
+    params = []
+    if availability_ids is not None:
+        availability_ids = list(availability_ids)
+        if not availability_ids:
+            return
+        sql += f' WHERE availability_id IN ({", ".join(["%s"] * len(availability_ids))})'
+        params = availability_ids
+    # На PostgreSQL - серверный курсор: месяц не загружается в память целиком
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(sql + ' ORDER BY id', params)
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                return
+            for object_id, availability_id, price, recorded_at in rows:
+                yield object_id, availability_id, _parse_price(price), _parse_time(recorded_at)
+
+
+def export_month(month):
+    """
+    Выгружает месяц в PRICE_HISTORY_ARCHIVE_DIR и удаляет его из БД.
+    Файл пишется во временный и переименовывается, таблица удаляется после
+    этого: при сбое посередине месяц остается в БД и выгружается повторно.
+    Возвращает (путь, строк).
+    """
+    connection = _connection()
+    table = month_tables(connection)[month]
+    path = archive_path(month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.partial')
+    count = 0
+    with gzip.open(partial, 'wt', encoding='utf-8', newline='') as stream:
+        writer = csv.writer(stream)
+        writer.writerow(ARCHIVE_COLUMNS)
+        for object_id, availability_id, price, recorded_at in _table_rows(connection, table):
+            writer.writerow([object_id, availability_id, price, recorded_at.isoformat()])
+            count += 1
+    os.replace(partial, path)
+
+    quoted = connection.ops.quote_name(table)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if _is_postgres(connection):
+            cursor.execute(
+                f'ALTER TABLE {connection.ops.quote_name(PriceHistory._meta.db_table)} DETACH PARTITION {quoted}'
+            )
+        cursor.execute(f'DROP TABLE {quoted}')
+    logger.info('История цен за %s выгружена в %s: строк %s', f'{month:%Y-%m}', path, count)
+    return path, count
+
+
+def archived_files():
+    """Архивные файлы: {месяц: путь}"""
+    files = {}
+    directory = archive_dir()
+    if directory.is_dir():
+        for path in directory.iterdir():
+            match = ARCHIVE_FILE_RE.match(path.name)
+            if match:
+                files[datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)] = path
+    return files
+
+
+def purge_archives(now=None):
+    """Удаляет архивные файлы старше PRICE_HISTORY_RETENTION_MONTHS. Возвращает удаленные пути"""
+    if not retention_months():
+        return []
+    cutoff = add_months(month_start(now or datetime.now(dt_timezone.utc)), -retention_months())
+    removed = []
+    for month, path in sorted(archived_files().items()):
+        if month < cutoff:
+            path.unlink()
+            removed.append(path)
+    return removed
+
+
+def archive(now=None):
+    """
+    Обслуживание истории цен: секции на будущие месяцы (PostgreSQL), перенос
+    старых месяцев из основной таблицы (SQLite), выгрузка месяцев старше
+    PRICE_HISTORY_DB_MONTHS в архив и удаление файлов сверх срока хранения.
+    """
+    now = now or datetime.now(dt_timezone.utc)
+    result = {
+        'partitions': ensure_partitions(now),
+        'split': split_cold_months(now),
+        'exported': {},
+    }
+    cutoff = add_months(month_start(now), 1 - db_months())
+    for month in sorted(month_tables()):
+        if month < cutoff:
+            result['exported'][month] = export_month(month)
+    result['purged'] = purge_archives(now)
+    return result
+
+
+def _file_rows(path, availability_ids=None):
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as stream:
+        reader = csv.reader(stream)
+        next(reader, None)
+        for object_id, availability_id, price, recorded_at in reader:
+            availability_id = int(availability_id)
+            if availability_ids is None or availability_id in availability_ids:
+                yield int(object_id), availability_id, Decimal(price), _parse_time(recorded_at)
+
+
+def load_archive(start=None, end=None, availability_ids=None):
+    """
+    Читает историю цен, которой нет в основной таблице: архивные файлы и
+    (на SQLite) таблицы по месяцам. Только чтение, записи HistoryRecord
+    по месяцам от старых к новым. start/end ограничивают recorded_at
+    (end не включается), availability_ids - строки наличия.
+    """
+    if availability_ids is not None:
+        availability_ids = set(availability_ids)
+    connection = _connection()
+    sources = {month: ('file', path) for month, path in archived_files().items()}
+    if not _is_postgres(connection):
+        # На PostgreSQL секции - часть основной таблицы, их читает ORM
+        sources.update({month: ('table', table) for month, table in month_tables(connection).items()})
+
+    for month in sorted(sources):
+        if (start and add_months(month, 1) <= start) or (end and month >= end):
+            continue
+        kind, source = sources[month]
+        if kind == 'file':
+            rows = _file_rows(source, availability_ids)
+        else:
+            rows = _table_rows(connection, source, availability_ids)
+        for row in rows:
+            if (start and row[3] < start) or (end and row[3] >= end):
+                continue
+            yield HistoryRecord(*row)
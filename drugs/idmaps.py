@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .catalog import CatalogCache
+from .models import ExternalId, UnmatchedCode
+
+
+class SourceMap:
+    """
+    Все коды одного источника в памяти: два словаря {код: id} - для аптек
+    и для препаратов. Загружаются одним потоковым запросом по двум колонкам,
+    поиск кода в загрузке не обращается к БД.
+    """
+    __slots__ = ('source', 'pharmacies', 'drugs')
+
+    def __init__(self, source):
+        self.source = source
+        self.pharmacies = {}
+        self.drugs = {}
+        rows = ExternalId.objects.filter(source=source).values_list('kind', 'code', 'drug_id', 'pharmacy_id')
+        for kind, code, drug_id, pharmacy_id in rows.iterator(chunk_size=10000):
+            if kind == ExternalId.DRUG:
+                self.drugs[code] = drug_id
+            else:
+                self.pharmacies[code] = pharmacy_id
+
+    def __len__(self):
+        return len(self.pharmacies) + len(self.drugs)
+
+    def __repr__(self):
+        return f'<SourceMap {self.source}: {len(self.pharmacies)} аптек, {len(self.drugs)} препаратов>'
+
+
+class ExternalIdCache(CatalogCache):
+    """
+    Словари кодов по источникам в памяти процесса (LRU по источникам, не больше
+    IDMAP_SOURCES_CACHED). Любое изменение ExternalId увеличивает версию в общем
+    кэше, и словари перечитываются целиком - коды меняются редко, а загрузки
+    (drugs.feeds, drugs.push) читают их постоянно. Без общего кэша (REDIS_URL)
+    коды, добавленные другим процессом, появляются через CATALOG_MAX_AGE_SECONDS.
+    """
+
+    def __init__(self):
+        super().__init__('external_ids', ExternalId, (), SourceMap)
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'IDMAP_SOURCES_CACHED', 20)
+
+    def _load(self, sources):
+        return {source: SourceMap(source) for source in sources}
+
+    def warm(self):
+        # Источники заранее неизвестны: словари загружаются при первой загрузке
+        self._check_version()
+
+
+external_ids = ExternalIdCache()
+
+
+def record_unmatched(source, unmatched, now=None):
+    """
+    Запоминает коды без соответствия для сверки: unmatched - {(тип, код): строк}.
+    Одним upsert: first_seen сохраняется, last_seen и rows обновляются.
+    Строки идут по (тип, код), а не в порядке файла: upsert выполняется в
+    транзакции пачки загрузки и блокирует строки по порядку, и параллельные
+    загрузки с общими кодами в разном порядке взаимно блокировались бы (deadlock).
+    """
+    now = now or timezone.now()
+    UnmatchedCode.objects.bulk_create(
+        [
+            UnmatchedCode(source=source, kind=kind, code=code, first_seen=now, last_seen=now, rows=rows)
+            for (kind, code), rows in sorted(unmatched.items())
+        ],
+        update_conflicts=True,
+        unique_fields=['source', 'kind', 'code'],
+        update_fields=['last_seen', 'rows'],
+    )
+
+
+def _mapped():
+    return ExternalId.objects.filter(source=OuterRef('source'), kind=OuterRef('kind'), code=OuterRef('code'))
+
+
+def unmatched_codes(source=None):
+    """Коды без соответствия, которые так и не сопоставлены: по убыванию числа строк"""
+    queryset = UnmatchedCode.objects.filter(~Exists(_mapped()))
+    if source:
+        queryset = queryset.filter(source=source)
+    return queryset.order_by('source', '-rows', 'kind', 'code')
+
+
+def prune_unmatched(source=None):
+    """Удаляет из сверки коды, для которых соответствие уже добавлено"""
+    queryset = UnmatchedCode.objects.filter(Exists(_mapped()))
+    if source:
+        queryset = queryset.filter(source=source)
+    deleted, _ = queryset.delete()
+    return deleted
@@ -0,0 +1,256 @@
+import csv
+import gzip
+import io
+import itertools
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import router
+from django.utils import timezone
+
+from . import catalog
+from .models import Availability, AvailabilityEvent, ExternalId, PriceHistory
+from .signals import availability_bulk_changed
+
+# Сколько строк выгрузки применяется одной пачкой (одна транзакция)
+BATCH_SIZE = 1000
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Внешний код помещается в ExternalId.code
+CODE_MAX_LENGTH = ExternalId._meta.get_field('code').max_length
+
+# Цена помещается в Availability.price (max_digits=10, decimal_places=2)
+MAX_PRICE = Decimal('99999999.99')
+
+
+def open_stream(raw):
+    """Бинарный поток выгрузки; сжатый gzip распаковывается на лету (по сигнатуре)"""
+    stream = raw if hasattr(raw, 'peek') else io.BufferedReader(raw)
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def iter_ndjson(lines):
+    """(номер строки, словарь или None, ошибка или None) по строкам NDJSON; пустые строки пропускаются"""
+    for line, raw in enumerate(lines, 1):
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError as e:
+            yield line, None, f'некорректный JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield line, None, 'ожидается JSON-объект'
+            continue
+        yield line, record, None
+
+
+def text_lines(stream):
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def iter_records(stream):
+    """
+    Строки выгрузки по одной: (номер строки, словарь или None, ошибка или None).
+    Формат определяется по первой строке: '{' - NDJSON, иначе CSV с заголовком.
+    Поток читается построчно, целиком в память не загружается.
+    """
+    text = text_lines(stream)
+    first = text.readline()
+    if not first:
+        return
+    lines = itertools.chain([first], text)
+    if first.lstrip().startswith('{'):
+        yield from iter_ndjson(lines)
+    else:
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record, None
+
+
+def parse_price(value):
+    try:
+        price = Decimal(str(value).strip().replace(',', '.'))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'некорректная цена: {value!r}')
+    if not price.is_finite() or price <= 0 or price > MAX_PRICE:
+        raise ValueError(f'некорректная цена: {value!r}')
+    return price.quantize(Decimal('0.01'))
+
+
+def parse_quantity(value):
+    try:
+        quantity = int(str(value).strip() or 0)
+    except ValueError:
+        raise ValueError(f'некорректное количество: {value!r}')
+    if quantity < 0:
+        raise ValueError(f'некорректное количество: {value!r}')
+    return quantity
+
+
+def parse_id(value, name):
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError(f'некорректный {name}: {value!r}')
+
+
+def parse_id_row(record):
+    """(id аптеки, id препарата, цена, количество) строки с полями pharmacy_id и drug_id"""
+    return (
+        parse_id(record.get('pharmacy_id'), 'pharmacy_id'),
+        parse_id(record.get('drug_id'), 'drug_id'),
+        parse_price(record.get('price')),
+        parse_quantity(record.get('quantity')),
+    )
+
+
+def parse_code_row(record):
+    """(код аптеки, код препарата, цена, количество) строки с внешними кодами pharmacy и drug"""
+    pharmacy = str(record.get('pharmacy') or '').strip()
+    drug = str(record.get('drug') or '').strip()
+    if not pharmacy or not drug:
+        raise ValueError('не указан код аптеки (pharmacy) или препарата (drug)')
+    # Длиннее кода не бывает ни в ExternalId, ни в сверке (UnmatchedCode)
+    if max(len(pharmacy), len(drug)) > CODE_MAX_LENGTH:
+        raise ValueError(f'код длиннее {CODE_MAX_LENGTH} символов')
+    return pharmacy, drug, parse_price(record.get('price')), parse_quantity(record.get('quantity'))
+
+
+def _offers(rows, network_id, pharmacy_ids, drug_ids, errors):
+    """
+    Строки (номер, аптека, препарат, цена, количество) с уже найденными id
+    ({ключ строки: id}) -> {(id аптеки, id препарата): (цена, количество)}.
+    Аптеки других сетей отклоняются (проверка по каталогу в памяти, drugs.catalog).
+    """
+    pharmacies = catalog.pharmacies.get_many(set(pharmacy_ids.values()))
+    offers = {}
+    for line, pharmacy, drug, price, quantity in rows:
+        pharmacy_id = pharmacy_ids.get(pharmacy)
+        if pharmacy_id is None:
+            errors.append((line, f'неизвестная аптека {pharmacy!r}'))
+        elif pharmacy_id not in pharmacies or pharmacies[pharmacy_id].network_id != network_id:
+            errors.append((line, f'аптека {pharmacy!r} не принадлежит сети'))
+        elif drug not in drug_ids:
+            errors.append((line, f'неизвестный препарат {drug!r}'))
+        else:
+            offers[pharmacy_id, drug_ids[drug]] = (price, quantity)
+    return offers
+
+
+def resolve_ids(rows, network_id, errors):
+    """Строки parse_id_row: проверка, что аптеки и препараты существуют"""
+    pharmacy_ids = {pharmacy_id: pharmacy_id for _, pharmacy_id, _, _, _ in rows}
+    drug_ids = {drug_id: drug_id for drug_id in catalog.drugs.get_many({row[2] for row in rows})}
+    return _offers(rows, network_id, pharmacy_ids, drug_ids, errors)
+
+
+def resolve_codes(rows, network_id, source_map, errors, unmatched):
+    """
+    Строки parse_code_row: коды переводятся в id по словарю источника
+    (drugs.idmaps.SourceMap). Коды без соответствия считаются в
+    unmatched {(тип, код): строк} для сверки.
+    """
+    for _, pharmacy, drug, _, _ in rows:
+        if pharmacy not in source_map.pharmacies:
+            unmatched[ExternalId.PHARMACY, pharmacy] += 1
+        if drug not in source_map.drugs:
+            unmatched[ExternalId.DRUG, drug] += 1
+    return _offers(rows, network_id, source_map.pharmacies, source_map.drugs, errors)
+
+
+def apply_offers(offers, using=None):
+    """
+    Применяет пачку проверенных строк {(id аптеки, id препарата): (цена, количество)}.
+    Вызывается внутри транзакции; is_available = количество > 0.
+
+    Текущие строки читаются одним запросом (с блокировкой), новые и изменившиеся
+    записываются одним INSERT ... ON CONFLICT DO UPDATE, у неизменившихся
+    обновляется только last_updated (актуальность остатков, drugs.freshness).
+    Изменения пишутся в журнал (drugs.outbox) и историю цен, кэши получают
+    сигнал availability_bulk_changed.
+    Возвращает {'created', 'updated', 'unchanged'}.
+    """
+    using = using or router.db_for_write(Availability)
+    now = timezone.now()
+    existing = {}
+    rows = Availability.objects.using(using).select_for_update().filter(
+        pharmacy_id__in={pharmacy_id for pharmacy_id, _ in offers},
+        drug_id__in={drug_id for _, drug_id in offers},
+    ).values_list('pharmacy_id', 'drug_id', 'id', 'price', 'quantity', 'is_available')
+    for pharmacy_id, drug_id, *current in rows:
+        if (pharmacy_id, drug_id) in offers:
+            existing[pharmacy_id, drug_id] = current
+
+    changed = []
+    unchanged = []
+    for (pharmacy_id, drug_id), (price, quantity) in offers.items():
+        current = existing.get((pharmacy_id, drug_id))
+        if current is not None and current[1:] == [price, quantity, quantity > 0]:
+            unchanged.append(current[0])
+            continue
+        changed.append(Availability(
+            pharmacy_id=pharmacy_id,
+            drug_id=drug_id,
+            price=price,
+            quantity=quantity,
+            is_available=quantity > 0,
+            last_updated=now,
+        ))
+
+    if changed:
+        Availability.objects.using(using).bulk_create(
+            changed,
+            update_conflicts=True,
+            unique_fields=['drug', 'pharmacy'],
+            update_fields=['price', 'quantity', 'is_available', 'last_updated'],
+        )
+        missing = [offer for offer in changed if offer.pk is None]
+        if missing:
+            # СУБД без RETURNING для upsert: id дочитываются отдельным запросом
+            ids = {
+                (pharmacy_id, drug_id): availability_id
+                for pharmacy_id, drug_id, availability_id in Availability.objects.using(using).filter(
+                    pharmacy_id__in={offer.pharmacy_id for offer in missing},
+                    drug_id__in={offer.drug_id for offer in missing},
+                ).values_list('pharmacy_id', 'drug_id', 'id')
+            }
+            for offer in missing:
+                offer.pk = ids[offer.pharmacy_id, offer.drug_id]
+    if unchanged:
+        Availability.objects.using(using).filter(id__in=unchanged).update(last_updated=now)
+
+    events = []
+    history = []
+    for offer in changed:
+        current = existing.get((offer.pharmacy_id, offer.drug_id))
+        if current is None:
+            kind, old_price = AvailabilityEvent.CREATED, None
+        elif current[1] != offer.price:
+            kind, old_price = AvailabilityEvent.PRICE_CHANGED, current[1]
+        else:
+            kind, old_price = AvailabilityEvent.UPDATED, None
+        events.append(AvailabilityEvent(
+            kind=kind,
+            availability_id=offer.pk,
+            drug_id=offer.drug_id,
+            pharmacy_id=offer.pharmacy_id,
+            price=offer.price,
+            old_price=old_price,
+            quantity=offer.quantity,
+            is_available=offer.is_available,
+            created_at=now,
+        ))
+        if kind != AvailabilityEvent.UPDATED:
+            history.append(PriceHistory(availability_id=offer.pk, price=offer.price))
+    AvailabilityEvent.objects.using(using).bulk_create(events)
+    PriceHistory.objects.using(using).bulk_create(history)
+
+    # Карточки хранят last_updated предложений (метка "Данные устарели"),
+    # поэтому сбрасываются и для строк, у которых изменилась только дата
+    availability_bulk_changed.send(sender=Availability, drug_ids={drug_id for _, drug_id in offers})
+    created = sum(event.kind == AvailabilityEvent.CREATED for event in events)
+    return {'created': created, 'updated': len(events) - created, 'unchanged': len(unchanged)}
@@ -0,0 +1,251 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.db.backends.signals import connection_created
+from django.db import connections
+from django.http import HttpResponse
+from django.template.backends.django import Template as DjangoBackendTemplate
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограммы длительности запросов, секунды
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_metrics = ContextVar('request_metrics', default=None)
+_installed = False
+
+
+def is_enabled():
+    return getattr(settings, 'REQUEST_METRICS_ENABLED', False)
+
+
+class RequestMetrics:
+    """Стоимость одного запроса: SQL-запросы, время БД и рендера шаблонов"""
+
+    __slots__ = ('started', 'query_count', 'db_time', 'template_time', 'queries')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.queries = []
+
+    def add_query(self, sql, duration):
+        self.query_count += 1
+        self.db_time += duration
+        self.queries.append((duration, sql))
+
+    def slowest_queries(self, limit=5):
+        return sorted(self.queries, key=lambda item: item[0], reverse=True)[:limit]
+
+    def server_timing(self, total):
+        """Значение заголовка Server-Timing (длительности в миллисекундах)"""
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.query_count} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - started)
+
+
+def _wrap_connection(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def install():
+    """
+    Подключает сбор метрик к соединениям БД и рендеру шаблонов.
+    Вызывается один раз из DrugsConfig.ready(), только если метрики включены.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    # Соединения создаются в разных потоках (в т.ч. sync_to_async для async views),
+    # поэтому обертка вешается на каждое новое соединение, а текущий запрос
+    # находится через ContextVar
+    connection_created.connect(_wrap_connection, dispatch_uid='drugs.instrumentation')
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(None, connection)
+
+    # Вложенные {% include %} рендерятся внутри, поэтому учитывается только
+    # рендер верхнего уровня и время не считается дважды
+    original_render = DjangoBackendTemplate.render
+
+    def render(self, context=None, request=None):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return original_render(self, context, request)
+        started = time.perf_counter()
+        try:
+            return original_render(self, context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+    DjangoBackendTemplate.render = render
+
+
+class MetricsRegistry:
+    """Агрегированные метрики процесса в формате Prometheus"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._views = {}
+
+    def observe(self, view, method, status, total, metrics):
+        with self._lock:
+            key = (view, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            stats = self._views.get(view)
+            if stats is None:
+                stats = self._views[view] = {
+                    'buckets': [0] * len(DURATION_BUCKETS),
+                    'count': 0,
+                    'duration': 0.0,
+                    'queries': 0,
+                    'db_time': 0.0,
+                    'template_time': 0.0,
+                }
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    stats['buckets'][index] += 1
+            stats['count'] += 1
+            stats['duration'] += total
+            stats['queries'] += metrics.query_count
+            stats['db_time'] += metrics.db_time
+            stats['template_time'] += metrics.template_time
+
+    def render(self):
+        with self._lock:
+            lines = [
+                '# HELP pharmacy_http_requests_total Обработанные HTTP-запросы',
+                '# TYPE pharmacy_http_requests_total counter',
+            ]
+            for (view, method, status), count in sorted(self._requests.items()):
+                lines.append(
+                    f'pharmacy_http_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}'
+                )
+
+            lines += [
+                '# HELP pharmacy_http_request_duration_seconds Длительность HTTP-запросов',
+                '# TYPE pharmacy_http_request_duration_seconds histogram',
+            ]
+            for view, stats in sorted(self._views.items()):
+                for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                    lines.append(
+                        f'pharmacy_http_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'pharmacy_http_request_duration_seconds_bucket{{view="{view}",le="+Inf"}} {stats["count"]}'
+                )
+                lines.append(f'pharmacy_http_request_duration_seconds_sum{{view="{view}"}} {stats["duration"]:.6f}')
+                lines.append(f'pharmacy_http_request_duration_seconds_count{{view="{view}"}} {stats["count"]}')
+
+            for name, field, kind, help_text in (
+                ('pharmacy_db_queries_total', 'queries', 'counter', 'SQL-запросы'),
+                ('pharmacy_db_duration_seconds_total', 'db_time', 'counter', 'Время в БД'),
+                ('pharmacy_template_render_seconds_total', 'template_time', 'counter', 'Время рендера шаблонов'),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                for view, stats in sorted(self._views.items()):
+                    value = stats[field]
+                    value = f'{value:.6f}' if isinstance(value, float) else value
+                    lines.append(f'{name}{{view="{view}"}} {value}')
+
+            return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware:
+    """
+    Собирает для каждого запроса число SQL-запросов, время БД и рендера шаблонов.
+
+    Добавляет заголовок Server-Timing, пишет в лог выборку медленных запросов
+    с самыми долгими SQL и копит агрегаты для /metrics.
+    Если REQUEST_METRICS_ENABLED выключен, middleware не подключается вовсе.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_threshold = getattr(settings, 'REQUEST_METRICS_SLOW_MS', 500) / 1000
+        self.slow_sample_rate = getattr(settings, 'REQUEST_METRICS_SLOW_SAMPLE_RATE', 1.0)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current_metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        total = time.perf_counter() - metrics.started
+        response['Server-Timing'] = metrics.server_timing(total)
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.observe(view, request.method, response.status_code, total, metrics)
+
+        if total >= self.slow_threshold and random.random() < self.slow_sample_rate:
+            slowest = '\n'.join(
+                f'  {duration * 1000:.1f} ms: {sql}' for duration, sql in metrics.slowest_queries()
+            )
+            logger.warning(
+                'Медленный запрос %s %s: %.1f ms, SQL: %d запросов / %.1f ms, шаблоны: %.1f ms\n%s',
+                request.method, request.path, total * 1000,
+                metrics.query_count, metrics.db_time * 1000, metrics.template_time * 1000,
+                slowest,
+            )
+        return response
+
+
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus"""
+    if not is_enabled():
+        return HttpResponse(status=404)
+    allowed_ips = getattr(settings, 'REQUEST_METRICS_ALLOWED_IPS', ['127.0.0.1'])
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not request.user.is_staff:
+        raise PermissionDenied
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from drugs import history
+
+
+class Command(BaseCommand):
+    help = (
+        'Обслуживание истории цен: секции PostgreSQL на следующие месяцы, перенос старых '
+        'месяцев из основной таблицы (SQLite), выгрузка месяцев в архив CSV.gz и удаление '
+        'архивов сверх срока хранения'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        result = history.archive()
+
+        for month in result['partitions']:
+            self.stdout.write(f'Создана секция {month:%Y-%m}')
+        for month, count in sorted(result['split'].items()):
+            self.stdout.write(f'{month:%Y-%m}: перенесено из основной таблицы {count}')
+        for month, (path, count) in sorted(result['exported'].items()):
+            self.stdout.write(f'{month:%Y-%m}: выгружено {count} в {path}')
+        for path in result['purged']:
+            self.stdout.write(f'Удален архив {path}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Обслуживание истории цен завершено за {time.monotonic() - started:.1f} с'
+        ))
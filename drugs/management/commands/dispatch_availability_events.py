@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from drugs import outbox
+
+
+class Command(BaseCommand):
+    help = 'Доставка событий журнала изменений наличия зарегистрированным обработчикам (drugs.outbox)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer',
+            action='append',
+            help='Имя обработчика (можно указать несколько раз, по умолчанию все)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=outbox.BATCH_SIZE,
+            help='Сколько событий передавать обработчику за один вызов',
+        )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            help='Работать постоянно, ожидая новые события',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Пауза между опросами в режиме --follow, секунд',
+        )
+        parser.add_argument(
+            '--purge',
+            action='store_true',
+            help='После доставки удалить события, обработанные всеми потребителями',
+        )
+
+    def handle(self, *args, **options):
+        names = options['consumer'] or list(outbox.consumers)
+        unknown = set(names) - set(outbox.consumers)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные обработчики: {", ".join(sorted(unknown))}. '
+                f'Доступны: {", ".join(sorted(outbox.consumers))}'
+            )
+
+        while True:
+            # Пачки доставляются, пока у потребителей есть события
+            total = {name: 0 for name in names}
+            while True:
+                delivered = outbox.dispatch_all(options['batch_size'], names)
+                for name, count in delivered.items():
+                    total[name] += count
+                if not any(delivered.values()):
+                    break
+            for name, count in total.items():
+                if count or not options['follow']:
+                    self.stdout.write(f'{name}: доставлено {count}, ожидает {outbox.lag(name)}')
+            if options['purge']:
+                self.stdout.write(f'Удалено обработанных событий: {outbox.purge()}')
+            if not options['follow']:
+                break
+            time.sleep(options['interval'])
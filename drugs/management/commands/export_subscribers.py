@@ -0,0 +1,90 @@
+import csv
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from drugs.management.commands.import_subscribers import CSV_FIELDS
+from drugs.models import UserSubscription
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка пользователей и их подписок в JSONL/CSV (формат совместим с import_subscribers)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Файл для выгрузки (по умолчанию stdout)')
+        parser.add_argument(
+            '--format',
+            choices=['jsonl', 'csv'],
+            help='Формат файла (по умолчанию определяется по расширению)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Сколько пользователей читать из БД за один запрос',
+        )
+        parser.add_argument(
+            '--with-passwords',
+            action='store_true',
+            help='Выгружать хэши паролей (для переноса аккаунтов)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path and path.endswith('.csv') else 'jsonl')
+        with_passwords = options['with_passwords']
+
+        # Пользователи читаются порциями, подписки подгружаются одним запросом на порцию
+        users = CustomUser.objects.order_by('id').only(
+            'id', 'email', 'first_name', 'last_name', 'password', 'email_notifications'
+        ).prefetch_related(
+            Prefetch(
+                'usersubscription_set',
+                queryset=UserSubscription.objects.select_related('city').only(
+                    'user_id', 'drug_id', 'city__name', 'max_price', 'is_active'
+                ),
+            )
+        )
+
+        stream = open(path, 'w', encoding='utf-8', newline='') if path else sys.stdout
+        try:
+            if file_format == 'csv':
+                writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+                writer.writeheader()
+
+            count = 0
+            for user in users.iterator(chunk_size=options['chunk_size']):
+                record = {
+                    'email': user.email,
+                    'first_name': user.first_name,
+                    'last_name': user.last_name,
+                    'password': user.password if with_passwords else '',
+                    'email_notifications': user.email_notifications,
+                }
+                subscriptions = [
+                    {
+                        'drug_id': subscription.drug_id,
+                        'city': subscription.city.name if subscription.city else None,
+                        'max_price': str(subscription.max_price) if subscription.max_price is not None else None,
+                        'is_active': subscription.is_active,
+                    }
+                    for subscription in user.usersubscription_set.all()
+                ]
+
+                if file_format == 'csv':
+                    for subscription in subscriptions or [{}]:
+                        writer.writerow({**record, **subscription})
+                else:
+                    stream.write(json.dumps({**record, 'subscriptions': subscriptions}, ensure_ascii=False) + '\n')
+                count += 1
+        finally:
+            if path:
+                stream.close()
+
+        if path:
+            self.stdout.write(self.style.SUCCESS(f'Выгружено пользователей: {count}'))
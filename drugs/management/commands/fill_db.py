@@ -2,7 +2,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from drugs.models import (
-    Drug, PharmacyNetwork, Pharmacy, Availability, 
+    Drug, City, PharmacyNetwork, Pharmacy, Availability, 
     Analogue, UserSubscription, PriceHistory
 )
 import random
@@ -189,10 +189,7 @@ class Command(BaseCommand):
         
         drugs = []
         for drug_data in drugs_data:
-            drug, created = Drug.objects.get_or_create(
-                trade_name=drug_data['trade_name'],
-                defaults=drug_data
-            )
+            drug, created = Drug.objects.get_or_create_normalized(**drug_data)
             if created:
                 self.stdout.write(f'Создан препарат: {drug.trade_name}')
             drugs.append(drug)
@@ -240,7 +237,10 @@ class Command(BaseCommand):
             )
             networks.append(network)
         
-        cities = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань']
+        cities = [
+            City.objects.get_or_create_by_name(name)
+            for name in ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань']
+        ]
         pharmacies = []
         
         for i in range(20):
@@ -327,7 +327,8 @@ class Command(BaseCommand):
             user_drugs = random.sample(drugs, random.randint(2, 4))
             
             for drug in user_drugs:
-                city = random.choice(['Москва', 'Санкт-Петербург', None])
+                city_name = random.choice(['Москва', 'Санкт-Петербург', None])
+                city = City.objects.get_or_create_by_name(city_name) if city_name else None
                 max_price = random.choice([None, Decimal('100.00'), Decimal('200.00'), Decimal('500.00')])
                 
                 UserSubscription.objects.get_or_create(
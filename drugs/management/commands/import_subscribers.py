@@ -0,0 +1,220 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from drugs.models import City, Drug, UserSubscription
+from drugs.usernames import UsernameAllocator
+
+CustomUser = get_user_model()
+
+CSV_FIELDS = [
+    'email', 'first_name', 'last_name', 'password', 'email_notifications',
+    'drug_id', 'city', 'max_price', 'is_active',
+]
+
+
+def parse_bool(value, default=True):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'да')
+
+
+def read_jsonl(stream):
+    """Одна строка - пользователь со списком подписок"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            raise CommandError(f'Строка {line_number}: некорректный JSON ({e})')
+
+
+def read_csv(stream):
+    """Одна строка - одна подписка; данные пользователя повторяются в каждой строке"""
+    for row in csv.DictReader(stream):
+        record = {key: row.get(key) for key in ('email', 'first_name', 'last_name', 'password', 'email_notifications')}
+        record['subscriptions'] = []
+        if row.get('drug_id'):
+            record['subscriptions'].append({
+                'drug_id': row['drug_id'],
+                'city': row.get('city'),
+                'max_price': row.get('max_price'),
+                'is_active': row.get('is_active'),
+            })
+        yield record
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт пользователей и их подписок из JSONL/CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл JSONL или CSV')
+        parser.add_argument(
+            '--format',
+            choices=['jsonl', 'csv'],
+            help='Формат файла (по умолчанию определяется по расширению)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество записей в одной транзакции',
+        )
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help='Обновлять max_price и is_active у уже существующих подписок',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        self.batch_size = options['batch_size']
+        self.update = options['update']
+
+        # Справочники загружаются один раз на весь импорт
+        self.drug_ids = set(Drug.objects.values_list('id', flat=True))
+        self.city_ids = dict(City.objects.values_list('normalized_name', 'id'))
+        self.usernames = UsernameAllocator(CustomUser.objects.all()).preload()
+        # Пароль без хэша получает один общий "непригодный" хэш вместо PBKDF2 на каждого
+        self.unusable_password = make_password(None)
+
+        self.stats = {'users_created': 0, 'users_existing': 0, 'subscriptions': 0, 'skipped': 0}
+        started = time.monotonic()
+
+        with open(path, encoding='utf-8', newline='') as stream:
+            records = read_csv(stream) if file_format == 'csv' else read_jsonl(stream)
+            for batch in batched(records, self.batch_size):
+                with transaction.atomic():
+                    self.import_batch(batch)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Пользователей: +{self.stats["users_created"]} (существовало {self.stats["users_existing"]}), '
+                    f'подписок: {self.stats["subscriptions"]}, пропущено: {self.stats["skipped"]}, '
+                    f'{elapsed:.1f} с'
+                )
+
+        self.stdout.write(self.style.SUCCESS('Импорт завершен.'))
+
+    def resolve_password(self, value):
+        """Принимаются только готовые хэши: импорт не тратит время на хэширование"""
+        if value:
+            try:
+                identify_hasher(value)
+                return value
+            except ValueError:
+                pass
+        return self.unusable_password
+
+    def resolve_city(self, name):
+        if not name:
+            return None
+        key = City.normalize(name)
+        if key not in self.city_ids:
+            self.city_ids[key] = City.objects.get_or_create_by_name(name).id
+        return self.city_ids[key]
+
+    def import_batch(self, batch):
+        # Пользователи: одна выборка существующих и один bulk_create новых
+        records = {}
+        for record in batch:
+            email = CustomUser.objects.normalize_email(record.get('email'))
+            if not email:
+                self.stats['skipped'] += 1
+                continue
+            merged = records.setdefault(email, {**record, 'subscriptions': []})
+            merged['subscriptions'].extend(record.get('subscriptions') or [])
+
+        user_ids = dict(CustomUser.objects.filter(email__in=records).values_list('email', 'id'))
+        self.stats['users_existing'] += len(user_ids)
+
+        new_users = [
+            CustomUser(
+                email=email,
+                username=self.usernames.allocate(email),
+                first_name=record.get('first_name') or '',
+                last_name=record.get('last_name') or '',
+                password=self.resolve_password(record.get('password')),
+                email_notifications=parse_bool(record.get('email_notifications')),
+            )
+            for email, record in records.items()
+            if email not in user_ids
+        ]
+        CustomUser.objects.bulk_create(new_users, batch_size=self.batch_size)
+        for user in new_users:
+            user_ids[user.email] = user.id
+        self.stats['users_created'] += len(new_users)
+
+        # Подписки: уникальность (user, drug, city) проверяет индекс, но NULL-города
+        # он не сравнивает, поэтому подписки "во всех городах" сверяются вручную
+        existing_without_city = set(
+            UserSubscription.objects.filter(
+                user_id__in=user_ids.values(), city__isnull=True
+            ).values_list('user_id', 'drug_id')
+        )
+        subscriptions = {}
+        for email, record in records.items():
+            user_id = user_ids[email]
+            for item in record['subscriptions']:
+                try:
+                    drug_id = int(item.get('drug_id'))
+                    max_price = Decimal(str(item['max_price'])) if item.get('max_price') not in (None, '') else None
+                except (TypeError, ValueError, InvalidOperation):
+                    self.stats['skipped'] += 1
+                    continue
+                if drug_id not in self.drug_ids:
+                    self.stats['skipped'] += 1
+                    continue
+                city_id = self.resolve_city(item.get('city'))
+                if city_id is None and (user_id, drug_id) in existing_without_city and not self.update:
+                    continue
+                subscriptions[(user_id, drug_id, city_id)] = UserSubscription(
+                    user_id=user_id,
+                    drug_id=drug_id,
+                    city_id=city_id,
+                    max_price=max_price,
+                    is_active=parse_bool(item.get('is_active')),
+                )
+
+        without_city = [s for s in subscriptions.values() if s.city_id is None]
+        with_city = [s for s in subscriptions.values() if s.city_id is not None]
+
+        if self.update:
+            UserSubscription.objects.bulk_create(
+                with_city,
+                batch_size=self.batch_size,
+                update_conflicts=True,
+                unique_fields=['user', 'drug', 'city'],
+                update_fields=['max_price', 'is_active'],
+            )
+            for subscription in without_city:
+                if (subscription.user_id, subscription.drug_id) in existing_without_city:
+                    UserSubscription.objects.filter(
+                        user_id=subscription.user_id, drug_id=subscription.drug_id, city__isnull=True
+                    ).update(max_price=subscription.max_price, is_active=subscription.is_active)
+            without_city = [
+                s for s in without_city
+                if (s.user_id, s.drug_id) not in existing_without_city
+            ]
+        else:
+            UserSubscription.objects.bulk_create(with_city, batch_size=self.batch_size, ignore_conflicts=True)
+        UserSubscription.objects.bulk_create(without_city, batch_size=self.batch_size)
+
+        self.stats['subscriptions'] += len(subscriptions)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from drugs.models import PartnerToken, PharmacyNetwork
+
+
+class Command(BaseCommand):
+    help = 'Выпуск ключа доступа партнера к приему остатков (/drugs/api/offers/)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('network_id', type=int, help='id аптечной сети партнера')
+        parser.add_argument('--source', required=True, help='Источник внешних кодов аптек и препаратов (ExternalId.source)')
+        parser.add_argument('--name', help='Название ключа (по умолчанию - название сети)')
+
+    def handle(self, *args, **options):
+        network = PharmacyNetwork.objects.filter(id=options['network_id']).first()
+        if network is None:
+            raise CommandError(f'Сеть {options["network_id"]} не найдена')
+        token, key = PartnerToken.issue(network, options['source'], options['name'] or network.name)
+        self.stdout.write(f'Ключ "{token.name}" для сети {network} (показывается один раз):')
+        self.stdout.write(key)
@@ -0,0 +1,94 @@
+import csv
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from drugs.idmaps import external_ids, prune_unmatched
+from drugs.ingest import CODE_MAX_LENGTH
+from drugs.models import Drug, ExternalId, Pharmacy
+
+CSV_FIELDS = ['kind', 'code', 'object_id']
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Загрузка соответствий внешних кодов (CSV: kind,code,object_id; kind - drug или pharmacy). '
+        'Строки без object_id пропускаются - так можно загрузить заполненный отчет reconcile_external_ids'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл CSV')
+        parser.add_argument('--source', required=True, help='Источник кодов (ExternalId.source)')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Количество строк в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        source = options['source']
+        loaded = skipped = 0
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            reader = csv.DictReader(stream)
+            missing = set(CSV_FIELDS) - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f'В файле нет колонок: {", ".join(sorted(missing))}')
+            for batch in batched(reader, options['batch_size']):
+                rows = []
+                for row in batch:
+                    kind = (row['kind'] or '').strip()
+                    code = (row['code'] or '').strip()
+                    object_id = (row['object_id'] or '').strip()
+                    if not object_id:
+                        skipped += 1
+                        continue
+                    if (
+                        kind not in (ExternalId.DRUG, ExternalId.PHARMACY)
+                        or not code or len(code) > CODE_MAX_LENGTH or not object_id.isdigit()
+                    ):
+                        raise CommandError(f'Строка {reader.line_num}: некорректное соответствие {row}')
+                    rows.append((kind, code, int(object_id)))
+                loaded += self.load(source, rows)
+        # Сигналы bulk_create не отправляются: словари кодов сбрасываются явно
+        external_ids.invalidate()
+        resolved = prune_unmatched(source)
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено соответствий: {loaded}, пропущено строк без id: {skipped}, '
+            f'снято со сверки кодов: {resolved}'
+        ))
+
+    def load(self, source, rows):
+        drug_ids = set(Drug.objects.filter(
+            id__in={object_id for kind, _, object_id in rows if kind == ExternalId.DRUG}
+        ).values_list('id', flat=True))
+        pharmacy_ids = set(Pharmacy.objects.filter(
+            id__in={object_id for kind, _, object_id in rows if kind == ExternalId.PHARMACY}
+        ).values_list('id', flat=True))
+        objects = []
+        for kind, code, object_id in rows:
+            known = drug_ids if kind == ExternalId.DRUG else pharmacy_ids
+            if object_id not in known:
+                raise CommandError(f'{kind} {object_id} для кода {code!r} не найден')
+            objects.append(ExternalId(
+                source=source,
+                kind=kind,
+                code=code,
+                drug_id=object_id if kind == ExternalId.DRUG else None,
+                pharmacy_id=object_id if kind == ExternalId.PHARMACY else None,
+            ))
+        with transaction.atomic():
+            ExternalId.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=['source', 'kind', 'code'],
+                update_fields=['drug', 'pharmacy'],
+            )
+        return len(objects)
@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+
+from drugs.dedup import CHUNK_SIZE, duplicate_groups, merge_drugs, refresh_fingerprints
+from drugs.models import Drug
+
+
+class Command(BaseCommand):
+    help = 'Объединение дублей препаратов с одинаковым нормализованным ключом (Drug.fingerprint)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать группы дублей, ничего не изменяя',
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Объединить без подтверждения (для запуска из скриптов)',
+        )
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            help='Сначала пересчитать ключи всех препаратов (после изменения правил нормализации)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Сколько ключей пересчитывается одним запросом',
+        )
+
+    def handle(self, *args, **options):
+        if options['refresh']:
+            self.stdout.write(f'Пересчитано ключей: {refresh_fingerprints(options["batch_size"])}')
+
+        groups = duplicate_groups()
+        for target_id, *duplicate_ids in groups:
+            names = dict(
+                Drug.objects.filter(id__in=[target_id, *duplicate_ids])
+                .values_list('id', 'trade_name')
+            )
+            self.stdout.write(
+                f'{target_id} {names.get(target_id)!r} <- '
+                + ', '.join(f'{drug_id} {names.get(drug_id)!r}' for drug_id in duplicate_ids)
+            )
+
+        if options['dry_run'] or not groups:
+            self.stdout.write(f'Групп дублей: {len(groups)}')
+            return
+        # Объединение необратимо: группы сначала показываются, а затем подтверждаются
+        if options['interactive']:
+            answer = input(f'Объединить {len(groups)} групп дублей? Это необратимо. Введите "yes" для продолжения: ')
+            if answer != 'yes':
+                self.stdout.write('Отменено')
+                return
+
+        merged = 0
+        for target_id, *duplicate_ids in groups:
+            stats = merge_drugs(target_id, duplicate_ids)
+            merged += len(duplicate_ids)
+            self.stdout.write(
+                f'{target_id}: предложений перенесено {stats["availability"]}, '
+                f'объединено {stats["availability_collapsed"]}, '
+                f'связей аналогов удалено {stats["analogues_removed"]}, '
+                f'подписок объединено {stats["subscriptions_removed"]}, '
+                f'внешних кодов перенесено {stats["external_ids"]}'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Групп дублей: {len(groups)}, объединено препаратов: {merged}'))
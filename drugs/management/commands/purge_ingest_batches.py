@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from drugs.push import purge_batches
+
+
+class Command(BaseCommand):
+    help = 'Удаляет записи о принятых пачках остатков старше INGEST_IDEMPOTENCY_HOURS'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Удалено записей о пачках: {purge_batches()}')
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from drugs.cards import rebuild_cards
+from drugs.models import Drug
+from drugs.routers import use_primary
+
+
+class Command(BaseCommand):
+    help = 'Полная пересборка карточек препаратов (read model для страницы препарата)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drug-id',
+            type=int,
+            action='append',
+            help='ID препарата (можно указать несколько раз)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько карточек сохранять одним запросом',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with use_primary():
+            drug_ids = options['drug_id'] or list(Drug.objects.order_by('id').values_list('id', flat=True))
+            batch_size = options['batch_size']
+            built = 0
+            for start in range(0, len(drug_ids), batch_size):
+                built += rebuild_cards(drug_ids[start:start + batch_size])
+                self.stdout.write(f'Собрано карточек: {built} из {len(drug_ids)}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересборка завершена за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,70 @@
+import csv
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from drugs.idmaps import prune_unmatched, unmatched_codes
+from drugs.models import ExternalId
+
+from .load_external_ids import CSV_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Сверка внешних кодов: сколько сопоставлено и какие коды из загрузок не найдены'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help='Только этот источник')
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Сколько несопоставленных кодов показать по каждому источнику',
+        )
+        parser.add_argument(
+            '--csv',
+            help='Выгрузить несопоставленные коды в CSV (kind,code,object_id) для load_external_ids',
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='Удалить из сверки коды, которые уже сопоставлены',
+        )
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if options['prune']:
+            self.stdout.write(f'Снято со сверки кодов: {prune_unmatched(source)}')
+
+        mapped = ExternalId.objects.all()
+        pending = unmatched_codes(source)
+        if source:
+            mapped = mapped.filter(source=source)
+        counts = {}
+        for row in mapped.values('source', 'kind').annotate(count=Count('id')).order_by():
+            counts.setdefault(row['source'], {}).setdefault('mapped', {})[row['kind']] = row['count']
+        for row in pending.values('source', 'kind').annotate(count=Count('id'), rows=Sum('rows')).order_by():
+            counts.setdefault(row['source'], {}).setdefault('unmatched', {})[row['kind']] = (row['count'], row['rows'])
+
+        for name in sorted(counts):
+            summary = counts[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for kind, label in ExternalId.KIND_CHOICES:
+                known = summary.get('mapped', {}).get(kind, 0)
+                codes, rows = summary.get('unmatched', {}).get(kind, (0, 0))
+                self.stdout.write(
+                    f'  {label}: сопоставлено {known}, не найдено {codes} '
+                    f'(строк в последних загрузках: {rows or 0})'
+                )
+            for code in pending.filter(source=name)[:options['top']]:
+                self.stdout.write(
+                    f'    {code.get_kind_display()} {code.code!r}: строк {code.rows}, '
+                    f'встречается с {code.first_seen:%Y-%m-%d %H:%M}, последний раз {code.last_seen:%Y-%m-%d %H:%M}'
+                )
+
+        if options['csv']:
+            with open(options['csv'], 'w', encoding='utf-8', newline='') as stream:
+                writer = csv.writer(stream)
+                writer.writerow(['source', *CSV_FIELDS, 'rows'])
+                for code in pending.iterator():
+                    writer.writerow([code.source, code.kind, code.code, '', code.rows])
+            self.stdout.write(f'Несопоставленные коды выгружены в {options["csv"]}')
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from drugs import feeds
+from drugs.ingest import BATCH_SIZE
+from drugs.models import NetworkFeed
+
+
+def _seconds(value):
+    return '-' if value is None else f'{value:.0f}'
+
+
+class Command(BaseCommand):
+    help = 'Загрузка остатков из выгрузок аптечных сетей по расписанию (drugs.feeds)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Сколько сетей загружать параллельно (по умолчанию FEED_WORKERS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Сколько строк применять одной транзакцией',
+        )
+        parser.add_argument(
+            '--network',
+            type=int,
+            action='append',
+            help='Загрузить выгрузку сети с этим id сейчас, без учета расписания (можно несколько раз)',
+        )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            help='Работать постоянно, опрашивая расписание',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Пауза между опросами расписания в режиме --follow, секунд',
+        )
+        parser.add_argument(
+            '--report',
+            action='store_true',
+            help='Только показать состояние загрузок по сетям',
+        )
+
+    def handle(self, *args, **options):
+        if options['report']:
+            self.print_report()
+            return
+
+        if options['network']:
+            feed_ids = dict(
+                NetworkFeed.objects.filter(network_id__in=options['network']).values_list('network_id', 'id')
+            )
+            unknown = set(options['network']) - set(feed_ids)
+            if unknown:
+                raise CommandError(f'У сетей нет выгрузки: {", ".join(map(str, sorted(unknown)))}')
+            for network_id, feed_id in feed_ids.items():
+                run = feeds.run_feed(feed_id, force=True, batch_size=options['batch_size'])
+                if run is None:
+                    self.stdout.write(self.style.WARNING(f'Сеть {network_id}: выгрузку уже загружает другой обработчик'))
+            self.print_report()
+            return
+
+        scheduler = feeds.Scheduler(options['workers'], options['batch_size'])
+        scheduler.serve(options['interval'], once=not options['follow'])
+        self.print_report()
+
+    def print_report(self):
+        self.stdout.write('Сеть | статус | строк | отклонено | строк/с | задержка старта, с | возраст данных, с | опоздание, с')
+        for row in feeds.report():
+            status = 'выполняется' if row['running'] else (row['status'] or 'не загружалась')
+            self.stdout.write(
+                f"{row['network']} | {status} | {row['rows']} | {row['rejected']} | "
+                f"{row['rows_per_second']:.0f} | {_seconds(row['start_lag'])} | "
+                f"{_seconds(row['data_age'])} | {_seconds(row['overdue'])}"
+            )
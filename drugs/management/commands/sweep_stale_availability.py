@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from drugs.bulk import sweep_stale
+from drugs.freshness import stale_querysets
+
+
+class Command(BaseCommand):
+    help = 'Снимает с наличия предложения, не обновлявшиеся дольше срока актуальности сети'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать устаревшие предложения',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            stale = sum(queryset.count() for queryset in stale_querysets())
+            self.stdout.write(f'Устаревших предложений в наличии: {stale}')
+            return
+
+        started = time.monotonic()
+        swept = sweep_stale()
+        self.stdout.write(self.style.SUCCESS(
+            f'Снято с наличия: {swept} за {time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,134 @@
+# Generated by Django 5.2 on 2026-10-19
+
+from collections import Counter, defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def normalize(name):
+    return ' '.join(name.split()).casefold().replace('ё', 'е')
+
+
+def cities_forward(apps, schema_editor):
+    """Переносит строковые города в справочник City, объединяя варианты написания"""
+    City = apps.get_model('drugs', 'City')
+    Pharmacy = apps.get_model('drugs', 'Pharmacy')
+    UserSubscription = apps.get_model('drugs', 'UserSubscription')
+
+    # Все варианты написания с количеством использований
+    variants = defaultdict(Counter)
+    for model in (Pharmacy, UserSubscription):
+        for value in model.objects.exclude(city__isnull=True).values_list('city', flat=True):
+            name = ' '.join(value.split())
+            if name:
+                variants[normalize(name)][name] += 1
+
+    # Каноническое название - самый частый вариант
+    city_ids = {}
+    for key, counter in variants.items():
+        name = counter.most_common(1)[0][0]
+        city_ids[key] = City.objects.create(name=name, normalized_name=key).id
+
+    for pharmacy in Pharmacy.objects.only('id', 'city'):
+        key = normalize(pharmacy.city or '')
+        if not key:
+            key = normalize('Не указан')
+            if key not in city_ids:
+                city_ids[key] = City.objects.create(name='Не указан', normalized_name=key).id
+        Pharmacy.objects.filter(id=pharmacy.id).update(city_ref_id=city_ids[key])
+
+    # Подписки, ставшие дубликатами после объединения городов, схлопываются:
+    # остается активная, а среди равных - самая ранняя
+    kept = {}
+    for subscription in UserSubscription.objects.order_by('-is_active', 'id'):
+        key = normalize(subscription.city or '')
+        city_id = city_ids.get(key)
+        unique_key = (subscription.user_id, subscription.drug_id, city_id)
+        if unique_key in kept:
+            subscription.delete()
+            continue
+        kept[unique_key] = subscription.id
+        if city_id:
+            UserSubscription.objects.filter(id=subscription.id).update(city_ref_id=city_id)
+
+
+def cities_backward(apps, schema_editor):
+    City = apps.get_model('drugs', 'City')
+    Pharmacy = apps.get_model('drugs', 'Pharmacy')
+    UserSubscription = apps.get_model('drugs', 'UserSubscription')
+
+    names = dict(City.objects.values_list('id', 'name'))
+    for model in (Pharmacy, UserSubscription):
+        for obj_id, city_id in model.objects.exclude(city_ref__isnull=True).values_list('id', 'city_ref_id'):
+            model.objects.filter(id=obj_id).update(city=names[city_id])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0002_customuser_username_alter_customuser_date_joined'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('normalized_name', models.CharField(max_length=100, unique=True, verbose_name='Нормализованное название')),
+            ],
+            options={
+                'verbose_name': 'Город',
+                'verbose_name_plural': 'Города',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='usersubscription',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='pharmacy',
+            name='city_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='drugs.city'),
+        ),
+        migrations.AddField(
+            model_name='usersubscription',
+            name='city_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='drugs.city'),
+        ),
+        migrations.RunPython(cities_forward, cities_backward),
+        migrations.RemoveField(
+            model_name='pharmacy',
+            name='city',
+        ),
+        migrations.RemoveField(
+            model_name='usersubscription',
+            name='city',
+        ),
+        migrations.RenameField(
+            model_name='pharmacy',
+            old_name='city_ref',
+            new_name='city',
+        ),
+        migrations.RenameField(
+            model_name='usersubscription',
+            old_name='city_ref',
+            new_name='city',
+        ),
+        migrations.AlterField(
+            model_name='pharmacy',
+            name='city',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='drugs.city', verbose_name='Город'),
+        ),
+        migrations.AlterField(
+            model_name='usersubscription',
+            name='city',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='drugs.city', verbose_name='Город'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='usersubscription',
+            unique_together={('user', 'drug', 'city')},
+        ),
+    ]
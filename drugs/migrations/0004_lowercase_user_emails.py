@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19
+
+from django.db import migrations
+
+
+def lowercase_emails(apps, schema_editor):
+    """Приводит email к нижнему регистру (вход теперь ищет по нормализованному email)"""
+    CustomUser = apps.get_model('drugs', 'CustomUser')
+    existing = set(CustomUser.objects.values_list('email', flat=True))
+    for user_id, email in CustomUser.objects.values_list('id', 'email'):
+        normalized = email.strip().lower()
+        if normalized == email:
+            continue
+        # Если такой email уже занят другим аккаунтом, оставляем запись как есть:
+        # объединять аккаунты автоматически небезопасно
+        if normalized in existing:
+            continue
+        CustomUser.objects.filter(id=user_id).update(email=normalized)
+        existing.discard(email)
+        existing.add(normalized)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0003_city'),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+    ]
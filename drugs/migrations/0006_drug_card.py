@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0005_admin_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrugCard',
+            fields=[
+                ('drug', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='drugs.drug', verbose_name='Препарат')),
+                ('data', models.JSONField(verbose_name='Данные карточки')),
+                ('built_at', models.DateTimeField(auto_now=True, verbose_name='Дата сборки')),
+            ],
+            options={
+                'verbose_name': 'Карточка препарата',
+                'verbose_name_plural': 'Карточки препаратов',
+            },
+        ),
+    ]
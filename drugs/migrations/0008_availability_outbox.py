@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0007_availability_offers_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('created', 'Добавлено'), ('updated', 'Изменено'), ('price_changed', 'Изменена цена'), ('deleted', 'Удалено')], max_length=20, verbose_name='Тип')),
+                ('availability_id', models.IntegerField(verbose_name='ID наличия')),
+                ('drug_id', models.IntegerField(verbose_name='ID препарата')),
+                ('pharmacy_id', models.IntegerField(verbose_name='ID аптеки')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, null=True, verbose_name='Цена')),
+                ('old_price', models.DecimalField(decimal_places=2, max_digits=10, null=True, verbose_name='Прежняя цена')),
+                ('quantity', models.IntegerField(null=True, verbose_name='Количество')),
+                ('is_available', models.BooleanField(null=True, verbose_name='В наличии')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата события')),
+            ],
+            options={
+                'verbose_name': 'Событие наличия',
+                'verbose_name_plural': 'События наличия',
+            },
+        ),
+        migrations.CreateModel(
+            name='OutboxOffset',
+            fields=[
+                ('consumer', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Потребитель')),
+                ('position', models.BigIntegerField(default=0, verbose_name='Позиция')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Позиция потребителя событий',
+                'verbose_name_plural': 'Позиции потребителей событий',
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0008_availability_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pharmacynetwork',
+            name='freshness_hours',
+            field=models.PositiveIntegerField(blank=True, help_text='Через сколько часов без обновления предложение считается устаревшим (пусто - STOCK_FRESHNESS_HOURS)', null=True, verbose_name='Срок актуальности остатков, ч'),
+        ),
+        migrations.AddIndex(
+            model_name='availability',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['last_updated'], name='availability_fresh_idx'),
+        ),
+    ]
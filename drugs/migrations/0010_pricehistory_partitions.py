@@ -0,0 +1,115 @@
+from datetime import datetime, timezone
+
+from django.db import migrations
+
+TABLE = 'drugs_pricehistory'
+
+# Секции на месяцы вперед, чтобы вставки не попадали в секцию по умолчанию
+PARTITIONS_AHEAD = 2
+
+
+def month_start(value):
+    value = value.astimezone(timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def create_indexes(cursor):
+    # Внешний ключ отложенный: после копирования строк его проверки ждут конца
+    # транзакции, а CREATE INDEX при ожидающих проверках PostgreSQL запрещает
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    cursor.execute(f'CREATE INDEX pricehistory_recorded_idx ON {TABLE} (recorded_at, id)')
+    cursor.execute(f'CREATE INDEX {TABLE}_availability_id_idx ON {TABLE} (availability_id)')
+
+
+def partition(apps, schema_editor):
+    """
+    PostgreSQL: drugs_pricehistory становится таблицей, секционированной по
+    месяцам recorded_at (drugs.history). Первичный ключ секционированной таблицы
+    обязан включать ключ секционирования, поэтому в БД он (id, recorded_at);
+    id по-прежнему уникален - его выдает одна последовательность.
+    На других СУБД история хранится без секций.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_unpartitioned')
+        # Имя первичного ключа освобождается для новой таблицы
+        cursor.execute(f'ALTER TABLE {TABLE}_unpartitioned RENAME CONSTRAINT {TABLE}_pkey TO {TABLE}_unpartitioned_pkey')
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0), MIN(recorded_at) FROM {TABLE}_unpartitioned')
+        last_id, first_recorded = cursor.fetchone()
+
+        cursor.execute(f'CREATE SEQUENCE {TABLE}_part_id_seq')
+        if last_id:
+            cursor.execute(f"SELECT setval('{TABLE}_part_id_seq', %s)", [last_id])
+        cursor.execute(f"""
+            CREATE TABLE {TABLE} (
+                id bigint NOT NULL DEFAULT nextval('{TABLE}_part_id_seq'),
+                price numeric(10, 2) NOT NULL,
+                recorded_at timestamp with time zone NOT NULL,
+                availability_id bigint NOT NULL
+                    REFERENCES drugs_availability (id) DEFERRABLE INITIALLY DEFERRED,
+                PRIMARY KEY (id, recorded_at)
+            ) PARTITION BY RANGE (recorded_at)
+        """)
+
+        now = datetime.now(timezone.utc)
+        month = month_start(first_recorded or now)
+        last_month = add_months(month_start(now), PARTITIONS_AHEAD)
+        while month <= last_month:
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)',
+                [month, add_months(month, 1)],
+            )
+            month = add_months(month, 1)
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+        cursor.execute(f"""
+            INSERT INTO {TABLE} (id, price, recorded_at, availability_id)
+            SELECT id, price, recorded_at, availability_id FROM {TABLE}_unpartitioned
+        """)
+        cursor.execute(f'DROP TABLE {TABLE}_unpartitioned')
+        cursor.execute(f'ALTER SEQUENCE {TABLE}_part_id_seq OWNED BY {TABLE}.id')
+        create_indexes(cursor)
+
+
+def unpartition(apps, schema_editor):
+    """Обратно в обычную таблицу (строки из архивных файлов не возвращаются)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_partitioned')
+        cursor.execute(f'ALTER TABLE {TABLE}_partitioned RENAME CONSTRAINT {TABLE}_pkey TO {TABLE}_partitioned_pkey')
+        cursor.execute(f"""
+            CREATE TABLE {TABLE} (
+                id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+                price numeric(10, 2) NOT NULL,
+                recorded_at timestamp with time zone NOT NULL,
+                availability_id bigint NOT NULL
+                    REFERENCES drugs_availability (id) DEFERRABLE INITIALLY DEFERRED
+            )
+        """)
+        cursor.execute(f"""
+            INSERT INTO {TABLE} (id, price, recorded_at, availability_id)
+            SELECT id, price, recorded_at, availability_id FROM {TABLE}_partitioned
+        """)
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), MAX(id)) FROM {TABLE} HAVING MAX(id) IS NOT NULL"
+        )
+        cursor.execute(f'DROP TABLE {TABLE}_partitioned CASCADE')
+        create_indexes(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0009_stock_freshness'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0010_pricehistory_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(help_text='http(s):// или file://; CSV или NDJSON, можно сжатый gzip', max_length=500, verbose_name='Адрес выгрузки')),
+                ('interval_minutes', models.PositiveIntegerField(default=60, verbose_name='Интервал загрузки, мин')),
+                ('priority', models.PositiveSmallIntegerField(default=100, help_text='Меньше - раньше. Загрузка, просроченная на целый интервал, поднимается в начало очереди', verbose_name='Приоритет')),
+                ('rate_limit', models.PositiveIntegerField(blank=True, help_text='Пусто - FEED_DEFAULT_RATE_LIMIT', null=True, verbose_name='Ограничение, строк/с')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активна')),
+                ('next_run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая загрузка')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='Заблокирована до')),
+                ('locked_by', models.CharField(blank=True, max_length=100, verbose_name='Кем заблокирована')),
+                ('network', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to='drugs.pharmacynetwork', verbose_name='Сеть')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка сети',
+                'verbose_name_plural': 'Выгрузки сетей',
+            },
+        ),
+        migrations.CreateModel(
+            name='FeedRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('success', 'Успешно'), ('failed', 'Ошибка')], default='running', max_length=20, verbose_name='Статус')),
+                ('scheduled_at', models.DateTimeField(verbose_name='Запланирована на')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Принято строк')),
+                ('rejected', models.PositiveIntegerField(default=0, verbose_name='Отклонено строк')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='drugs.networkfeed', verbose_name='Выгрузка')),
+            ],
+            options={
+                'verbose_name': 'Загрузка выгрузки',
+                'verbose_name_plural': 'Загрузки выгрузок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='networkfeed',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['next_run_at'], name='networkfeed_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedrun',
+            index=models.Index(fields=['feed', '-started_at'], name='feedrun_feed_started_idx'),
+        ),
+    ]
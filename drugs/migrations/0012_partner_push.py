@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0011_network_feeds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartnerToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='Источник внешних кодов (ExternalId.source)', max_length=50, verbose_name='Источник кодов')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('prefix', models.CharField(max_length=16, unique=True, verbose_name='Префикс')),
+                ('key_hash', models.CharField(max_length=64, verbose_name='Хэш ключа')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активен')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('last_used_at', models.DateTimeField(blank=True, null=True, verbose_name='Последнее использование')),
+                ('network', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='drugs.pharmacynetwork', verbose_name='Сеть')),
+            ],
+            options={
+                'verbose_name': 'Ключ партнера',
+                'verbose_name_plural': 'Ключи партнеров',
+            },
+        ),
+        migrations.CreateModel(
+            name='ExternalId',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, verbose_name='Источник')),
+                ('kind', models.CharField(choices=[('drug', 'Препарат'), ('pharmacy', 'Аптека')], max_length=20, verbose_name='Тип')),
+                ('code', models.CharField(max_length=100, verbose_name='Внешний код')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('drug', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='external_ids', to='drugs.drug', verbose_name='Препарат')),
+                ('pharmacy', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='external_ids', to='drugs.pharmacy', verbose_name='Аптека')),
+            ],
+            options={
+                'verbose_name': 'Внешний код',
+                'verbose_name_plural': 'Внешние коды',
+                'constraints': [models.UniqueConstraint(fields=('source', 'kind', 'code'), name='externalid_code_uniq'), models.CheckConstraint(condition=models.Q(models.Q(('drug__isnull', False), ('kind', 'drug'), ('pharmacy__isnull', True)), models.Q(('drug__isnull', True), ('kind', 'pharmacy'), ('pharmacy__isnull', False)), _connector='OR'), name='externalid_target_check')],
+            },
+        ),
+        migrations.CreateModel(
+            name='IngestBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, verbose_name='Ключ идемпотентности')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата приема')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Принято строк')),
+                ('rejected', models.PositiveIntegerField(default=0, verbose_name='Отклонено строк')),
+                ('response', models.JSONField(default=dict, verbose_name='Ответ')),
+                ('token', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='drugs.partnertoken', verbose_name='Ключ партнера')),
+            ],
+            options={
+                'verbose_name': 'Пачка остатков',
+                'verbose_name_plural': 'Пачки остатков',
+                'unique_together': {('token', 'key')},
+            },
+        ),
+    ]
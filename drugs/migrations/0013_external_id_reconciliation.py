@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0012_partner_push'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networkfeed',
+            name='source',
+            field=models.CharField(blank=True, help_text='Источник внешних кодов (ExternalId.source): строки с полями pharmacy и drug. Пусто - строки с pharmacy_id и drug_id', max_length=50, verbose_name='Источник кодов'),
+        ),
+        migrations.CreateModel(
+            name='UnmatchedCode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, verbose_name='Источник')),
+                ('kind', models.CharField(choices=[('drug', 'Препарат'), ('pharmacy', 'Аптека')], max_length=20, verbose_name='Тип')),
+                ('code', models.CharField(max_length=100, verbose_name='Внешний код')),
+                ('first_seen', models.DateTimeField(verbose_name='Впервые встречен')),
+                ('last_seen', models.DateTimeField(verbose_name='Последний раз встречен')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='Строк в последней загрузке')),
+            ],
+            options={
+                'verbose_name': 'Несопоставленный код',
+                'verbose_name_plural': 'Несопоставленные коды',
+                'constraints': [models.UniqueConstraint(fields=('source', 'kind', 'code'), name='unmatchedcode_code_uniq')],
+            },
+        ),
+    ]
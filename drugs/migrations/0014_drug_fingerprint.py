@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:34
+
+from django.db import migrations, models
+
+# Ключи существующих препаратов заполняет миграция 0016 (по замороженной копии
+# правил нормализации); здесь только поле, без пересчета по живому модулю
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0013_external_id_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drug',
+            name='fingerprint',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=40, verbose_name='Ключ дедупликации'),
+        ),
+    ]
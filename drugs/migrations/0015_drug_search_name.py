@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+from drugs.migrations._frozen_normalization import normalize_text
+
+
+def fill_search_names(apps, schema_editor):
+    """Строка автодополнения для существующих препаратов (как Drug.search_key)"""
+    Drug = apps.get_model('drugs', 'Drug')
+    drugs = []
+    rows = Drug.objects.values_list('id', 'trade_name', 'mnn', 'manufacturer')
+    for drug_id, trade_name, mnn, manufacturer in rows.iterator(chunk_size=5000):
+        drugs.append(Drug(id=drug_id, search_name=normalize_text(f'{trade_name} {mnn} {manufacturer}')))
+        if len(drugs) == 5000:
+            Drug.objects.bulk_update(drugs, ['search_name'])
+            drugs = []
+    Drug.objects.bulk_update(drugs, ['search_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0014_drug_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drug',
+            name='search_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=800, verbose_name='Строка поиска'),
+        ),
+        migrations.RunPython(fill_search_names, migrations.RunPython.noop),
+    ]
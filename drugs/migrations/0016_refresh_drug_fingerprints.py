@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from drugs.migrations._frozen_normalization import fingerprint
+
+
+def refresh_fingerprints(apps, schema_editor):
+    """
+    Ключи существующих препаратов по правилам на момент миграции (копия в
+    _frozen_normalization): дозировка с объемом заполнения, числом в упаковке
+    и всеми веществами комбинации. Прежние ключи совпадали у разных упаковок,
+    и get_or_create_normalized мог найти чужую карточку
+    """
+    Drug = apps.get_model('drugs', 'Drug')
+    drugs = []
+    rows = Drug.objects.values_list('id', 'fingerprint', 'trade_name', 'form', 'dosage', 'manufacturer')
+    for drug_id, current, *fields in rows.iterator(chunk_size=5000):
+        key = fingerprint(*fields)
+        if key != current:
+            drugs.append(Drug(id=drug_id, fingerprint=key))
+        if len(drugs) == 5000:
+            Drug.objects.bulk_update(drugs, ['fingerprint'])
+            drugs = []
+    Drug.objects.bulk_update(drugs, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0015_drug_search_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(refresh_fingerprints, migrations.RunPython.noop),
+    ]
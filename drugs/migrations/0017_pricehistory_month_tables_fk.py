@@ -0,0 +1,51 @@
+import re
+
+from django.db import migrations
+
+TABLE = 'drugs_pricehistory'
+MONTH_TABLE_RE = re.compile(rf'^{TABLE}_p\d{{6}}$')
+
+
+def add_foreign_keys(apps, schema_editor):
+    """
+    SQLite: таблицы истории по месяцам (drugs.history.split_cold_months) создавались
+    без внешнего ключа на drugs_availability, и после удаления строки наличия ее
+    история оставалась в них. Таблицы пересоздаются с ключом ON DELETE CASCADE,
+    строки удаленных предложений не переносятся.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for table in connection.introspection.table_names(cursor):
+            if not MONTH_TABLE_RE.match(table):
+                continue
+            cursor.execute(f'PRAGMA foreign_key_list("{table}")')
+            if cursor.fetchall():
+                continue
+            cursor.execute(f'ALTER TABLE "{table}" RENAME TO "{table}_old"')
+            cursor.execute(f'DROP INDEX IF EXISTS "{table}_availability"')
+            cursor.execute(
+                f'CREATE TABLE "{table}" ('
+                'id integer NOT NULL PRIMARY KEY, '
+                'availability_id bigint NOT NULL REFERENCES "drugs_availability" (id) ON DELETE CASCADE, '
+                'price decimal NOT NULL, recorded_at datetime NOT NULL)'
+            )
+            cursor.execute(
+                f'INSERT INTO "{table}" (id, availability_id, price, recorded_at) '
+                f'SELECT id, availability_id, price, recorded_at FROM "{table}_old" '
+                'WHERE availability_id IN (SELECT id FROM "drugs_availability")'
+            )
+            cursor.execute(f'DROP TABLE "{table}_old"')
+            cursor.execute(f'CREATE INDEX "{table}_availability" ON "{table}" (availability_id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0016_refresh_drug_fingerprints'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_foreign_keys, migrations.RunPython.noop),
+    ]
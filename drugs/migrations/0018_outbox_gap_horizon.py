@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drugs', '0017_pricehistory_month_tables_fk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxoffset',
+            name='gap_seen_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Пропуск обнаружен'),
+        ),
+        migrations.AddField(
+            model_name='outboxoffset',
+            name='gap_until',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Пропуски до события'),
+        ),
+        migrations.AddField(
+            model_name='outboxoffset',
+            name='gap_xmax',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Граница транзакций при обнаружении пропуска'),
+        ),
+    ]
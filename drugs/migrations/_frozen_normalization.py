@@ -0,0 +1,172 @@
+"""
+Копия drugs.normalization на момент миграций 0015 и 0016.
+
+Миграции считают Drug.search_name и Drug.fingerprint по правилам своего
+времени: импорт живого модуля менял бы результат старых миграций при каждом
+изменении правил. Модуль не меняется; новые правила пересчитываются новой
+миграцией со своей копией или командой merge_duplicate_drugs --refresh.
+Имя начинается с "_", поэтому загрузчик миграций его пропускает.
+"""
+import hashlib
+import re
+from decimal import Decimal
+
+# Канонические формы выпуска и их написания (после normalize_text, без точек)
+FORM_ALIASES = {
+    'таблетки': ('таб', 'табл', 'таблетка', 'таблетки', 'tab', 'tabs', 'tablet', 'tablets'),
+    'капсулы': ('капс', 'капсула', 'капсулы', 'cap', 'caps', 'capsule', 'capsules'),
+    'раствор': ('р-р', 'рр', 'раствор', 'sol', 'solution'),
+    'сироп': ('сироп', 'syrup'),
+    'суспензия': ('сусп', 'суспензия', 'suspension'),
+    'капли': ('капли', 'drops'),
+    'спрей': ('спрей', 'spray'),
+    'мазь': ('мазь', 'ointment'),
+    'крем': ('крем', 'cream'),
+    'гель': ('гель', 'gel'),
+    'порошок': ('пор', 'порошок', 'powder'),
+    'суппозитории': ('супп', 'свечи', 'суппозитории', 'suppositories'),
+    'ампулы': ('амп', 'ампулы', 'ampoules'),
+}
+
+# Уточнения формы: написание (после удаления точек) -> канонический вид
+FORM_PHRASES = (
+    ('покрытые пленочной оболочкой', 'п/о'),
+    ('покрытые оболочкой', 'п/о'),
+    ('пленочной оболочкой', 'п/о'),
+    ('п/пл/о', 'п/о'),
+    ('п п о', 'п/о'),
+    ('ппо', 'п/о'),
+    ('п о', 'п/о'),
+    ('для инъекций', 'д/ин'),
+    ('д/инъекций', 'д/ин'),
+    ('для приема внутрь', 'внутрь'),
+    ('кишечнорастворимые', 'кр'),
+    ('шипучие', 'шип'),
+)
+
+# Единицы дозировки: написание -> (каноническая единица, множитель к ней)
+UNITS = {
+    'г': ('мг', Decimal(1000)), 'гр': ('мг', Decimal(1000)), 'g': ('мг', Decimal(1000)),
+    'мг': ('мг', Decimal(1)), 'mg': ('мг', Decimal(1)),
+    'мкг': ('мг', Decimal('0.001')), 'mcg': ('мг', Decimal('0.001')),
+    'µg': ('мг', Decimal('0.001')), 'μg': ('мг', Decimal('0.001')), 'ug': ('мг', Decimal('0.001')),
+    'л': ('мл', Decimal(1000)), 'l': ('мл', Decimal(1000)),
+    'мл': ('мл', Decimal(1)), 'ml': ('мл', Decimal(1)),
+    'ме': ('ме', Decimal(1)), 'me': ('ме', Decimal(1)), 'iu': ('ме', Decimal(1)),
+    'ед': ('ме', Decimal(1)), 'тыс.ме': ('ме', Decimal(1000)),
+    '%': ('%', Decimal(1)),
+}
+
+# Организационно-правовые формы производителя: не влияют на ключ
+LEGAL_FORMS = {
+    'ао', 'оао', 'зао', 'пао', 'ооо', 'нпо', 'фгуп',
+    'ag', 'gmbh', 'ltd', 'inc', 'llc', 'plc', 'sa', 'spa', 'corp', 'co', 'kg', 'bv', 'nv', 'as', 'dd',
+}
+
+_ALIASES = {alias: canonical for canonical, aliases in FORM_ALIASES.items() for alias in aliases}
+_NUMBER = r'\d+(?:\.\d+)?'
+_UNIT = '(?:' + '|'.join(sorted(map(re.escape, UNITS), key=len, reverse=True)) + r')(?![a-zа-я])'
+# Части дозировки по порядку: '+' между веществами; число без единицы перед
+# '/' ('160/4,5 мкг' - единица берется у следующего количества); количество;
+# знаменатель концентрации ('/5 мл', '/доза'); число доз во флаконе ('120 доз');
+# число в упаковке ('№10', 'x10', '10 шт')
+_DOSAGE_TOKEN_RE = re.compile(
+    r'(?P<plus>\+)'
+    rf'|(?P<bare>{_NUMBER})\s*/\s*(?={_NUMBER}\s*{_UNIT})'
+    rf'|(?P<number>{_NUMBER})\s*(?P<unit>{_UNIT})'
+    rf'|/\s*(?P<per_number>{_NUMBER})?\s*(?P<per_unit>мл|ml|г|g|доза|доз|dose)(?![a-zа-я])'
+    r'|(?<![a-zа-я])(?:№|n|x|х|\*)\s*(?P<pack>\d+)(?![\d.])'
+    r'|(?P<doses>\d+)\s*(?:доз|доза|dose|doses)(?![a-zа-я])'
+    r'|(?P<count>\d+)\s*шт(?![a-zа-я])'
+)
+_PER_UNITS = {'ml': 'мл', 'g': 'г', 'доз': 'доза', 'dose': 'доза'}
+
+
+def normalize_text(value):
+    """Нижний регистр, ё -> е, без знаков ®/™ и кавычек, одиночные пробелы"""
+    value = (value or '').casefold().replace('ё', 'е')
+    value = re.sub(r'[®™©"«»\'`]', ' ', value)
+    return ' '.join(value.split())
+
+
+def _number(value):
+    """Число без лишних нулей и экспоненты: 500, 0.25"""
+    return format(value.normalize(), 'f')
+
+
+def canonical_form(value):
+    """Форма выпуска: 'Табл. п.п.о.' -> 'таблетки п/о'"""
+    value = ' '.join(re.sub(r'[.,;]+', ' ', normalize_text(value)).split())
+    for phrase, canonical in FORM_PHRASES:
+        value = re.sub(rf'(?<![\w/]){re.escape(phrase)}(?![\w/])', canonical, value)
+    words = value.split()
+    if words:
+        words[0] = _ALIASES.get(words[0], words[0])
+    return ' '.join(words)
+
+
+def canonical_dosage(value):
+    """
+    Дозировка: количества переводятся в мг/мл/МЕ, вещества комбинации - через '+',
+    знаменатель концентрации - через '/', объем заполнения и число в упаковке
+    сохраняются после пробела. '0,5 г' -> '500 мг', '875мг+125мг' -> '875 мг+125 мг',
+    '5 mg/ml 2 ml' -> '5 мг/мл 2 мл', '500 мг №10' -> '500 мг №10'.
+    Если после разбора в строке остались цифры, дозировка не распознана и
+    возвращается только нормализованной: лучше не склеить варианты написания,
+    чем склеить разные упаковки.
+    """
+    value = normalize_text(value).replace(',', '.')
+    groups = []
+    bare = []
+    join = False
+    rest = value
+    for match in _DOSAGE_TOKEN_RE.finditer(value):
+        rest = rest[:match.start()] + ' ' * (match.end() - match.start()) + rest[match.end():]
+        if match['plus']:
+            join = True
+        elif match['bare']:
+            bare.append(Decimal(match['bare']))
+        elif match['number']:
+            canonical, factor = UNITS[match['unit']]
+            amounts = [f'{_number(number * factor)} {canonical}' for number in (*bare, Decimal(match['number']))]
+            if join and groups:
+                groups[-1].extend(amounts)
+            else:
+                groups.append(amounts)
+            bare = []
+            join = False
+        elif match['per_unit']:
+            if not groups:
+                return value
+            number = match['per_number']
+            unit = _PER_UNITS.get(match['per_unit'], match['per_unit'])
+            groups[-1][-1] += f'/{_number(Decimal(number))} {unit}' if number and Decimal(number) != 1 else f'/{unit}'
+        elif match['doses']:
+            groups.append([f'{int(match["doses"])} доз'])
+        else:
+            groups.append([f'№{int(match["pack"] or match["count"])}'])
+    if not groups or bare or re.search(r'\d', rest):
+        return value
+    return ' '.join('+'.join(amounts) for amounts in groups)
+
+
+def normalize_manufacturer(value):
+    """Производитель без организационно-правовой формы и пунктуации: 'ОАО "Фармстандарт"' -> 'фармстандарт'"""
+    words = re.sub(r'[^\w\s]', ' ', normalize_text(value)).split()
+    return ' '.join(word for word in words if word not in LEGAL_FORMS)
+
+
+def normalize_trade_name(value):
+    """Торговое название: 'Но-шпа®' и 'НО-ШПА' дают 'но шпа'"""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', normalize_text(value)).split())
+
+
+def fingerprint(trade_name, form, dosage, manufacturer):
+    """Ключ препарата (sha1, 40 символов): совпадает у карточек, отличающихся только написанием"""
+    key = '|'.join((
+        normalize_trade_name(trade_name),
+        canonical_form(form),
+        canonical_dosage(dosage),
+        normalize_manufacturer(manufacturer),
+    ))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
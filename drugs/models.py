@@ -1,32 +1,57 @@
-from django.db import models
+import hashlib
+import hmac
+import secrets
+
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.mail import send_mail
 from django.conf import settings
+from django.utils import timezone
+
+from .normalization import fingerprint, normalize_text
+from .usernames import next_free_username, username_base
 
 
 class CustomUserManager(BaseUserManager):
     """Кастомный менеджер для модели пользователя с email аутентификацией"""
     
+    # Сколько раз пересчитывать username при гонке регистраций
+    USERNAME_ATTEMPTS = 5
+    
+    @classmethod
+    def normalize_email(cls, email):
+        """Email хранится целиком в нижнем регистре, чтобы вход не зависел от регистра"""
+        return (email or '').strip().lower()
+    
     def create_user(self, email, password=None, **extra_fields):
         """Создание обычного пользователя"""
         if not email:
             raise ValueError('Email обязателен для регистрации')
         email = self.normalize_email(email)
         
-        # Генерируем username из email если не указан
-        if 'username' not in extra_fields or not extra_fields['username']:
-            # Используем часть email до @ как username
-            username = email.split('@')[0]
-            # Убедимся, что username уникален
-            base_username = username
-            counter = 1
-            while CustomUser.objects.filter(username=username).exists():
-                username = f"{base_username}{counter}"
-                counter += 1
-            extra_fields['username'] = username
-        
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
+        
+        # Генерируем username из email если не указан
+        if user.username:
+            user.save(using=self._db)
+            return user
+        
+        base_username = username_base(email)
+        for attempt in range(self.USERNAME_ATTEMPTS):
+            # Следующий свободный суффикс находится одним запросом; если параллельная
+            # регистрация заняла его раньше, уникальный индекс вернет IntegrityError
+            user.username = next_free_username(self.db_manager(self._db), base_username)
+            try:
+                with transaction.atomic(using=self._db):
+                    user.save(using=self._db)
+                return user
+            except IntegrityError:
+                if self.db_manager(self._db).filter(email=email).exists():
+                    raise
+        
+        # Крайний случай при высокой конкуренции - случайный суффикс
+        user.username = f'{base_username}-{secrets.token_hex(4)}'
         user.save(using=self._db)
         return user
     
@@ -76,31 +101,30 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         """Возвращает короткое имя пользователя"""
         return self.first_name or self.email
     
+    def save(self, *args, **kwargs):
+        self.email = self.__class__.objects.normalize_email(self.email)
+        super().save(*args, **kwargs)
+    
     def email_user(self, subject, message, from_email=None, **kwargs):
         """Отправляет email пользователю"""
         send_mail(subject, message, from_email, [self.email], **kwargs)
-        
-    def create_user(self, email, password=None, **extra_fields):
-        if not email:
-            raise ValueError('Email обязателен для регистрации')
-        email = self.normalize_email(email)
-        
-        # Генерируем username из email если не указан
-        if 'username' not in extra_fields or not extra_fields['username']:
-            # Используем часть email до @ как username
-            username = email.split('@')[0]
-            # Проверка на username уникален
-            base_username = username
-            counter = 1
-            while CustomUser.objects.filter(username=username).exists():
-                username = f"{base_username}{counter}"
-                counter += 1
-            extra_fields['username'] = username
-        
-        user = self.model(email=email, **extra_fields)
-        user.set_password(password)
-        user.save(using=self._db)
-        return user
+
+
+class DrugManager(models.Manager):
+    """Менеджер препаратов с поиском по нормализованному ключу (drugs.normalization)"""
+    
+    def get_or_create_normalized(self, trade_name, form, dosage, manufacturer, **defaults):
+        """
+        Находит препарат, отличающийся от данных только написанием формы,
+        дозировки, производителя или названия, или создает новый
+        """
+        key = fingerprint(trade_name, form, dosage, manufacturer)
+        drug = self.filter(fingerprint=key).order_by('id').first()
+        if drug is not None:
+            return drug, False
+        return self.create(
+            trade_name=trade_name, form=form, dosage=dosage, manufacturer=manufacturer, **defaults
+        ), True
 
 
 class Drug(models.Model):
@@ -114,6 +138,14 @@ class Drug(models.Model):
     description = models.TextField("Описание", blank=True, null=True)
     created_at = models.DateTimeField("Дата добавления", auto_now_add=True)
     updated_at = models.DateTimeField("Дата обновления", auto_now=True)
+    # Ключ для поиска дублей: название, форма, дозировка и производитель
+    # в каноническом виде (drugs.normalization), заполняется при сохранении
+    fingerprint = models.CharField("Ключ дедупликации", max_length=40, db_index=True, editable=False, default='')
+    # Строка автодополнения: название, МНН и производитель в нижнем регистре
+    # (drugs.reference.search_drugs), заполняется при сохранении
+    search_name = models.CharField("Строка поиска", max_length=800, db_index=True, editable=False, default='')
+    
+    objects = DrugManager()
     
     class Meta:
         verbose_name = "Препарат"
@@ -122,6 +154,57 @@ class Drug(models.Model):
     
     def __str__(self):
         return f"{self.trade_name} ({self.mnn})"
+    
+    @staticmethod
+    def search_key(trade_name, mnn, manufacturer):
+        """Строка поиска: 'Но-шпа®' и 'НО-ШПА' ищутся одинаково в любой СУБД"""
+        return normalize_text(f'{trade_name} {mnn} {manufacturer}')
+    
+    def save(self, *args, **kwargs):
+        self.fingerprint = fingerprint(self.trade_name, self.form, self.dosage, self.manufacturer)
+        self.search_name = self.search_key(self.trade_name, self.mnn, self.manufacturer)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = [*update_fields, *{'fingerprint', 'search_name'}.difference(update_fields)]
+        super().save(*args, **kwargs)
+
+class CityManager(models.Manager):
+    """Менеджер городов с поиском по нормализованному названию"""
+    
+    def get_or_create_by_name(self, name):
+        """Находит город с учетом регистра, пробелов и ё/е или создает новый"""
+        name = ' '.join(name.split())
+        city, created = self.get_or_create(
+            normalized_name=City.normalize(name),
+            defaults={'name': name}
+        )
+        return city
+
+
+class City(models.Model):
+    """Модель города (общий справочник для аптек и подписок)"""
+    name = models.CharField("Название", max_length=100)
+    normalized_name = models.CharField("Нормализованное название", max_length=100, unique=True)
+    
+    objects = CityManager()
+    
+    class Meta:
+        verbose_name = "Город"
+        verbose_name_plural = "Города"
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+    
+    @staticmethod
+    def normalize(name):
+        """Ключ для дедупликации: без лишних пробелов, в нижнем регистре, ё → е"""
+        return ' '.join(name.split()).casefold().replace('ё', 'е')
+    
+    def save(self, *args, **kwargs):
+        self.name = ' '.join(self.name.split())
+        self.normalized_name = self.normalize(self.name)
+        super().save(*args, **kwargs)
 
 class PharmacyNetwork(models.Model):
     """Модель аптечной сети"""
@@ -129,6 +212,12 @@ class PharmacyNetwork(models.Model):
     website = models.URLField("Сайт", blank=True, null=True)
     phone = models.CharField("Телефон", max_length=20, blank=True, null=True)
     is_active = models.BooleanField("Активна", default=True)
+    freshness_hours = models.PositiveIntegerField(
+        "Срок актуальности остатков, ч",
+        blank=True,
+        null=True,
+        help_text="Через сколько часов без обновления предложение считается устаревшим (пусто - STOCK_FRESHNESS_HOURS)",
+    )
     
     class Meta:
         verbose_name = "Аптечная сеть"
@@ -142,7 +231,7 @@ class Pharmacy(models.Model):
     network = models.ForeignKey(PharmacyNetwork, on_delete=models.CASCADE, verbose_name="Сеть")
     name = models.CharField("Название аптеки", max_length=100)
     address = models.TextField("Адрес")
-    city = models.CharField("Город", max_length=100)
+    city = models.ForeignKey(City, on_delete=models.PROTECT, verbose_name="Город")
     phone = models.CharField("Телефон", max_length=20, blank=True, null=True)
     latitude = models.FloatField("Широта", blank=True, null=True)
     longitude = models.FloatField("Долгота", blank=True, null=True)
@@ -168,9 +257,24 @@ class Availability(models.Model):
         verbose_name = "Наличие препарата"
         verbose_name_plural = "Наличие препаратов"
         unique_together = ['drug', 'pharmacy']
+        indexes = [
+            # Сортировка списка в админке: последние обновления первыми
+            models.Index(fields=['last_updated', 'id'], name='availability_updated_idx'),
+            # Таблица предложений на странице препарата: keyset-пагинация по цене
+            models.Index(fields=['drug', 'is_available', 'price', 'id'], name='availability_offers_idx'),
+            # Поиск устаревших предложений (drugs.freshness): только строки в наличии
+            models.Index(fields=['last_updated'], condition=models.Q(is_available=True), name='availability_fresh_idx'),
+        ]
     
     def __str__(self):
         return f"{self.drug.trade_name} в {self.pharmacy.name} - {self.price} руб."
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Цена на момент чтения: по ней журнал изменений отличает изменение цены
+        instance._loaded_price = instance.__dict__.get('price')
+        return instance
 
 class Analogue(models.Model):
     """Модель связи между препаратами-аналогами"""
@@ -198,6 +302,9 @@ class PriceHistory(models.Model):
         verbose_name = "История цены"
         verbose_name_plural = "История цен"
         ordering = ['-recorded_at']
+        indexes = [
+            models.Index(fields=['recorded_at', 'id'], name='pricehistory_recorded_idx'),
+        ]
     
     def __str__(self):
         return f"{self.availability.drug.trade_name}: {self.price} руб. ({self.recorded_at})"
@@ -206,7 +313,7 @@ class UserSubscription(models.Model):
     """Модель подписки пользователя на препарат"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name="Пользователь")
     drug = models.ForeignKey(Drug, on_delete=models.CASCADE, verbose_name="Препарат")
-    city = models.CharField("Город", max_length=100, blank=True, null=True)
+    city = models.ForeignKey(City, on_delete=models.PROTECT, verbose_name="Город", blank=True, null=True)
     max_price = models.DecimalField("Максимальная цена", max_digits=10, decimal_places=2, blank=True, null=True)
     is_active = models.BooleanField("Активна", default=True)
     created_at = models.DateTimeField("Дата создания", auto_now_add=True)
@@ -217,4 +324,280 @@ class UserSubscription(models.Model):
         unique_together = ['user', 'drug', 'city']
     
     def __str__(self):
-        return f"{self.user.username} подписан на {self.drug.trade_name}"
\ No newline at end of file
+        return f"{self.user.username} подписан на {self.drug.trade_name}"
+
+class DrugCard(models.Model):
+    """
+    Денормализованная карточка препарата для страницы drug_detail (read model).
+    Собирается из Drug/Availability/Analogue модулем drugs.cards и
+    пересобирается при изменении исходных данных.
+    """
+    drug = models.OneToOneField(Drug, on_delete=models.CASCADE, primary_key=True, related_name='card', verbose_name="Препарат")
+    data = models.JSONField("Данные карточки")
+    built_at = models.DateTimeField("Дата сборки", auto_now=True)
+    
+    class Meta:
+        verbose_name = "Карточка препарата"
+        verbose_name_plural = "Карточки препаратов"
+    
+    def __str__(self):
+        return f"Карточка препарата #{self.drug_id}"
+
+class AvailabilityEvent(models.Model):
+    """
+    Журнал изменений наличия (transactional outbox): событие пишется в той же
+    транзакции, что и изменение Availability, и доставляется обработчикам
+    командой dispatch_availability_events (drugs.outbox).
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    PRICE_CHANGED = 'price_changed'
+    DELETED = 'deleted'
+    KIND_CHOICES = [
+        (CREATED, 'Добавлено'),
+        (UPDATED, 'Изменено'),
+        (PRICE_CHANGED, 'Изменена цена'),
+        (DELETED, 'Удалено'),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField("Тип", max_length=20, choices=KIND_CHOICES)
+    # Без внешних ключей: событие переживает удаление строки наличия
+    availability_id = models.IntegerField("ID наличия")
+    drug_id = models.IntegerField("ID препарата")
+    pharmacy_id = models.IntegerField("ID аптеки")
+    price = models.DecimalField("Цена", max_digits=10, decimal_places=2, null=True)
+    old_price = models.DecimalField("Прежняя цена", max_digits=10, decimal_places=2, null=True)
+    quantity = models.IntegerField("Количество", null=True)
+    is_available = models.BooleanField("В наличии", null=True)
+    created_at = models.DateTimeField("Дата события", default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Событие наличия"
+        verbose_name_plural = "События наличия"
+    
+    def __str__(self):
+        return f"#{self.id} {self.kind} наличие #{self.availability_id}"
+
+class OutboxOffset(models.Model):
+    """
+    Позиция потребителя журнала изменений: id последнего обработанного события.
+    gap_* - граница ожидания пропуска в нумерации (drugs.outbox._settled):
+    пропуски до gap_until окончательны, когда завершились все транзакции,
+    выполнявшиеся при их обнаружении (xmin снимка PostgreSQL дошел до gap_xmax).
+    """
+    consumer = models.CharField("Потребитель", max_length=100, primary_key=True)
+    position = models.BigIntegerField("Позиция", default=0)
+    gap_until = models.BigIntegerField("Пропуски до события", blank=True, null=True)
+    gap_xmax = models.BigIntegerField("Граница транзакций при обнаружении пропуска", blank=True, null=True)
+    gap_seen_at = models.DateTimeField("Пропуск обнаружен", blank=True, null=True)
+    updated_at = models.DateTimeField("Дата обновления", auto_now=True)
+    
+    class Meta:
+        verbose_name = "Позиция потребителя событий"
+        verbose_name_plural = "Позиции потребителей событий"
+    
+    def __str__(self):
+        return f"{self.consumer}: {self.position}"
+
+class NetworkFeed(models.Model):
+    """
+    Выгрузка остатков аптечной сети, которую забирает планировщик (drugs.feeds).
+    Поля блокировки - аренда: пока locked_until в будущем, сеть загружает
+    только обработчик locked_by.
+    """
+    network = models.OneToOneField(PharmacyNetwork, on_delete=models.CASCADE, related_name='feed', verbose_name="Сеть")
+    url = models.CharField(
+        "Адрес выгрузки",
+        max_length=500,
+        help_text="http(s):// или file://; CSV или NDJSON, можно сжатый gzip",
+    )
+    interval_minutes = models.PositiveIntegerField("Интервал загрузки, мин", default=60)
+    priority = models.PositiveSmallIntegerField(
+        "Приоритет",
+        default=100,
+        help_text="Меньше - раньше. Загрузка, просроченная на целый интервал, поднимается в начало очереди",
+    )
+    rate_limit = models.PositiveIntegerField(
+        "Ограничение, строк/с",
+        blank=True,
+        null=True,
+        help_text="Пусто - FEED_DEFAULT_RATE_LIMIT",
+    )
+    source = models.CharField(
+        "Источник кодов",
+        max_length=50,
+        blank=True,
+        help_text="Источник внешних кодов (ExternalId.source): строки с полями pharmacy и drug. "
+                  "Пусто - строки с pharmacy_id и drug_id",
+    )
+    is_active = models.BooleanField("Активна", default=True)
+    next_run_at = models.DateTimeField("Следующая загрузка", default=timezone.now)
+    locked_until = models.DateTimeField("Заблокирована до", blank=True, null=True)
+    locked_by = models.CharField("Кем заблокирована", max_length=100, blank=True)
+    
+    class Meta:
+        verbose_name = "Выгрузка сети"
+        verbose_name_plural = "Выгрузки сетей"
+        indexes = [
+            models.Index(fields=['next_run_at'], condition=models.Q(is_active=True), name='networkfeed_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Выгрузка {self.network}"
+
+class FeedRun(models.Model):
+    """Одна загрузка выгрузки сети: объем, скорость и задержка относительно расписания"""
+    RUNNING = 'running'
+    SUCCESS = 'success'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (RUNNING, 'Выполняется'),
+        (SUCCESS, 'Успешно'),
+        (FAILED, 'Ошибка'),
+    ]
+    
+    feed = models.ForeignKey(NetworkFeed, on_delete=models.CASCADE, related_name='runs', verbose_name="Выгрузка")
+    status = models.CharField("Статус", max_length=20, choices=STATUS_CHOICES, default=RUNNING)
+    scheduled_at = models.DateTimeField("Запланирована на")
+    started_at = models.DateTimeField("Начало", default=timezone.now)
+    finished_at = models.DateTimeField("Окончание", blank=True, null=True)
+    rows = models.PositiveIntegerField("Принято строк", default=0)
+    rejected = models.PositiveIntegerField("Отклонено строк", default=0)
+    error = models.TextField("Ошибка", blank=True)
+    
+    class Meta:
+        verbose_name = "Загрузка выгрузки"
+        verbose_name_plural = "Загрузки выгрузок"
+        indexes = [
+            models.Index(fields=['feed', '-started_at'], name='feedrun_feed_started_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.feed} {self.started_at:%Y-%m-%d %H:%M}: {self.get_status_display()}"
+    
+    @property
+    def duration(self):
+        """Длительность, сек (для незавершенной - на текущий момент)"""
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+    
+    @property
+    def rows_per_second(self):
+        return self.rows / self.duration if self.duration > 0 else 0.0
+    
+    @property
+    def lag(self):
+        """На сколько секунд загрузка началась позже расписания"""
+        return max((self.started_at - self.scheduled_at).total_seconds(), 0.0)
+
+class ExternalId(models.Model):
+    """Код препарата или аптеки во внешней системе (source): по нему партнеры присылают остатки"""
+    DRUG = 'drug'
+    PHARMACY = 'pharmacy'
+    KIND_CHOICES = [
+        (DRUG, 'Препарат'),
+        (PHARMACY, 'Аптека'),
+    ]
+    
+    source = models.CharField("Источник", max_length=50)
+    kind = models.CharField("Тип", max_length=20, choices=KIND_CHOICES)
+    code = models.CharField("Внешний код", max_length=100)
+    drug = models.ForeignKey(Drug, on_delete=models.CASCADE, blank=True, null=True, related_name='external_ids', verbose_name="Препарат")
+    pharmacy = models.ForeignKey(Pharmacy, on_delete=models.CASCADE, blank=True, null=True, related_name='external_ids', verbose_name="Аптека")
+    created_at = models.DateTimeField("Дата создания", auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Внешний код"
+        verbose_name_plural = "Внешние коды"
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'kind', 'code'], name='externalid_code_uniq'),
+            models.CheckConstraint(
+                condition=(
+                    models.Q(kind='drug', drug__isnull=False, pharmacy__isnull=True)
+                    | models.Q(kind='pharmacy', pharmacy__isnull=False, drug__isnull=True)
+                ),
+                name='externalid_target_check',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.source}:{self.code} → {self.drug or self.pharmacy}"
+    
+    @property
+    def object_id(self):
+        return self.drug_id if self.kind == self.DRUG else self.pharmacy_id
+
+class UnmatchedCode(models.Model):
+    """Внешний код из загрузки, для которого нет ExternalId: очередь сверки (drugs.idmaps)"""
+    source = models.CharField("Источник", max_length=50)
+    kind = models.CharField("Тип", max_length=20, choices=ExternalId.KIND_CHOICES)
+    code = models.CharField("Внешний код", max_length=100)
+    first_seen = models.DateTimeField("Впервые встречен")
+    last_seen = models.DateTimeField("Последний раз встречен")
+    rows = models.PositiveIntegerField("Строк в последней загрузке", default=0)
+    
+    class Meta:
+        verbose_name = "Несопоставленный код"
+        verbose_name_plural = "Несопоставленные коды"
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'kind', 'code'], name='unmatchedcode_code_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.source}:{self.code} ({self.get_kind_display()})"
+
+class PartnerToken(models.Model):
+    """
+    Ключ доступа партнера к приему остатков (drugs.push). Хранится только хэш;
+    ключ имеет вид <prefix>.<secret> и показывается один раз при выпуске.
+    """
+    network = models.ForeignKey(PharmacyNetwork, on_delete=models.CASCADE, related_name='tokens', verbose_name="Сеть")
+    source = models.CharField("Источник кодов", max_length=50, help_text="Источник внешних кодов (ExternalId.source)")
+    name = models.CharField("Название", max_length=100)
+    prefix = models.CharField("Префикс", max_length=16, unique=True)
+    key_hash = models.CharField("Хэш ключа", max_length=64)
+    is_active = models.BooleanField("Активен", default=True)
+    created_at = models.DateTimeField("Дата создания", auto_now_add=True)
+    last_used_at = models.DateTimeField("Последнее использование", blank=True, null=True)
+    
+    class Meta:
+        verbose_name = "Ключ партнера"
+        verbose_name_plural = "Ключи партнеров"
+    
+    def __str__(self):
+        return f"{self.name} ({self.network})"
+    
+    @staticmethod
+    def hash_key(secret):
+        return hashlib.sha256(secret.encode()).hexdigest()
+    
+    @classmethod
+    def issue(cls, network, source, name):
+        """Создает ключ; возвращает (PartnerToken, ключ целиком)"""
+        prefix = secrets.token_hex(6)
+        secret = secrets.token_urlsafe(32)
+        token = cls.objects.create(network=network, source=source, name=name, prefix=prefix, key_hash=cls.hash_key(secret))
+        return token, f'{prefix}.{secret}'
+    
+    def check_key(self, secret):
+        return hmac.compare_digest(self.key_hash, self.hash_key(secret))
+
+class IngestBatch(models.Model):
+    """
+    Принятая пачка остатков по ключу идемпотентности: повтор запроса с тем же
+    ключом возвращает сохраненный ответ, не применяя пачку второй раз
+    """
+    token = models.ForeignKey(PartnerToken, on_delete=models.CASCADE, related_name='batches', verbose_name="Ключ партнера")
+    key = models.CharField("Ключ идемпотентности", max_length=100)
+    created_at = models.DateTimeField("Дата приема", default=timezone.now, db_index=True)
+    rows = models.PositiveIntegerField("Принято строк", default=0)
+    rejected = models.PositiveIntegerField("Отклонено строк", default=0)
+    response = models.JSONField("Ответ", default=dict)
+    
+    class Meta:
+        verbose_name = "Пачка остатков"
+        verbose_name_plural = "Пачки остатков"
+        unique_together = ['token', 'key']
+    
+    def __str__(self):
+        return f"{self.token}: {self.key}"
@@ -0,0 +1,226 @@
+from bisect import bisect_right
+from decimal import Decimal
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min, Q
+from django.template.loader import render_to_string
+
+from . import catalog
+from .catalog import Record
+from .freshness import fresh_q
+from .models import Analogue, Availability
+
+
+# Шаблоны блока предложений для разных типов уведомлений
+IMMEDIATE_OFFERS_TEMPLATE = 'drugs/emails/offers_immediate.txt'
+DIGEST_OFFERS_TEMPLATE = 'drugs/emails/offers_digest.txt'
+ANALOGUES_TEMPLATE = 'drugs/emails/analogues.txt'
+
+# Сколько самых дешевых предложений попадает в письмо
+OFFERS_LIMIT = 10
+
+# Сколько аналогов предлагается, когда самого препарата нет
+ANALOGUES_LIMIT = 3
+
+
+class OfferRecord(Record):
+    """Предложение для письма; pharmacy - запись каталога (drugs.catalog)"""
+    __slots__ = ('id', 'price', 'quantity', 'last_updated', 'pharmacy_id', 'pharmacy')
+
+
+class AnalogueOffer(Record):
+    """Самая низкая цена аналога в наличии; drug - запись каталога (drugs.catalog)"""
+    __slots__ = ('drug_id', 'price', 'similarity_score', 'drug')
+
+
+def get_site_url():
+    """Базовый адрес сайта для ссылок в письмах"""
+    return getattr(settings, 'SITE_URL', 'http://localhost:8000')
+
+
+class OfferBlockCache:
+    """
+    Кэш блоков предложений для email-уведомлений.
+
+    Предложения загружаются один раз на пару (препарат, город) и сортируются по цене.
+    Подписки с ограничением по цене получают префикс этого списка, поэтому
+    ценовая корзина — это просто количество подходящих предложений.
+    Блок рендерится один раз на (препарат, город, корзина) и переиспользуется
+    для всех получателей; отрендеренный текст также кладется в общий кэш Django.
+    """
+
+    def __init__(self, template_name, limit=OFFERS_LIMIT):
+        self.template_name = template_name
+        self.limit = limit
+        self._offers = {}
+        self._blocks = {}
+
+    def get_offers(self, drug_id, city_id=None):
+        """Самые дешевые предложения препарата в городе (или везде)"""
+        key = (drug_id, city_id)
+        if key not in self._offers:
+            # Устаревшие предложения (дольше срока своей сети без обновления) в письма не попадают
+            offers_query = Availability.objects.filter(
+                fresh_q(),
+                drug_id=drug_id,
+                is_available=True,
+            )
+            if city_id:
+                offers_query = offers_query.filter(pharmacy__city_id=city_id)
+            # Аптеки берутся из каталога в памяти: без JOIN и без создания моделей
+            offers = [
+                OfferRecord(*row)
+                for row in offers_query.order_by('price', 'id').values_list(
+                    'id', 'price', 'quantity', 'last_updated', 'pharmacy_id'
+                )[:self.limit]
+            ]
+            pharmacies = catalog.pharmacies.get_many({offer.pharmacy_id for offer in offers})
+            for offer in offers:
+                offer.pharmacy = pharmacies.get(offer.pharmacy_id)
+            self._offers[key] = offers
+        return self._offers[key]
+
+    def get_block(self, drug_id, city_id=None, max_price=None):
+        """
+        Возвращает (текст блока, список предложений) для параметров подписки.
+        Если подходящих предложений нет, возвращает ('', []).
+        """
+        offers = self.get_offers(drug_id, city_id)
+        if max_price:
+            bucket = bisect_right([offer.price for offer in offers], max_price)
+        else:
+            bucket = len(offers)
+        if not bucket:
+            return '', []
+
+        offers = offers[:bucket]
+        key = (drug_id, city_id, bucket)
+        block = self._blocks.get(key)
+        if block is None:
+            block = self._render(offers)
+            self._blocks[key] = block
+        return block, offers
+
+    def _render(self, offers):
+        # Ключ общего кэша зависит от содержимого предложений,
+        # поэтому изменение цены или остатка сразу дает новый ключ
+        fingerprint = hashlib.md5(
+            '|'.join(
+                f'{offer.id}:{offer.price}:{offer.quantity}:{offer.last_updated.timestamp()}'
+                for offer in offers
+            ).encode()
+        ).hexdigest()
+        cache_key = f'notifications:offers:{self.template_name}:{fingerprint}'
+
+        block = cache.get(cache_key)
+        if block is None:
+            block = render_to_string(self.template_name, {'offers': offers})
+            cache.set(cache_key, block, getattr(settings, 'NOTIFICATION_OFFERS_CACHE_TIMEOUT', 300))
+        return block
+
+
+class AnalogueIndex:
+    """
+    Индекс (препарат, город) → самые дешевые аналоги в наличии.
+
+    Строится заранее для всех препаратов рассылки двумя запросами: активные связи
+    Analogue (в обе стороны, не ниже ANALOGUE_MIN_SIMILARITY) и минимальные цены
+    аналогов в наличии по городам. Подбор аналогов для подписки - поиск в словаре,
+    без запросов к БД. Ключ с городом None - минимальная цена по всем городам.
+    """
+
+    def __init__(self, drug_ids, limit=ANALOGUES_LIMIT):
+        """drug_ids - список id или подзапрос .values('drug_id')"""
+        self.limit = limit
+        min_similarity = getattr(settings, 'ANALOGUE_MIN_SIMILARITY', 0.0)
+
+        partners = {}
+        links = Analogue.objects.filter(
+            Q(original_id__in=drug_ids) | Q(analogue_id__in=drug_ids),
+            is_active=True,
+            similarity_score__gte=min_similarity,
+        ).values_list('original_id', 'analogue_id', 'similarity_score')
+        for original_id, analogue_id, score in links:
+            partners.setdefault(original_id, {})[analogue_id] = score
+            partners.setdefault(analogue_id, {})[original_id] = score
+
+        # Минимальная цена каждого аналога в каждом городе
+        prices = {}
+        analogue_ids = set().union(*partners.values())
+        if analogue_ids:
+            rows = Availability.objects.filter(
+                fresh_q(),
+                drug_id__in=analogue_ids,
+                is_available=True,
+            ).values_list('drug_id', 'pharmacy__city_id').annotate(min_price=Min('price')).order_by()
+            for drug_id, city_id, price in rows:
+                # Агрегат на SQLite теряет копейки у целых цен
+                price = price.quantize(Decimal('0.01'))
+                by_city = prices.setdefault(drug_id, {})
+                by_city[city_id] = price
+                if by_city.get(None) is None or price < by_city[None]:
+                    by_city[None] = price
+
+        # Кандидаты по (препарат, город): от дешевых к дорогим, при равной цене - более похожие
+        self._index = {}
+        for drug_id, analogues in partners.items():
+            for analogue_id, score in analogues.items():
+                for city_id, price in prices.get(analogue_id, {}).items():
+                    self._index.setdefault((drug_id, city_id), []).append(
+                        AnalogueOffer(analogue_id, price, score)
+                    )
+        for candidates in self._index.values():
+            candidates.sort(key=lambda offer: (offer.price, -offer.similarity_score, offer.drug_id))
+
+        drugs = catalog.drugs.get_many({
+            offer.drug_id for candidates in self._index.values() for offer in candidates
+        })
+        for candidates in self._index.values():
+            for offer in candidates:
+                offer.drug = drugs.get(offer.drug_id)
+
+    def get(self, drug_id, city_id=None, max_price=None):
+        """Самые дешевые аналоги препарата в городе (или везде) не дороже max_price"""
+        candidates = self._index.get((drug_id, city_id), [])
+        if max_price:
+            candidates = candidates[:bisect_right([offer.price for offer in candidates], max_price)]
+        return candidates[:self.limit]
+
+
+def build_analogues_block(analogues):
+    return render_to_string(ANALOGUES_TEMPLATE, {'analogues': analogues, 'site_url': get_site_url()})
+
+
+def build_immediate_message(subscription, offers_block):
+    """Текст письма о текущем наличии сразу после подписки"""
+    return render_to_string('drugs/emails/immediate_notification.txt', {
+        'subscription': subscription,
+        'user_name': subscription.user.get_full_name(),
+        'drug': catalog.drugs.get(subscription.drug_id),
+        'offers_block': offers_block,
+        'site_url': get_site_url(),
+    }).strip()
+
+
+def build_digest_message(subscription, offers_block):
+    """Текст письма периодической рассылки о наличии"""
+    return render_to_string('drugs/emails/availability_notification.txt', {
+        'subscription': subscription,
+        'user_name': subscription.user.get_full_name(),
+        'drug': catalog.drugs.get(subscription.drug_id),
+        'offers_block': offers_block,
+        'site_url': getattr(settings, 'SITE_URL', ''),
+    }).strip()
+
+
+def build_analogue_message(subscription, analogues):
+    """Текст письма, когда препарата нет по условиям подписки, но есть аналоги"""
+    return render_to_string('drugs/emails/analogue_notification.txt', {
+        'subscription': subscription,
+        'user_name': subscription.user.get_full_name(),
+        'drug': catalog.drugs.get(subscription.drug_id),
+        'analogues_block': build_analogues_block(analogues),
+        'site_url': get_site_url(),
+    }).strip()
@@ -0,0 +1,214 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import DateTimeField, DecimalField, F, Value
+from django.utils import timezone
+
+from .models import AvailabilityEvent, OutboxOffset
+
+logger = logging.getLogger(__name__)
+
+# Сколько событий передается обработчику за один вызов
+BATCH_SIZE = 500
+
+# Зарегистрированные потребители: {имя: обработчик(список событий)}
+consumers = {}
+
+
+def consumer(name):
+    """
+    Регистрирует обработчик событий наличия под именем name:
+
+        @outbox.consumer('drug-cards')
+        def handle(events): ...
+
+    Доставка "хотя бы один раз": позиция потребителя сдвигается только после
+    успешного вызова, поэтому после сбоя пачка придет повторно - обработчик
+    должен быть идемпотентным.
+    """
+    def decorator(handler):
+        consumers[name] = handler
+        return handler
+    return decorator
+
+
+def record(instance, kind, old_price=None):
+    """Событие об изменении одной строки Availability (вызывается из сигналов)"""
+    AvailabilityEvent.objects.create(
+        kind=kind,
+        availability_id=instance.id,
+        drug_id=instance.drug_id,
+        pharmacy_id=instance.pharmacy_id,
+        price=instance.price,
+        old_price=old_price,
+        quantity=instance.quantity,
+        is_available=instance.is_available,
+    )
+
+
+def record_queryset(queryset, kind, **values):
+    """
+    События для всех строк выборки Availability одним INSERT ... SELECT
+    (массовые операции drugs.bulk, сигналы они не отправляют).
+    values - выражения для полей события вместо текущих значений строки:
+    событие пишется до UPDATE, поэтому в него передаются новые значения,
+    например price=<новая цена>, old_price=F('price').
+    """
+    fields = {
+        'availability_id': F('id'),
+        'drug_id': F('drug_id'),
+        'pharmacy_id': F('pharmacy_id'),
+        'price': F('price'),
+        'old_price': Value(None, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        'quantity': F('quantity'),
+        'is_available': F('is_available'),
+        **values,
+        'kind': Value(kind),
+        'created_at': Value(timezone.now(), output_field=DateTimeField()),
+    }
+    select = queryset.order_by().annotate(
+        **{f'event_{name}': expression for name, expression in fields.items()}
+    ).values(*(f'event_{name}' for name in fields))
+    sql, params = select.query.sql_with_params()
+    meta = AvailabilityEvent._meta
+    columns = ', '.join(meta.get_field(name).column for name in fields)
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'INSERT INTO {meta.db_table} ({columns}) {sql}', params)
+        return cursor.rowcount
+
+
+def _snapshot(connection):
+    """
+    PostgreSQL: (xmin, xmax) текущего снимка. Транзакции с xid < xmin завершены,
+    все выполняющиеся сейчас транзакции с назначенным xid имеют xid < xmax.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_snapshot_xmin(s)::text::bigint, pg_snapshot_xmax(s)::text::bigint '
+            'FROM pg_current_snapshot() s'
+        )
+        return cursor.fetchone()
+
+
+def _settled(events, offset, xmin, now):
+    """
+    Префикс пачки, который можно доставить: события подряд после позиции и
+    события до offset.gap_until, если пропуски перед ними окончательны.
+
+    id выделяются при вставке, а видны после коммита: пропуск в нумерации может
+    быть еще не закоммиченной транзакцией, сколько бы она ни длилась (пачка
+    загрузки партнера, массовое действие админки, объединение дублей). Читать
+    за него нельзя - позиция уйдет вперед и событие потеряется. Поэтому пропуск
+    не истекает по времени: при обнаружении запоминается xmax снимка
+    (dispatch), и пропуски до последнего прочитанного тогда события считаются
+    откатом, только когда завершились все транзакции, выполнявшиеся в тот
+    момент (xmin дошел до запомненного xmax). Отсутствующий id выделен раньше
+    видимого большего, то есть до обнаружения. OUTBOX_SETTLE_SECONDS - не
+    таймаут, а минимальное ожидание для транзакции, которая выделила id в
+    INSERT, но еще не получила xid.
+    """
+    position = offset.position
+    settled_until = position
+    if offset.gap_until is not None and xmin >= offset.gap_xmax:
+        settle = timedelta(seconds=getattr(settings, 'OUTBOX_SETTLE_SECONDS', 5))
+        if now - offset.gap_seen_at >= settle:
+            settled_until = offset.gap_until
+    for index, event in enumerate(events):
+        if event.id != position + 1 and event.id > settled_until:
+            return events[:index]
+        position = event.id
+    return events
+
+
+def dispatch(name, batch_size=BATCH_SIZE):
+    """
+    Доставляет потребителю name одну пачку событий после его позиции.
+    Позиция блокируется на время обработки (select_for_update), поэтому
+    два диспетчера не обрабатывают одного потребителя одновременно.
+    Возвращает количество доставленных событий.
+
+    Пропуски в нумерации ждут завершения транзакций только на PostgreSQL
+    (_settled). На SQLite пишет одна транзакция за раз: событие с большим id
+    не может закоммититься раньше незавершенной транзакции с меньшим, а id
+    отката переиспользуются, поэтому видимый пропуск всегда окончателен.
+    """
+    handler = consumers[name]
+    using = router.db_for_write(OutboxOffset)
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        OutboxOffset.objects.using(using).get_or_create(consumer=name)
+        offset = OutboxOffset.objects.using(using).select_for_update().get(consumer=name)
+        events = list(
+            AvailabilityEvent.objects.using(using).filter(id__gt=offset.position).order_by('id')[:batch_size]
+        )
+        current_gap = (offset.gap_until, offset.gap_xmax, offset.gap_seen_at)
+        delivered = events
+        gap = (None, None, None)
+        if connection.vendor == 'postgresql' and events:
+            # Снимок - после чтения событий: транзакции пропущенных id начались до него
+            xmin, xmax = _snapshot(connection)
+            now = timezone.now()
+            delivered = _settled(events, offset, xmin, now)
+            position = delivered[-1].id if delivered else offset.position
+            if offset.gap_until is not None and offset.gap_until > position:
+                # Прежняя граница еще не пройдена: ожидание не начинается заново
+                gap = current_gap
+            elif len(delivered) < len(events):
+                gap = (events[-1].id, xmax, now)
+        position = delivered[-1].id if delivered else offset.position
+        if not delivered and gap == current_gap:
+            return 0
+        if delivered:
+            handler(delivered)
+        offset.position = position
+        offset.gap_until, offset.gap_xmax, offset.gap_seen_at = gap
+        offset.save(update_fields=['position', 'gap_until', 'gap_xmax', 'gap_seen_at', 'updated_at'])
+    return len(delivered)
+
+
+def dispatch_all(batch_size=BATCH_SIZE, names=None):
+    """
+    Одна пачка каждому потребителю: {имя: доставлено}. Ошибка обработчика
+    логируется и не мешает остальным; его позиция остается на месте.
+    """
+    delivered = {}
+    for name in names or consumers:
+        started = time.monotonic()
+        try:
+            delivered[name] = dispatch(name, batch_size)
+        except Exception:
+            logger.exception('Ошибка обработчика событий %s', name)
+            delivered[name] = 0
+            continue
+        if delivered[name]:
+            logger.info(
+                '%s: доставлено %s событий за %.0f мс',
+                name, delivered[name], (time.monotonic() - started) * 1000,
+            )
+    return delivered
+
+
+def lag(name):
+    """Сколько событий ждет потребителя name"""
+    offset = OutboxOffset.objects.filter(consumer=name).values_list('position', flat=True).first() or 0
+    return AvailabilityEvent.objects.filter(id__gt=offset).count()
+
+
+def purge():
+    """
+    Удаляет события, которые обработали все зарегистрированные потребители
+    и которые старше OUTBOX_RETENTION_DAYS. Возвращает количество удаленных.
+    """
+    positions = dict(OutboxOffset.objects.filter(consumer__in=list(consumers)).values_list('consumer', 'position'))
+    if not consumers or len(positions) < len(consumers):
+        # Потребитель без позиции еще ничего не прочитал
+        return 0
+    cutoff = timezone.now() - timedelta(days=getattr(settings, 'OUTBOX_RETENTION_DAYS', 7))
+    deleted, _ = AvailabilityEvent.objects.filter(
+        id__lte=min(positions.values()),
+        created_at__lt=cutoff,
+    ).delete()
+    return deleted
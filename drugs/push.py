@@ -0,0 +1,184 @@
+import io
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+
+from . import ingest
+from .idmaps import external_ids, record_unmatched
+from .models import IngestBatch, PartnerToken
+
+# Сколько ошибок строк возвращается в ответе
+ERRORS_RETURNED = 100
+
+# Как часто обновлять PartnerToken.last_used_at (не на каждый запрос)
+LAST_USED_PRECISION = timedelta(minutes=1)
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class LimitedReader(io.RawIOBase):
+    """Поток с ограничением на число прочитанных байт (в том числе после распаковки)"""
+
+    def __init__(self, source, limit):
+        self.source = source
+        self.limit = limit
+        self.total = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.source.read(len(buffer))
+        self.total += len(data)
+        if self.total > self.limit:
+            raise PayloadTooLarge(f'Пачка больше {self.limit} байт')
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class WriteQueue:
+    """
+    Ограничение одновременных записей пачек в процессе: не больше
+    INGEST_MAX_CONCURRENT_WRITES, следующая пачка ждет свободного места
+    до INGEST_QUEUE_WAIT_SECONDS, иначе получает отказ (429).
+    """
+
+    def __init__(self):
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    @property
+    def semaphore(self):
+        with self._lock:
+            if self._semaphore is None:
+                self._semaphore = threading.BoundedSemaphore(getattr(settings, 'INGEST_MAX_CONCURRENT_WRITES', 2))
+            return self._semaphore
+
+    def acquire(self):
+        return self.semaphore.acquire(timeout=getattr(settings, 'INGEST_QUEUE_WAIT_SECONDS', 1.0))
+
+    def release(self):
+        self.semaphore.release()
+
+
+write_queue = WriteQueue()
+
+
+def authenticate(request):
+    """Активный PartnerToken по заголовку Authorization: Bearer <prefix>.<secret> или None"""
+    scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+    prefix, _, secret = key.strip().partition('.')
+    if scheme.lower() != 'bearer' or not prefix or not secret:
+        return None
+    token = PartnerToken.objects.select_related('network').filter(prefix=prefix, is_active=True).first()
+    if token is None or not token.check_key(secret):
+        return None
+    now = timezone.now()
+    if token.last_used_at is None or now - token.last_used_at > LAST_USED_PRECISION:
+        PartnerToken.objects.filter(id=token.id).update(last_used_at=now)
+    return token
+
+
+def apply_stream(token, stream, using, chunk_size=ingest.BATCH_SIZE):
+    """
+    Разбирает NDJSON из потока по строкам и применяет частями по chunk_size
+    строк (drugs.ingest.apply_offers). Коды переводятся в id по словарю
+    источника ключа (drugs.idmaps), коды без соответствия попадают в сверку.
+    Вызывается внутри транзакции пачки.
+    """
+    max_rows = getattr(settings, 'INGEST_MAX_ROWS', 50000)
+    source_map = external_ids.get(token.source)
+    unmatched = Counter()
+    totals = {'accepted': 0, 'rejected': 0, 'created': 0, 'updated': 0, 'unchanged': 0}
+    errors = []
+    rows = []
+    count = 0
+
+    def flush():
+        offers = ingest.resolve_codes(rows, token.network_id, source_map, errors, unmatched)
+        if offers:
+            for name, value in ingest.apply_offers(offers, using).items():
+                totals[name] += value
+        totals['accepted'] += len(offers)
+        rows.clear()
+
+    for line, record, error in ingest.iter_ndjson(ingest.text_lines(stream)):
+        count += 1
+        if count > max_rows:
+            raise PayloadTooLarge(f'В пачке больше {max_rows} строк')
+        if error is None:
+            try:
+                rows.append((line, *ingest.parse_code_row(record)))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            errors.append((line, error))
+        if len(rows) >= chunk_size:
+            flush()
+    if rows:
+        flush()
+    if unmatched:
+        record_unmatched(token.source, unmatched)
+
+    totals['rejected'] = len(errors)
+    totals['errors'] = [{'line': line, 'error': error} for line, error in sorted(errors)[:ERRORS_RETURNED]]
+    return totals
+
+
+def _stored(token, key, using):
+    return IngestBatch.objects.using(using).filter(token=token, key=key).values_list('response', flat=True).first()
+
+
+def receive(token, key, body):
+    """
+    Принимает пачку остатков партнера: (HTTP-статус, ответ, повтор ли это).
+
+    Пачка применяется в одной транзакции вместе с записью IngestBatch: при
+    повторе запроса с тем же ключом возвращается сохраненный ответ. Параллельный
+    повтор ждет на уникальном индексе (token, key) и тоже получает сохраненный ответ.
+    """
+    using = router.db_for_write(IngestBatch)
+    stored = _stored(token, key, using)
+    if stored is not None:
+        return 200, stored, True
+    if not write_queue.acquire():
+        return 429, {'error': 'Очередь записи заполнена, повторите позже'}, False
+    limit = getattr(settings, 'INGEST_MAX_BYTES', 100 * 1024 * 1024)
+    try:
+        with transaction.atomic(using=using):
+            batch = IngestBatch.objects.using(using).create(token=token, key=key)
+            # Тело читается потоком; gzip распознается по сигнатуре, и размер
+            # ограничивается и до, и после распаковки
+            stream = ingest.open_stream(io.BufferedReader(LimitedReader(body, limit)))
+            stream = io.BufferedReader(LimitedReader(stream, limit))
+            result = apply_stream(token, stream, using)
+            batch.rows = result['accepted']
+            batch.rejected = result['rejected']
+            batch.response = result
+            batch.save(update_fields=['rows', 'rejected', 'response'])
+    except IntegrityError:
+        stored = _stored(token, key, using)
+        if stored is None:
+            raise
+        return 200, stored, True
+    except PayloadTooLarge as e:
+        return 413, {'error': str(e)}, False
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        # Поврежденный gzip или не UTF-8
+        return 400, {'error': f'Не удалось прочитать пачку: {e}'}, False
+    finally:
+        write_queue.release()
+    return 200, result, False
+
+
+def purge_batches(now=None):
+    """Удаляет записи о пачках старше INGEST_IDEMPOTENCY_HOURS; возвращает количество"""
+    cutoff = (now or timezone.now()) - timedelta(hours=getattr(settings, 'INGEST_IDEMPOTENCY_HOURS', 24))
+    deleted, _ = IngestBatch.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
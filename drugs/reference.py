@@ -0,0 +1,121 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import City, Drug, PharmacyNetwork
+from .normalization import normalize_text
+
+
+CITIES_CACHE_KEY = 'reference:cities'
+NETWORKS_CACHE_KEY = 'reference:networks'
+NETWORK_FRESHNESS_CACHE_KEY = 'reference:network_freshness'
+DRUGS_VERSION_KEY = 'reference:drugs:version'
+DRUGS_SEARCH_PREFIX = 'reference:drugs:search'
+
+# Сколько вариантов отдает автодополнение препаратов
+AUTOCOMPLETE_LIMIT = 20
+
+
+def _timeout():
+    return getattr(settings, 'REFERENCE_CACHE_TIMEOUT', 600)
+
+
+def get_cities():
+    """Города, в которых есть аптеки: [(id, название)]"""
+    cities = cache.get(CITIES_CACHE_KEY)
+    if cities is None:
+        cities = list(
+            City.objects.filter(pharmacy__isnull=False).distinct().order_by('name').values_list('id', 'name')
+        )
+        cache.set(CITIES_CACHE_KEY, cities, _timeout())
+    return cities
+
+
+def get_city_choices():
+    """Варианты для выпадающего списка городов в формах подписки"""
+    return [('', 'Все города')] + get_cities()
+
+
+def get_networks():
+    """Список аптечных сетей: [(id, название)]"""
+    networks = cache.get(NETWORKS_CACHE_KEY)
+    if networks is None:
+        networks = list(PharmacyNetwork.objects.order_by('name').values_list('id', 'name'))
+        cache.set(NETWORKS_CACHE_KEY, networks, _timeout())
+    return networks
+
+
+def get_network_freshness():
+    """Сети со своим сроком актуальности остатков: {id сети: часов}"""
+    freshness = cache.get(NETWORK_FRESHNESS_CACHE_KEY)
+    if freshness is None:
+        freshness = dict(
+            PharmacyNetwork.objects.filter(freshness_hours__isnull=False).values_list('id', 'freshness_hours')
+        )
+        cache.set(NETWORK_FRESHNESS_CACHE_KEY, freshness, _timeout())
+    return freshness
+
+
+def drug_label(trade_name, mnn, dosage):
+    return f'{trade_name} ({mnn}), {dosage}'
+
+
+def _drugs_version():
+    """Версия результатов поиска препаратов: invalidate_drugs() делает старые ключи недостижимыми"""
+    version = cache.get(DRUGS_VERSION_KEY)
+    if version is None:
+        cache.add(DRUGS_VERSION_KEY, 1, None)
+        version = cache.get(DRUGS_VERSION_KEY, 1)
+    return version
+
+
+def get_drug_label(drug_id):
+    """Подпись выбранного препарата для поля автодополнения: один запрос по первичному ключу"""
+    try:
+        drug_id = int(drug_id)
+    except (TypeError, ValueError):
+        return ''
+    row = Drug.objects.filter(id=drug_id).values_list('trade_name', 'mnn', 'dosage').first()
+    return drug_label(*row) if row else ''
+
+
+def search_drugs(query, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Поиск препаратов для автодополнения: сначала совпадения с начала названия,
+    затем по вхождению в название, МНН или производителя. Ищется по индексу
+    Drug.search_name (не больше limit строк из БД), результат для каждого
+    запроса кэшируется отдельно.
+    """
+    query = normalize_text(query)
+    if not query:
+        return []
+    key = f'{DRUGS_SEARCH_PREFIX}:{_drugs_version()}:{limit}:{hashlib.md5(query.encode()).hexdigest()}'
+    results = cache.get(key)
+    if results is None:
+        columns = ('id', 'trade_name', 'mnn', 'dosage')
+        drugs = Drug.objects.order_by('trade_name', 'id')
+        rows = list(drugs.filter(search_name__startswith=query).values_list(*columns)[:limit])
+        if len(rows) < limit:
+            rows += drugs.filter(search_name__contains=query).exclude(
+                search_name__startswith=query
+            ).values_list(*columns)[:limit - len(rows)]
+        results = [(drug_id, drug_label(*fields)) for drug_id, *fields in rows]
+        cache.set(key, results, _timeout())
+    return results
+
+
+def invalidate_cities():
+    cache.delete(CITIES_CACHE_KEY)
+
+
+def invalidate_networks():
+    cache.delete_many([NETWORKS_CACHE_KEY, NETWORK_FRESHNESS_CACHE_KEY])
+
+
+def invalidate_drugs():
+    try:
+        cache.incr(DRUGS_VERSION_KEY)
+    except ValueError:
+        # Версии еще нет (или вытеснена): следующий поиск начнет с новой
+        cache.set(DRUGS_VERSION_KEY, 2, None)
@@ -0,0 +1,161 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+
+# Cookie, по которой следующие запросы клиента после записи читают с primary
+PRIMARY_PIN_COOKIE = 'db_primary_pin'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Модели приложения drugs, которые читаются с реплик.
+# Пользователи (и сессии/права из других приложений) всегда читаются с primary.
+PRIMARY_ONLY_MODELS = {'customuser'}
+
+
+class RoutingState:
+    """Состояние маршрутизации в рамках одного запроса (или команды)"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+
+
+_routing_state = ContextVar('db_routing_state', default=None)
+
+
+def _get_state():
+    state = _routing_state.get()
+    if state is None:
+        state = RoutingState()
+        _routing_state.set(state)
+    return state
+
+
+def pin_to_primary():
+    """Все последующие чтения в текущем контексте идут в primary"""
+    _get_state().pinned = True
+
+
+def is_pinned_to_primary():
+    state = _routing_state.get()
+    return state is not None and state.pinned
+
+
+@contextmanager
+def use_primary():
+    """Временно читать всё с primary (например, сразу после импорта данных)"""
+    state = _get_state()
+    previous = state.pinned
+    state.pinned = True
+    try:
+        yield
+    finally:
+        state.pinned = previous
+
+
+@contextmanager
+def keep_pin():
+    """
+    Служебная запись (например, сохранение собранной при чтении карточки):
+    запрос не закрепляется за primary, и cookie закрепления не выставляется
+    """
+    state = _get_state()
+    previous = state.pinned
+    try:
+        yield
+    finally:
+        state.pinned = previous
+
+
+def get_replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class PrimaryReplicaRouter:
+    """
+    Роутер primary/replica.
+
+    Чтения каталога (препараты, аптеки, наличие, аналоги, история цен, подписки)
+    распределяются по репликам из settings.DATABASE_REPLICAS, все записи идут в primary.
+    После записи запрос закрепляется за primary (read-your-writes), а middleware
+    продлевает закрепление на несколько секунд через cookie, чтобы страница после
+    редиректа (например, "Мои подписки") увидела только что сохраненные данные.
+    """
+
+    primary = 'default'
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replica_aliases()
+        if not replicas or is_pinned_to_primary():
+            return self.primary
+        if model._meta.app_label != 'drugs' or model._meta.model_name in PRIMARY_ONLY_MODELS:
+            return self.primary
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return self.primary
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат копию тех же данных, что и primary
+        databases = {self.primary, *get_replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит из primary через репликацию
+        if db in get_replica_aliases():
+            return False
+        return None
+
+
+@sync_and_async_middleware
+def primary_pin_middleware(get_response):
+    """
+    Закрепляет запрос за primary, если недавно была запись,
+    и выставляет cookie после модифицирующих запросов.
+    """
+
+    def begin(request):
+        # Модифицирующие запросы читают с primary целиком: проверки перед записью
+        # не должны видеть отстающую реплику
+        pinned = PRIMARY_PIN_COOKIE in request.COOKIES or request.method not in SAFE_METHODS
+        return _routing_state.set(RoutingState(pinned=pinned))
+
+    def finish(request, response, token):
+        pinned_by_write = _routing_state.get().pinned and PRIMARY_PIN_COOKIE not in request.COOKIES
+        _routing_state.reset(token)
+        if pinned_by_write:
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE, '1',
+                max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = begin(request)
+            try:
+                response = await get_response(request)
+            except BaseException:
+                _routing_state.reset(token)
+                raise
+            return finish(request, response, token)
+    else:
+        def middleware(request):
+            token = begin(request)
+            try:
+                response = get_response(request)
+            except BaseException:
+                _routing_state.reset(token)
+                raise
+            return finish(request, response, token)
+
+    return middleware
@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import cards, catalog, idmaps, outbox, reference
+from .models import Analogue, Availability, AvailabilityEvent, City, Drug, ExternalId, Pharmacy, PharmacyNetwork
+
+
+# Массовое изменение наличия/цен (drugs.bulk): аргумент drug_ids - затронутые препараты
+availability_bulk_changed = Signal()
+
+
+# Массовые операции (QuerySet.update, bulk_create) сигналы не отправляют,
+# поэтому после них кэш справочников сбрасывается явно или истекает по таймауту.
+# Сброс - после коммита: иначе другой процесс успеет перечитать еще старую
+# строку и сохранить ее в кэше под новой версией
+
+def _after_commit(using, *callbacks):
+    for callback in callbacks:
+        transaction.on_commit(callback, using=using)
+
+
+@receiver([post_save, post_delete], sender=City)
+@receiver([post_save, post_delete], sender=Pharmacy)
+def pharmacy_changed(sender, using, **kwargs):
+    """Аптека добавлена/изменена/удалена - список городов мог измениться"""
+    _after_commit(using, reference.invalidate_cities, catalog.pharmacies.invalidate)
+
+
+@receiver([post_save, post_delete], sender=PharmacyNetwork)
+def network_changed(sender, using, **kwargs):
+    _after_commit(using, reference.invalidate_networks, catalog.networks.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Drug)
+def drug_changed(sender, using, **kwargs):
+    _after_commit(using, reference.invalidate_drugs, catalog.drugs.invalidate)
+
+
+@receiver([post_save, post_delete], sender=ExternalId)
+def external_id_changed(sender, using, **kwargs):
+    _after_commit(using, idmaps.external_ids.invalidate)
+
+
+# Карточки препаратов (drugs.cards): изменение одной строки пересобирает
+# карточку препарата, изменение аптеки/сети/города сбрасывает карточки
+# всех препаратов в ней одним DELETE с подзапросом
+
+@receiver([post_save, post_delete], sender=Availability)
+def availability_changed(sender, instance, **kwargs):
+    cards.schedule_rebuild(instance.drug_id)
+
+
+@receiver(post_save, sender=Drug)
+def drug_card_changed(sender, instance, **kwargs):
+    cards.schedule_rebuild(instance.id)
+
+
+@receiver(pre_delete, sender=Drug)
+def drug_card_deleted(sender, instance, **kwargs):
+    # pre_delete: после удаления связи Analogue уже не найти
+    cards.invalidate_cards([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Analogue)
+def analogue_changed(sender, instance, **kwargs):
+    cards.schedule_rebuild(instance.original_id)
+    cards.schedule_rebuild(instance.analogue_id)
+
+
+@receiver(post_save, sender=Pharmacy)
+def pharmacy_card_changed(sender, instance, **kwargs):
+    cards.invalidate_cards(Availability.objects.filter(pharmacy=instance).values('drug_id'))
+
+
+@receiver(post_save, sender=PharmacyNetwork)
+def network_card_changed(sender, instance, **kwargs):
+    cards.invalidate_cards(Availability.objects.filter(pharmacy__network=instance).values('drug_id'))
+
+
+@receiver(post_save, sender=City)
+def city_card_changed(sender, instance, **kwargs):
+    cards.invalidate_cards(Availability.objects.filter(pharmacy__city=instance).values('drug_id'))
+
+
+@receiver(availability_bulk_changed)
+def availability_bulk_card_changed(sender, drug_ids, **kwargs):
+    cards.invalidate_cards(list(drug_ids))
+
+
+# Журнал изменений наличия (drugs.outbox): событие пишется в транзакции изменения.
+# Массовые операции drugs.bulk пишут события сами (outbox.record_queryset)
+
+@receiver(post_save, sender=Availability)
+def availability_saved_event(sender, instance, created, **kwargs):
+    old_price = getattr(instance, '_loaded_price', None)
+    if created:
+        outbox.record(instance, AvailabilityEvent.CREATED)
+    elif old_price is not None and old_price != instance.price:
+        outbox.record(instance, AvailabilityEvent.PRICE_CHANGED, old_price=old_price)
+    else:
+        outbox.record(instance, AvailabilityEvent.UPDATED)
+    instance._loaded_price = instance.price
+
+
+@receiver(post_delete, sender=Availability)
+def availability_deleted_event(sender, instance, **kwargs):
+    outbox.record(instance, AvailabilityEvent.DELETED)
@@ -0,0 +1,258 @@
+import ast
+import itertools
+import json
+import logging
+import shutil
+import sys
+from array import array
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Max
+from django.db.models.functions import Length
+
+from . import history
+from .models import Availability, Drug, Pharmacy, PriceHistory
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк читается из БД за один запрос (серверный курсор на PostgreSQL)
+CHUNK_SIZE = 20000
+
+# Версия формата снимка (manifest.json)
+SNAPSHOT_FORMAT = 1
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# Заголовок .npy резервируется заранее фиксированной длины: число строк
+# становится известно только в конце, и заголовок перезаписывается на месте
+NPY_HEADER_SIZE = 128
+
+# Типы колонок (dtype в файле - NpyColumnWriter.descr)
+INT = 'int'
+FLOAT = 'float'
+BOOL = 'bool'
+DATETIME = 'datetime'
+STRING = 'string'
+
+# NULL в целых колонках и датах (в numpy для дат это NaT)
+NAT = -2 ** 63
+
+
+class NpyColumnWriter:
+    """
+    Колонка в формате .npy (версия 1.0), записываемая порциями без numpy.
+    Файл открывается numpy.load(path, mmap_mode='r') без копирования в память.
+
+    Строки хранятся как '<U{width}' (UTF-32 фиксированной ширины) - так их
+    читает numpy без pickle. Даты - datetime64[us] в UTC, NULL - NaT/NaN/''.
+    """
+
+    def __init__(self, path, kind, width=1):
+        self.path = path
+        self.kind = kind
+        self.width = max(width, 1)
+        self.rows = 0
+        self._file = open(path, 'wb')
+        self._file.write(self._header())
+
+    @property
+    def descr(self):
+        return {
+            INT: '<i8',
+            FLOAT: '<f8',
+            BOOL: '|b1',
+            DATETIME: '<M8[us]',
+            STRING: f'<U{self.width}',
+        }[self.kind]
+
+    def _header(self):
+        header = repr({'descr': self.descr, 'fortran_order': False, 'shape': (self.rows,)})
+        size = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2
+        header = header.ljust(size - 1) + '\n'
+        if len(header) != size:
+            raise ValueError(f'Заголовок колонки {self.path} не помещается в {NPY_HEADER_SIZE} байт')
+        return NPY_MAGIC + size.to_bytes(2, 'little') + header.encode('latin1')
+
+    def write(self, values):
+        if self.kind == STRING:
+            self._file.write(b''.join(
+                ('' if value is None else value).ljust(self.width, '\0').encode('utf-32-le')
+                for value in values
+            ))
+        elif self.kind == BOOL:
+            self._file.write(bytes(bool(value) for value in values))
+        else:
+            if self.kind == INT:
+                data = array('q', (NAT if value is None else value for value in values))
+            elif self.kind == FLOAT:
+                data = array('d', (float('nan') if value is None else float(value) for value in values))
+            else:
+                data = array('q', (NAT if value is None else _microseconds(value) for value in values))
+            if sys.byteorder == 'big':
+                data.byteswap()
+            self._file.write(data.tobytes())
+        self.rows += len(values)
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.close()
+
+
+def _microseconds(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    delta = value - datetime(1970, 1, 1)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _tables(day, history_days):
+    """Таблицы снимка: имя -> (выборка, [(колонка, поле, тип)])"""
+    history_start, history_end = _history_range(day, history_days)
+    return {
+        'drugs': (Drug.objects.all(), [
+            ('id', 'id', INT),
+            ('trade_name', 'trade_name', STRING),
+            ('mnn', 'mnn', STRING),
+            ('form', 'form', STRING),
+            ('dosage', 'dosage', STRING),
+            ('manufacturer', 'manufacturer', STRING),
+            ('atx_code', 'atx_code', STRING),
+            ('created_at', 'created_at', DATETIME),
+        ]),
+        'pharmacies': (Pharmacy.objects.all(), [
+            ('id', 'id', INT),
+            ('name', 'name', STRING),
+            ('address', 'address', STRING),
+            ('city_id', 'city_id', INT),
+            ('city', 'city__name', STRING),
+            ('network_id', 'network_id', INT),
+            ('network', 'network__name', STRING),
+            ('latitude', 'latitude', FLOAT),
+            ('longitude', 'longitude', FLOAT),
+        ]),
+        'availability': (Availability.objects.all(), [
+            ('id', 'id', INT),
+            ('drug_id', 'drug_id', INT),
+            ('pharmacy_id', 'pharmacy_id', INT),
+            ('price', 'price', FLOAT),
+            ('quantity', 'quantity', INT),
+            ('is_available', 'is_available', BOOL),
+            ('last_updated', 'last_updated', DATETIME),
+        ]),
+        # История - только за последние history_days дней снимка: по условию
+        # на recorded_at PostgreSQL читает только нужные секции
+        'price_history': (PriceHistory.objects.filter(recorded_at__gte=history_start, recorded_at__lt=history_end), [
+            ('id', 'id', INT),
+            ('availability_id', 'availability_id', INT),
+            ('price', 'price', FLOAT),
+            ('recorded_at', 'recorded_at', DATETIME),
+        ]),
+    }
+
+
+def _history_range(day, history_days):
+    start = datetime.combine(day - timedelta(days=history_days - 1), time.min, dt_timezone.utc)
+    return start, datetime.combine(day + timedelta(days=1), time.min, dt_timezone.utc)
+
+
+def _archived_history(day, history_days):
+    """
+    История за период снимка, которой нет в основной таблице (архивные файлы,
+    на SQLite - таблицы по месяцам): идет в снимок перед строками из ORM
+    """
+    start, end = _history_range(day, history_days)
+    for record in history.load_archive(start, end):
+        yield tuple(getattr(record, name) for name in history.ARCHIVE_COLUMNS)
+
+
+def _export_table(directory, queryset, columns, chunk_size, extra=()):
+    """extra - строки перед строками выборки (кортежи в порядке columns)"""
+    directory.mkdir()
+    strings = [field for _, field, kind in columns if kind == STRING]
+    widths = queryset.order_by().aggregate(
+        **{f'width_{index}': Max(Length(field)) for index, field in enumerate(strings)}
+    ) if strings else {}
+    width_of = {field: widths[f'width_{index}'] or 1 for index, field in enumerate(strings)}
+
+    writers = [
+        NpyColumnWriter(directory / f'{name}.npy', kind, width_of.get(field, 1))
+        for name, field, kind in columns
+    ]
+    rows = queryset.order_by('id').values_list(*(field for _, field, _ in columns))
+    chunk = []
+    try:
+        for row in itertools.chain(extra, rows.iterator(chunk_size=chunk_size)):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                for writer, values in zip(writers, zip(*chunk)):
+                    writer.write(values)
+                chunk = []
+        if chunk:
+            for writer, values in zip(writers, zip(*chunk)):
+                writer.write(values)
+    finally:
+        for writer in writers:
+            writer.close()
+    return {
+        'rows': writers[0].rows,
+        'columns': {writer.path.stem: writer.descr for writer in writers},
+    }
+
+
+def snapshot_dir():
+    return Path(getattr(settings, 'SNAPSHOT_DIR', Path(settings.BASE_DIR) / 'snapshots'))
+
+
+def export_snapshot(day=None, history_days=1, chunk_size=CHUNK_SIZE, output=None):
+    """
+    Снимок справочников и цен на день day в каталог <output>/<YYYY-MM-DD>:
+    по каталогу на таблицу, по файлу .npy на колонку, описание в manifest.json.
+
+    Таблицы читаются с реплики (если настроена) в одной транзакции, на
+    PostgreSQL - REPEATABLE READ: все файлы соответствуют одному моменту.
+    Снимок пишется во временный каталог и переименовывается после записи.
+    Возвращает путь к каталогу снимка.
+    """
+    day = day or datetime.now(dt_timezone.utc).date()
+    output = Path(output or snapshot_dir())
+    target = output / day.isoformat()
+    partial = output / f'{day.isoformat()}.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+
+    using = router.db_for_read(Availability)
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'date': day.isoformat(),
+        'history_days': history_days,
+        'tables': {},
+    }
+    with transaction.atomic(using=using):
+        if connections[using].vendor == 'postgresql':
+            with connections[using].cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        manifest['created_at'] = datetime.now(dt_timezone.utc).isoformat()
+        for name, (queryset, columns) in _tables(day, history_days).items():
+            extra = _archived_history(day, history_days) if name == 'price_history' else ()
+            manifest['tables'][name] = _export_table(
+                partial / name, queryset.using(using), columns, chunk_size, extra,
+            )
+            logger.info('Снимок %s: %s - строк %s', day, name, manifest['tables'][name]['rows'])
+
+    (partial / 'manifest.json').write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+    shutil.rmtree(target, ignore_errors=True)
+    partial.rename(target)
+    return target
+
+
+def read_header(path):
+    """Заголовок колонки .npy: {'descr', 'fortran_order', 'shape'} (проверка без numpy)"""
+    with open(path, 'rb') as stream:
+        prefix = stream.read(len(NPY_MAGIC) + 2)
+        if prefix[:len(NPY_MAGIC)] != NPY_MAGIC:
+            raise ValueError(f'{path} - не файл .npy версии 1.0')
+        size = int.from_bytes(prefix[len(NPY_MAGIC):], 'little')
+        return ast.literal_eval(stream.read(size).decode('latin1'))
@@ -0,0 +1,27 @@
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+from django.template.loader import render_to_string
+
+
+# Место в шаблоне, куда вставляется потоковая часть страницы
+STREAM_MARKER = '<!--stream-->'
+
+
+async def astream_render(request, template_name, context, chunks):
+    """
+    Потоковый рендер страницы: шаблон рендерится без большой таблицы
+    (в контексте stream=True, на месте строк - STREAM_MARKER), начало страницы
+    отправляется сразу, затем по мере чтения из БД идут куски chunks
+    (асинхронный итератор HTML-строк), в конце - остаток страницы.
+    Время до первого байта и память не зависят от числа строк.
+    """
+    page = await sync_to_async(render_to_string)(template_name, {**context, 'stream': True}, request)
+    head, tail = page.split(STREAM_MARKER, 1)
+
+    async def content():
+        yield head
+        async for chunk in chunks:
+            yield chunk
+        yield tail
+
+    return StreamingHttpResponse(content(), content_type='text/html; charset=utf-8')
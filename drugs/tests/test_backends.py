@@ -0,0 +1,37 @@
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+
+@override_settings(LOGIN_THROTTLE_ACCOUNT_LIMIT=3, LOGIN_THROTTLE_IP_LIMIT=100, PASSWORD_HASH_ITERATIONS=1000)
+class LoginThrottleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(email='owner@example.com', password='secret')
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self, password, ip):
+        request = RequestFactory().post('/login/', REMOTE_ADDR=ip)
+        return authenticate(request, username='Owner@Example.com', password=password), request
+
+    def test_account_blocked_per_ip(self):
+        for _ in range(3):
+            self.login('wrong', '10.0.0.1')
+        user, request = self.login('secret', '10.0.0.1')
+        self.assertIsNone(user)
+        self.assertTrue(request.login_throttled)
+
+        # Неудачные попытки с другого адреса не блокируют вход владельцу
+        user, request = self.login('secret', '10.0.0.2')
+        self.assertEqual(user, self.user)
+
+    def test_standard_pbkdf2_hash_accepted(self):
+        get_user_model().objects.filter(id=self.user.id).update(
+            password=make_password('legacy', hasher='pbkdf2_sha256'),
+        )
+        user, request = self.login('legacy', '10.0.0.3')
+        self.assertEqual(user, self.user)
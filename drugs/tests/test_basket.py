@@ -0,0 +1,88 @@
+import random
+from itertools import combinations
+
+from django.test import SimpleTestCase
+
+from drugs.basket import _candidates, _plan
+
+INF = float('inf')
+
+
+def random_vectors(seed, pharmacies, items, coverage=0.7):
+    rnd = random.Random(seed)
+    vectors = []
+    for item in range(items):
+        prices = {
+            position: (float(rnd.randint(50, 500)), item)
+            for position in range(pharmacies) if rnd.random() < coverage
+        }
+        prices.setdefault(rnd.randrange(pharmacies), (float(rnd.randint(50, 500)), item))
+        vectors.append(prices)
+    return vectors
+
+
+def brute_force(vectors, pharmacies):
+    """Перебор: самая дешевая аптека со всей корзиной и самая дешевая пара"""
+    def cost(positions):
+        total = 0.0
+        for prices in vectors:
+            offers = [prices[position][0] for position in positions if position in prices]
+            if not offers:
+                return INF
+            total += min(offers)
+        return total
+
+    single = min(cost([position]) for position in range(pharmacies))
+    pair = min(cost(pair) for pair in combinations(range(pharmacies), 2))
+    return single, pair
+
+
+class PlanTests(SimpleTestCase):
+    """_plan по маскам подмножеств против перебора всех пар аптек"""
+
+    def check(self, vectors, pharmacies, per_item):
+        single, pair = _plan(vectors, split=True, per_item=per_item)
+        expected_single, expected_pair = brute_force(vectors, pharmacies)
+        if expected_single == INF:
+            self.assertIsNone(single)
+        else:
+            self.assertAlmostEqual(single[0], expected_single)
+        if expected_pair < expected_single:
+            self.assertIsNotNone(pair)
+            self.assertAlmostEqual(pair[0], expected_pair)
+            self.assertNotEqual(pair[1], pair[2])
+            self.assertAlmostEqual(
+                pair[0],
+                sum(min(prices[p][0] for p in pair[1:] if p in prices) for prices in vectors),
+            )
+        else:
+            self.assertIsNone(pair)
+
+    def test_exact_search_matches_brute_force(self):
+        for seed in range(60):
+            pharmacies = 2 + seed % 12
+            vectors = random_vectors(seed, pharmacies, items=1 + seed % 8)
+            with self.subTest(seed=seed):
+                self.check(vectors, pharmacies, per_item=None)
+
+    def test_candidates_cover_small_cities(self):
+        # Аптек не больше per_item: отбор кандидатов не меняет ответ
+        for seed in range(60):
+            pharmacies = 2 + seed % 9
+            vectors = random_vectors(seed, pharmacies, items=2 + seed % 7, coverage=0.8)
+            with self.subTest(seed=seed):
+                self.check(vectors, pharmacies, per_item=10)
+
+    def test_dominated_pharmacy_is_dropped(self):
+        vectors = [
+            {0: (100.0, 1), 1: (120.0, 1), 2: (90.0, 1)},
+            {0: (50.0, 2), 1: (60.0, 2), 2: (70.0, 2)},
+        ]
+        # Аптека 1 не дешевле аптеки 0 ни по одной позиции
+        self.assertEqual(_candidates(vectors, per_item=10), {0, 2})
+
+    def test_split_disabled(self):
+        vectors = random_vectors(1, 5, items=3, coverage=1.0)
+        single, pair = _plan(vectors, split=False)
+        self.assertIsNone(pair)
+        self.assertAlmostEqual(single[0], brute_force(vectors, 5)[0])
@@ -0,0 +1,136 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from drugs.dedup import merge_drugs
+from drugs.models import (
+    Analogue, Availability, City, Drug, ExternalId, Pharmacy, PharmacyNetwork, PriceHistory, UserSubscription,
+)
+
+
+def create_drug(trade_name, **fields):
+    return Drug.objects.create(
+        mnn='Дротаверин', trade_name=trade_name, form='таблетки', dosage='40 мг', manufacturer='Хиноин', **fields,
+    )
+
+
+class MergeDrugsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.moscow = City.objects.get_or_create_by_name('Москва')
+        cls.kazan = City.objects.get_or_create_by_name('Казань')
+        network = PharmacyNetwork.objects.create(name='Сеть')
+        cls.first = Pharmacy.objects.create(network=network, name='Аптека 1', address='ул. Тестовая, 1', city=cls.moscow)
+        cls.second = Pharmacy.objects.create(network=network, name='Аптека 2', address='ул. Тестовая, 2', city=cls.moscow)
+
+    def setUp(self):
+        self.target = create_drug('Но-шпа')
+        self.duplicate = create_drug('НО-ШПА', atx_code='A03AD02')
+        self.other = create_drug('Спазмол')
+
+    def offer(self, drug, pharmacy, price, age_hours):
+        availability = Availability.objects.create(drug=drug, pharmacy=pharmacy, price=Decimal(price))
+        Availability.objects.filter(id=availability.id).update(
+            last_updated=timezone.now() - timedelta(hours=age_hours),
+        )
+        return availability
+
+    def test_offers_collapse_per_pharmacy(self):
+        stale = self.offer(self.target, self.first, '100.00', age_hours=5)
+        fresh = self.offer(self.duplicate, self.first, '95.00', age_hours=1)
+        moved = self.offer(self.duplicate, self.second, '110.00', age_hours=1)
+        PriceHistory.objects.create(availability=stale, price=Decimal('105.00'))
+        PriceHistory.objects.create(availability=fresh, price=Decimal('97.00'))
+
+        stats = merge_drugs(self.target.id, [self.duplicate.id])
+
+        self.assertEqual(stats['availability'], 2)
+        self.assertEqual(stats['availability_collapsed'], 1)
+        # В аптеке остается самое свежее предложение, история цен переходит к нему
+        self.assertEqual(
+            set(Availability.objects.values_list('id', 'drug_id', 'pharmacy_id')),
+            {(fresh.id, self.target.id, self.first.id), (moved.id, self.target.id, self.second.id)},
+        )
+        self.assertEqual(
+            sorted(PriceHistory.objects.filter(availability=fresh).values_list('price', flat=True)),
+            [Decimal('97.00'), Decimal('105.00')],
+        )
+        self.assertFalse(Drug.objects.filter(id=self.duplicate.id).exists())
+        # Пустые поля основной карточки заполняются из дубля
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.atx_code, 'A03AD02')
+
+    def test_subscriptions_collapse_per_user_and_city(self):
+        User = get_user_model()
+        limited = User.objects.create_user(email='limited@example.com', password='x')
+        unlimited = User.objects.create_user(email='unlimited@example.com', password='x')
+        inactive = User.objects.create_user(email='inactive@example.com', password='x')
+
+        kept = UserSubscription.objects.create(user=limited, drug=self.target, city=self.moscow, max_price=Decimal('100'))
+        UserSubscription.objects.create(user=limited, drug=self.duplicate, city=self.moscow, max_price=Decimal('150'))
+        # Неактивная подписка не смягчает цену активной
+        UserSubscription.objects.create(
+            user=limited, drug=self.duplicate, city=None, max_price=Decimal('80'), is_active=False,
+        )
+        UserSubscription.objects.create(user=unlimited, drug=self.target, city=self.kazan, max_price=Decimal('100'))
+        UserSubscription.objects.create(user=unlimited, drug=self.duplicate, city=self.kazan, max_price=None)
+        UserSubscription.objects.create(
+            user=inactive, drug=self.target, city=self.moscow, max_price=Decimal('50'), is_active=False,
+        )
+        UserSubscription.objects.create(user=inactive, drug=self.duplicate, city=self.moscow, max_price=Decimal('70'))
+
+        stats = merge_drugs(self.target.id, [self.duplicate.id])
+
+        self.assertEqual(stats['subscriptions_removed'], 3)
+        self.assertFalse(UserSubscription.objects.exclude(drug=self.target).exists())
+        rows = {
+            (row.user_id, row.city_id): (row.max_price, row.is_active)
+            for row in UserSubscription.objects.all()
+        }
+        self.assertEqual(rows, {
+            # Самая мягкая цена из активных подписок; остается подписка основного препарата
+            (limited.id, self.moscow.id): (Decimal('150.00'), True),
+            # Подписка в другом городе (здесь - без города) не объединяется
+            (limited.id, None): (Decimal('80.00'), False),
+            # Без ограничения цены, если его нет хотя бы у одной
+            (unlimited.id, self.kazan.id): (None, True),
+            # Активна, если активна любая; цена - из активной
+            (inactive.id, self.moscow.id): (Decimal('70.00'), True),
+        })
+        self.assertTrue(UserSubscription.objects.filter(id=kept.id).exists())
+
+    def test_analogues_remapped(self):
+        third = create_drug('Папаверин')
+        Analogue.objects.create(original=self.target, analogue=self.duplicate, similarity_score=0.9)
+        Analogue.objects.create(original=self.target, analogue=self.other, similarity_score=0.5, is_active=False)
+        Analogue.objects.create(original=self.duplicate, analogue=self.other, similarity_score=0.7)
+        Analogue.objects.create(original=third, analogue=self.duplicate, similarity_score=0.4)
+
+        stats = merge_drugs(self.target.id, [self.duplicate.id])
+
+        # Связь дубля с основным удалена, совпадающие связи объединены
+        self.assertEqual(stats['analogues_removed'], 2)
+        self.assertEqual(
+            set(Analogue.objects.values_list('original_id', 'analogue_id', 'similarity_score', 'is_active')),
+            {
+                (self.target.id, self.other.id, 0.7, True),
+                (third.id, self.target.id, 0.4, True),
+            },
+        )
+
+    def test_external_ids_moved(self):
+        ExternalId.objects.create(source='partner', kind=ExternalId.DRUG, code='A1', drug=self.duplicate)
+        ExternalId.objects.create(source='partner', kind=ExternalId.DRUG, code='A2', drug=self.target)
+        ExternalId.objects.create(source='partner', kind=ExternalId.DRUG, code='B1', drug=self.other)
+
+        stats = merge_drugs(self.target.id, [self.duplicate.id])
+
+        self.assertEqual(stats['external_ids'], 1)
+        self.assertEqual(
+            dict(ExternalId.objects.values_list('code', 'drug_id')),
+            {'A1': self.target.id, 'A2': self.target.id, 'B1': self.other.id},
+        )
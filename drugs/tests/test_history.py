@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from drugs import history
+from drugs.models import Availability, City, Drug, Pharmacy, PharmacyNetwork, PriceHistory
+
+
+@override_settings(PRICE_HISTORY_HOT_MONTHS=3, PRICE_HISTORY_ARCHIVE_DIR='/nonexistent/pricehistory')
+class MonthTablesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.get_or_create_by_name('Москва')
+        network = PharmacyNetwork.objects.create(name='Сеть')
+        pharmacy = Pharmacy.objects.create(network=network, name='Аптека', address='ул. Тестовая, 1', city=city)
+        drug = Drug.objects.create(mnn='Дротаверин', trade_name='Но-шпа', form='таблетки', dosage='40 мг', manufacturer='Хиноин')
+        other = Drug.objects.create(mnn='Дротаверин', trade_name='Спазмол', form='таблетки', dosage='40 мг', manufacturer='Хиноин')
+        cls.kept = Availability.objects.create(drug=drug, pharmacy=pharmacy, price=Decimal('100.00'))
+        cls.deleted = Availability.objects.create(drug=other, pharmacy=pharmacy, price=Decimal('90.00'))
+
+    def test_history_of_deleted_offer_is_removed(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('таблицы по месяцам есть только на SQLite, на PostgreSQL - секции')
+        old = datetime(2024, 1, 15, tzinfo=timezone.utc)
+        for availability in (self.kept, self.deleted):
+            PriceHistory.objects.create(availability=availability, price=availability.price)
+        PriceHistory.objects.update(recorded_at=old)
+
+        moved = history.split_cold_months(now=datetime(2024, 6, 1, tzinfo=timezone.utc))
+        self.assertEqual(moved, {datetime(2024, 1, 1, tzinfo=timezone.utc): 2})
+        self.assertFalse(PriceHistory.objects.exists())
+
+        self.deleted.delete()
+        rows = list(history.load_archive())
+        self.assertEqual([row.availability_id for row in rows], [self.kept.id])
@@ -0,0 +1,101 @@
+from django.test import SimpleTestCase
+
+from drugs.normalization import canonical_dosage, canonical_form, fingerprint
+
+
+class CanonicalDosageTests(SimpleTestCase):
+
+    def test_units(self):
+        for value, expected in (
+            ('0,5 г', '500 мг'),
+            ('500мг', '500 мг'),
+            ('500 mg', '500 мг'),
+            ('250 мкг', '0.25 мг'),
+            ('1 тыс.МЕ', '1000 ме'),
+            ('0,1%', '0.1 %'),
+        ):
+            with self.subTest(value=value):
+                self.assertEqual(canonical_dosage(value), expected)
+
+    def test_concentration(self):
+        self.assertEqual(canonical_dosage('5 mg/ml'), '5 мг/мл')
+        self.assertEqual(canonical_dosage('5 мг/1 мл'), '5 мг/мл')
+        self.assertEqual(canonical_dosage('125мг/5мл'), '125 мг/5 мл')
+        self.assertEqual(canonical_dosage('50 mcg/dose'), '0.05 мг/доза')
+
+    def test_concentration_keeps_fill_volume(self):
+        self.assertEqual(canonical_dosage('4 мг/мл 1 мл'), '4 мг/мл 1 мл')
+        self.assertEqual(canonical_dosage('4мг/мл, 2мл'), '4 мг/мл 2 мл')
+        self.assertNotEqual(canonical_dosage('4 мг/мл 1 мл'), canonical_dosage('4 мг/мл 2 мл'))
+        self.assertNotEqual(canonical_dosage('4 мг/мл 1 мл'), canonical_dosage('4 мг/мл'))
+        self.assertEqual(canonical_dosage('50 мкг/доза 120 доз'), '0.05 мг/доза 120 доз')
+
+    def test_multi_ingredient(self):
+        self.assertEqual(canonical_dosage('875мг+125мг'), '875 мг+125 мг')
+        self.assertEqual(canonical_dosage('125 мг/5 мл + 31,25 мг/5 мл'), '125 мг/5 мл+31.25 мг/5 мл')
+        self.assertNotEqual(canonical_dosage('125 мг/5 мл + 31,25 мг/5 мл'), canonical_dosage('125 мг/5 мл'))
+        self.assertEqual(canonical_dosage('160/4,5 мкг/доза'), '0.16 мг+0.0045 мг/доза')
+        self.assertNotEqual(canonical_dosage('160/4,5 мкг/доза'), canonical_dosage('80/4,5 мкг/доза'))
+
+    def test_pack_quantity(self):
+        for value in ('500 мг №10', '500 mg N10', '500 мг x 10', '500мг 10 шт'):
+            with self.subTest(value=value):
+                self.assertEqual(canonical_dosage(value), '500 мг №10')
+        self.assertNotEqual(canonical_dosage('500 мг №10'), canonical_dosage('500 мг №20'))
+
+    def test_unrecognized(self):
+        self.assertEqual(canonical_dosage(''), '')
+        self.assertEqual(canonical_dosage('По  назначению'), 'по назначению')
+        # Нераспознанное число не отбрасывается
+        self.assertEqual(canonical_dosage('5 мг в 1 табл'), '5 мг в 1 табл')
+        self.assertNotEqual(canonical_dosage('5 мг в 1 табл'), canonical_dosage('5 мг в 2 табл'))
+
+
+class CanonicalFormTests(SimpleTestCase):
+
+    def test_aliases(self):
+        for value in ('Табл.', 'таблетки', 'TABS', 'tablet'):
+            with self.subTest(value=value):
+                self.assertEqual(canonical_form(value), 'таблетки')
+        self.assertEqual(canonical_form('Капс.'), 'капсулы')
+        self.assertEqual(canonical_form('Р-р'), 'раствор')
+
+    def test_phrases(self):
+        self.assertEqual(canonical_form('Табл. п.п.о.'), 'таблетки п/о')
+        self.assertEqual(canonical_form('таблетки, покрытые пленочной оболочкой'), 'таблетки п/о')
+        self.assertEqual(canonical_form('р-р для инъекций'), 'раствор д/ин')
+
+    def test_unknown_form(self):
+        self.assertEqual(canonical_form('Пластырь'), 'пластырь')
+
+
+class FingerprintTests(SimpleTestCase):
+
+    def test_spelling_variants_match(self):
+        self.assertEqual(
+            fingerprint('Но-шпа®', 'Табл.', '0,04 г', 'ЗАО "Хиноин"'),
+            fingerprint('НО-ШПА', 'таблетки', '40мг', 'Хиноин'),
+        )
+        self.assertEqual(
+            fingerprint('Амоксиклав', 'пор. д/сусп.', '125 мг/5 мл + 31,25 мг/5 мл', 'Sandoz GmbH'),
+            fingerprint('АМОКСИКЛАВ', 'пор д/сусп', '125мг/5мл+31.25мг/5мл', 'SANDOZ'),
+        )
+
+    def test_different_packages_differ(self):
+        self.assertNotEqual(
+            fingerprint('Дексаметазон', 'р-р д/ин', '4 мг/мл 1 мл', 'КРКА'),
+            fingerprint('Дексаметазон', 'р-р д/ин', '4 мг/мл 2 мл', 'КРКА'),
+        )
+        self.assertNotEqual(
+            fingerprint('Амоксиклав', 'пор д/сусп', '125 мг/5 мл + 31,25 мг/5 мл', 'Sandoz'),
+            fingerprint('Амоксиклав', 'пор д/сусп', '125 мг/5 мл', 'Sandoz'),
+        )
+        self.assertNotEqual(
+            fingerprint('Но-шпа', 'таблетки', '40 мг', 'Хиноин'),
+            fingerprint('Но-шпа', 'капсулы', '40 мг', 'Хиноин'),
+        )
+
+    def test_key_format(self):
+        key = fingerprint('Но-шпа', 'таблетки', '40 мг', 'Хиноин')
+        self.assertEqual(len(key), 40)
+        self.assertEqual(key, fingerprint('но шпа', 'табл', '0,04 g', 'Хиноин LLC'))
@@ -0,0 +1,80 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from drugs import outbox
+from drugs.models import AvailabilityEvent, OutboxOffset
+
+
+def events(*ids):
+    return [SimpleNamespace(id=event_id) for event_id in ids]
+
+
+@override_settings(OUTBOX_SETTLE_SECONDS=5)
+class SettledTests(SimpleTestCase):
+    """Правило пропусков в нумерации (PostgreSQL): ожидание транзакций, а не таймаут"""
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def ids(self, batch, offset, xmin):
+        return [event.id for event in outbox._settled(batch, offset, xmin, self.now)]
+
+    def test_contiguous_prefix(self):
+        offset = OutboxOffset(position=10)
+        self.assertEqual(self.ids(events(11, 12, 14, 15), offset, xmin=100), [11, 12])
+
+    def test_gap_waits_for_open_transactions(self):
+        # Транзакция с пропущенным id может идти сколько угодно долго:
+        # пока xmin не дошел до запомненного xmax, пропуск не окончателен
+        offset = OutboxOffset(
+            position=12, gap_until=15, gap_xmax=200, gap_seen_at=self.now - timedelta(hours=1),
+        )
+        self.assertEqual(self.ids(events(14, 15, 16, 18), offset, xmin=199), [])
+
+    def test_gap_settles_after_transactions_finish(self):
+        offset = OutboxOffset(
+            position=12, gap_until=15, gap_xmax=200, gap_seen_at=self.now - timedelta(seconds=10),
+        )
+        # Пропуски до gap_until окончательны, дальше - снова только подряд
+        self.assertEqual(self.ids(events(14, 15, 16, 18), offset, xmin=200), [14, 15, 16])
+
+    def test_gap_settle_minimum(self):
+        offset = OutboxOffset(position=12, gap_until=15, gap_xmax=200, gap_seen_at=self.now - timedelta(seconds=1))
+        self.assertEqual(self.ids(events(14, 15), offset, xmin=300), [])
+
+
+class DispatchTests(TestCase):
+
+    def setUp(self):
+        self.delivered = []
+        outbox.consumers['test'] = lambda batch: self.delivered.extend(event.id for event in batch)
+        self.addCleanup(outbox.consumers.pop, 'test')
+
+    def create_events(self, count):
+        return [
+            AvailabilityEvent.objects.create(
+                kind=AvailabilityEvent.UPDATED, availability_id=1, drug_id=1, pharmacy_id=1,
+            ).id
+            for _ in range(count)
+        ]
+
+    def test_rolled_back_gap(self):
+        first, missing, last = self.create_events(3)
+        AvailabilityEvent.objects.filter(id=missing).delete()
+        OutboxOffset.objects.create(consumer='test', position=first - 1)
+
+        outbox.dispatch('test')
+        offset = OutboxOffset.objects.get(consumer='test')
+        if connection.vendor == 'sqlite':
+            # Одна пишущая транзакция за раз: видимый пропуск окончателен
+            self.assertEqual(self.delivered, [first, last])
+            self.assertEqual(offset.position, last)
+        else:
+            # Пропуск ждет транзакций, выполнявшихся при его обнаружении
+            self.assertEqual(self.delivered, [first])
+            self.assertEqual((offset.position, offset.gap_until), (first, last))
+            self.assertIsNotNone(offset.gap_xmax)
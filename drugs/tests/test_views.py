@@ -0,0 +1,50 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from drugs.models import Availability, City, Drug, DrugCard, Pharmacy, PharmacyNetwork
+from drugs.routers import PRIMARY_PIN_COOKIE
+
+
+class DrugDetailTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.get_or_create_by_name('Москва')
+        network = PharmacyNetwork.objects.create(name='Сеть', freshness_hours=24)
+        pharmacy = Pharmacy.objects.create(network=network, name='Аптека 1', address='ул. Тестовая, 1', city=city)
+        cls.drug = Drug.objects.create(
+            mnn='Дротаверин', trade_name='Но-шпа', form='таблетки', dosage='40 мг', manufacturer='Хиноин',
+        )
+        Availability.objects.create(drug=cls.drug, pharmacy=pharmacy, price=Decimal('120.00'), quantity=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cold_cache(self):
+        # Справочник сроков актуальности читается из БД внутри асинхронного представления
+        response = self.client.get(f'/drugs/{self.drug.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Аптека 1')
+
+    def test_missing_card(self):
+        DrugCard.objects.filter(drug=self.drug).delete()
+        response = self.client.get(f'/drugs/{self.drug.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Аптека 1')
+        self.assertTrue(DrugCard.objects.filter(drug=self.drug).exists())
+        # Сохранение карточки при чтении не закрепляет клиента за primary
+        self.assertNotIn(PRIMARY_PIN_COOKIE, response.cookies)
+
+    def test_missing_card_built_by_another_request(self):
+        # Другое чтение уже сохраняет карточку: эта сборка только отдается
+        DrugCard.objects.filter(drug=self.drug).delete()
+        cache.add(f'drug_card_build:{self.drug.id}', 1)
+        response = self.client.get(f'/drugs/{self.drug.id}/')
+        self.assertContains(response, 'Аптека 1')
+        self.assertFalse(DrugCard.objects.filter(drug=self.drug).exists())
+
+    def test_unknown_drug(self):
+        response = self.client.get(f'/drugs/{self.drug.id + 1000}/')
+        self.assertEqual(response.status_code, 404)
@@ -7,6 +7,10 @@ urlpatterns = [
     path('', views.drug_list, name='drug_list'),
     path('search/', views.drug_search, name='drug_search'),
     path('<int:drug_id>/', views.drug_detail, name='drug_detail'),
+    path('<int:drug_id>/offers/', views.drug_offers, name='drug_offers'),
+    path('autocomplete/', views.drug_autocomplete, name='drug_autocomplete'),
+    path('basket/', views.basket, name='basket'),
+    path('api/offers/', views.ingest_offers, name='ingest_offers'),
     
     # Аутентификация
     path('register/', views.register, name='register'),
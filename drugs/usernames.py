@@ -0,0 +1,82 @@
+import re
+
+from django.db.models.functions import Length
+
+
+# Длина поля CustomUser.username и запас под числовой суффикс
+USERNAME_MAX_LENGTH = 150
+SUFFIX_RESERVE = 10
+
+_SUFFIX_RE = re.compile(r'[1-9][0-9]*$')
+
+
+def username_base(email):
+    """База для username: часть email до @ (обрезанная с запасом под суффикс)"""
+    base = email.split('@')[0] or 'user'
+    return base[:USERNAME_MAX_LENGTH - SUFFIX_RESERVE]
+
+
+def next_free_username(queryset, base):
+    """
+    Свободный username вида base, base1, base2, ... за один запрос.
+
+    Из занятых имен вида base<число> выбирается максимальное (длиннее = больше,
+    при равной длине - больше лексикографически), следующее за ним свободно.
+    """
+    pattern = rf'^{re.escape(base)}([1-9][0-9]*)?$'
+    last = (
+        queryset.filter(username__startswith=base, username__regex=pattern)
+        .annotate(username_length=Length('username'))
+        .order_by('-username_length', '-username')
+        .values_list('username', flat=True)
+        .first()
+    )
+    if last is None:
+        return base
+    suffix = last[len(base):]
+    return f'{base}{int(suffix) + 1 if suffix else 1}'
+
+
+class UsernameAllocator:
+    """
+    Выдача уникальных username для массового импорта без запроса на каждого пользователя.
+
+    preload() один раз читает все занятые username и для каждой возможной базы
+    запоминает максимальный занятый суффикс; дальше имена выдаются из памяти.
+    Параллельные регистрации во время импорта ловятся уникальным индексом
+    при вставке.
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self._max_suffix = {}
+        self._loaded = False
+
+    def _register(self, username):
+        # -1 - свободна только база, 0 - занята сама база, N - занят base<N>
+        self._max_suffix[username] = max(self._max_suffix.get(username, -1), 0)
+        # Имя с цифрами на конце - это base<N> для каждого возможного деления:
+        # user12 занимает и user + 12, и user1 + 2
+        digits = len(username) - len(username.rstrip('0123456789'))
+        for split in range(len(username) - digits, len(username)):
+            suffix = username[split:]
+            if _SUFFIX_RE.fullmatch(suffix):
+                base = username[:split]
+                self._max_suffix[base] = max(self._max_suffix.get(base, -1), int(suffix))
+
+    def preload(self, chunk_size=10000):
+        for username in self.queryset.exclude(username__isnull=True).values_list(
+            'username', flat=True
+        ).iterator(chunk_size=chunk_size):
+            self._register(username)
+        self._loaded = True
+        return self
+
+    def allocate(self, email):
+        if not self._loaded:
+            self.preload()
+        base = username_base(email)
+        current = self._max_suffix.get(base, -1)
+        username = base if current < 0 else f'{base}{current + 1}'
+        self._register(username)
+        return username
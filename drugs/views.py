@@ -1,130 +1,172 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, Http404, JsonResponse
+from django.template.loader import render_to_string
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.db.models import Min, Avg, Count, Q
 from django.core.mail import send_mail
 from django.conf import settings
-from .models import Drug, Availability, Analogue, UserSubscription, Pharmacy, PharmacyNetwork
+from asgiref.sync import sync_to_async
+from .models import Drug, Availability, Analogue, UserSubscription, Pharmacy, PharmacyNetwork, City
 from .forms import UserRegistrationForm, UserLoginForm, SubscriptionForm, SubscriptionEditForm
+from .reference import search_drugs
+from .cards import get_card, card_context, offer_page
+from .streaming import astream_render
+from . import basket as basket_optimizer, catalog, push
+from .notifications import (
+    OfferBlockCache, AnalogueIndex, IMMEDIATE_OFFERS_TEMPLATE, DIGEST_OFFERS_TEMPLATE,
+    build_immediate_message, build_digest_message, build_analogue_message,
+)
 from decimal import Decimal
 from datetime import datetime, timedelta
 from random import random
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
-def home(request):
+# Строки таблицы предложений (страница препарата, подгрузка, потоковый режим)
+OFFER_ROWS_TEMPLATE = 'drugs/includes/offer_rows.html'
+
+# Сколько строк таблицы отправляется одним куском в потоковом режиме
+OFFERS_STREAM_CHUNK = 200
+
+async def _arender(request, template_name, context):
+    """
+    Рендер шаблона из асинхронного view.
+    Контекст-процессоры (auth, messages) читают сессию синхронно,
+    поэтому сам рендер выполняется в потоке через sync_to_async.
+    """
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def home(request):
     """Главная страница"""
     # Получаем препараты с минимальной ценой и количеством аптек
-    featured_drugs = Drug.objects.annotate(
+    featured_query = Drug.objects.annotate(
         min_price=Min('availability__price'),
         pharmacy_count=Count('availability', distinct=True)
     ).filter(
         availability__is_available=True
     ).order_by('?')[:6]  # Случайные 6 препаратов
     
-    total_drugs = Drug.objects.count()
-    pharmacies_count = Pharmacy.objects.count()
+    featured_drugs = [drug async for drug in featured_query]
+    total_drugs = await Drug.objects.acount()
+    pharmacies_count = await Pharmacy.objects.acount()
     
-    return render(request, 'drugs/home.html', {
+    return await _arender(request, 'drugs/home.html', {
         'featured_drugs': featured_drugs,
         'total_drugs': total_drugs,
         'pharmacies_count': pharmacies_count,
     })
 
-def drug_list(request):
+async def drug_list(request):
     """Список всех препаратов"""
     query = request.GET.get('q', '')
     
-    drugs = Drug.objects.annotate(
+    drugs_query = Drug.objects.annotate(
         min_price=Min('availability__price'),
         pharmacy_count=Count('availability', distinct=True)
     ).all()
     
     if query:
-        drugs = drugs.filter(
+        drugs_query = drugs_query.filter(
             Q(trade_name__icontains=query) |
             Q(mnn__icontains=query) |
             Q(manufacturer__icontains=query)
         )
     
-    drugs = drugs.order_by('trade_name')
+    drugs_query = drugs_query.order_by('trade_name')
     
-    available_drugs = drugs.filter(availability__is_available=True).distinct().count()
+    drugs = [drug async for drug in drugs_query]
+    available_drugs = await drugs_query.filter(availability__is_available=True).distinct().acount()
     
-    return render(request, 'drugs/drug_list.html', {
+    return await _arender(request, 'drugs/drug_list.html', {
         'drugs': drugs,
-        'total_drugs': drugs.count(),
+        'total_drugs': len(drugs),
         'available_drugs': available_drugs,
         'query': query,
     })
 
-def drug_detail(request, drug_id):
+async def _load_user_subscription(request, drug_id):
+    """Активная подписка текущего пользователя на препарат"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None
+    return await UserSubscription.objects.filter(
+        user=user,
+        drug_id=drug_id,
+        is_active=True
+    ).select_related('city').afirst()
+
+async def _stream_offer_rows(drug_id):
+    """
+    Строки таблицы предложений кусками по OFFERS_STREAM_CHUNK. Каждый кусок -
+    отдельный короткий запрос по курсору (как у drug_offers), соединение
+    не держится открытым на время отправки страницы.
+    """
+    after = None
+    while True:
+        offers, after = await sync_to_async(offer_page)(drug_id, after, OFFERS_STREAM_CHUNK)
+        yield render_to_string(OFFER_ROWS_TEMPLATE, {'availabilities': offers})
+        if after is None:
+            break
+
+def _load_card_context(drug_id):
+    """
+    Карточка и контекст шаблона в одном потоке: отметка устаревших предложений
+    читает сроки актуальности сетей, а при холодном кэше это запрос к БД
+    """
+    data = get_card(drug_id)
+    return card_context(data) if data is not None else None
+
+async def drug_detail(request, drug_id):
     """Детальная страница препарата"""
-    drug = get_object_or_404(
-        Drug.objects.annotate(
-            min_price=Min('availability__price'),
-            avg_price=Avg('availability__price'),
-            pharmacy_count=Count('availability', distinct=True)
-        ),
-        id=drug_id
+    # Препарат, первая страница предложений и аналоги берутся из готовой карточки
+    # одним чтением по ключу
+    context, user_subscription = await asyncio.gather(
+        sync_to_async(_load_card_context)(drug_id),
+        _load_user_subscription(request, drug_id),
     )
-    
-    # Получаем наличие препарата в аптеках
-    availabilities = Availability.objects.filter(
-        drug=drug,
-        is_available=True
-    ).select_related('pharmacy', 'pharmacy__network').order_by('price')
-    
-    # Получаем аналоги препарата
-    analogues_ids = Analogue.objects.filter(
-        Q(original=drug) | Q(analogue=drug)
-    ).values_list('original_id', 'analogue_id')
-    
-    analogue_ids = set()
-    for orig_id, anal_id in analogues_ids:
-        if orig_id == drug.id:
-            analogue_ids.add(anal_id)
-        else:
-            analogue_ids.add(orig_id)
-    
-    analogues = Drug.objects.filter(id__in=analogue_ids).annotate(
-        min_price=Min('availability__price')
-    ).distinct()[:10]
-    
-    # Проверяем, подписан ли пользователь на этот препарат
-    user_subscription = None
-    if request.user.is_authenticated:
-        user_subscription = UserSubscription.objects.filter(
-            user=request.user,
-            drug=drug,
-            is_active=True
-        ).first()
-    
-    # Проверяем, есть ли препарат в наличии (для отображения в шаблоне)
-    is_available = availabilities.exists()
-    # Берем только первые 2 аптеки для отображения
-    first_availabilities = availabilities[:2]
-    
-    return render(request, 'drugs/drug_detail.html', {
-        'drug': drug,
-        'availabilities': availabilities,
-        'first_availabilities': first_availabilities,
-        'is_available': is_available,
-        'analogues': analogues,
+    if context is None:
+        raise Http404('Препарат не найден')
+    
+    availabilities = context['availabilities']
+    context.update({
+        # Берем только первые 2 аптеки для отображения
+        'first_availabilities': availabilities[:2],
+        'is_available': bool(availabilities),
         'user_subscription': user_subscription,
     })
+    
+    if request.GET.get('offers') == 'all' and context['next_cursor']:
+        # Полная таблица (без JavaScript): страница отдается потоком,
+        # строки читаются из БД кусками
+        return await astream_render(request, 'drugs/drug_detail.html', context, _stream_offer_rows(drug_id))
+    return await _arender(request, 'drugs/drug_detail.html', context)
+
+async def drug_offers(request, drug_id):
+    """Следующая страница предложений для таблицы на странице препарата"""
+    try:
+        offers, next_cursor = await sync_to_async(offer_page)(drug_id, request.GET.get('after'))
+    except (ValueError, ArithmeticError):
+        return HttpResponseBadRequest('Некорректный курсор')
+    return JsonResponse({
+        'html': render_to_string(OFFER_ROWS_TEMPLATE, {'availabilities': offers}),
+        'next': next_cursor,
+    })
 
-def drug_search(request):
+async def drug_search(request):
     """Поиск препаратов"""
     query = request.GET.get('q', '')
     
-    results = Drug.objects.none()
+    results = []
     
     if query:
-        results = Drug.objects.annotate(
+        results_query = Drug.objects.annotate(
             min_price=Min('availability__price')
         ).filter(
             Q(trade_name__icontains=query) |
@@ -132,12 +174,107 @@ def drug_search(request):
             Q(manufacturer__icontains=query) |
             Q(description__icontains=query)
         ).order_by('trade_name')
+        results = [drug async for drug in results_query]
     
-    return render(request, 'drugs/drug_search.html', {
+    return await _arender(request, 'drugs/drug_search.html', {
         'results': results,
         'query': query,
     })
 
+def drug_autocomplete(request):
+    """Варианты препаратов для поля автодополнения в форме подписки"""
+    query = request.GET.get('q', '')
+    results = [{'id': drug_id, 'text': label} for drug_id, label in search_drugs(query)]
+    return JsonResponse({'results': results})
+
+@csrf_exempt
+@require_POST
+def ingest_offers(request):
+    """
+    Прием остатков от партнера (drugs.push): тело - NDJSON, можно сжатый gzip,
+    строка - {"pharmacy": код, "drug": код, "price": цена, "quantity": количество}.
+    Ключ партнера - в заголовке Authorization: Bearer, ключ идемпотентности -
+    в заголовке Idempotency-Key.
+    """
+    token = push.authenticate(request)
+    if token is None:
+        return JsonResponse({'error': 'Неверный ключ доступа'}, status=401)
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if not key or len(key) > 100:
+        return JsonResponse({'error': 'Укажите заголовок Idempotency-Key (до 100 символов)'}, status=400)
+
+    status, data, replayed = push.receive(token, key, request)
+    response = JsonResponse(data, status=status)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    if status == 429:
+        response['Retry-After'] = str(getattr(settings, 'INGEST_RETRY_AFTER_SECONDS', 5))
+    return response
+
+def basket(request):
+    """
+    Подбор аптек для корзины: ?city=<id>&drug=<id>&drug=<id>...[&analogues=1].
+    Возвращает самую дешевую аптеку со всей корзиной и, если выгоднее,
+    самую дешевую пару аптек.
+    """
+    try:
+        city_id = int(request.GET['city'])
+        drug_ids = list(dict.fromkeys(int(value) for value in request.GET.getlist('drug')))
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Укажите город (city) и препараты (drug)'}, status=400)
+    if not drug_ids:
+        return JsonResponse({'error': 'Корзина пуста'}, status=400)
+    if len(drug_ids) > basket_optimizer.BASKET_MAX_ITEMS:
+        return JsonResponse(
+            {'error': f'В корзине не больше {basket_optimizer.BASKET_MAX_ITEMS} препаратов'},
+            status=400,
+        )
+
+    result = basket_optimizer.optimize(city_id, drug_ids, request.GET.get('analogues') == '1')
+
+    plans = [plan for plan in (result['single'], result['split']) if plan]
+    pharmacies = catalog.pharmacies.get_many({item['pharmacy_id'] for plan in plans for item in plan['items']})
+    drugs = catalog.drugs.get_many(
+        set(drug_ids) | {item['chosen_drug_id'] for plan in plans for item in plan['items']}
+    )
+
+    def pharmacy_data(pharmacy_id):
+        pharmacy = pharmacies.get(pharmacy_id)
+        return {
+            'id': pharmacy_id,
+            'name': pharmacy.name if pharmacy else None,
+            'address': pharmacy.address if pharmacy else None,
+        }
+
+    def plan_data(plan):
+        if plan is None:
+            return None
+        ids = plan['pharmacy_ids'] if 'pharmacy_ids' in plan else [plan['pharmacy_id']]
+        return {
+            'total': str(plan['total']),
+            'pharmacies': [pharmacy_data(pharmacy_id) for pharmacy_id in ids],
+            'items': [
+                {
+                    'drug_id': item['drug_id'],
+                    'chosen_drug_id': item['chosen_drug_id'],
+                    'chosen_drug': str(drugs[item['chosen_drug_id']]) if item['chosen_drug_id'] in drugs else None,
+                    'pharmacy_id': item['pharmacy_id'],
+                    'price': str(item['price']),
+                }
+                for item in plan['items']
+            ],
+        }
+
+    return JsonResponse({
+        'city': city_id,
+        'single': plan_data(result['single']),
+        'split': plan_data(result['split']),
+        'missing': [
+            {'id': drug_id, 'name': str(drugs[drug_id]) if drug_id in drugs else None}
+            for drug_id in result['missing']
+        ],
+    })
+
 logger = logging.getLogger(__name__)
 
 def register(request):
@@ -154,7 +291,7 @@ def register(request):
                 logger.info(f'Пользователь создан: {user.email}')
                 
                 # Автоматически логиним пользователя
-                user.backend = 'django.contrib.auth.backends.ModelBackend'
+                user.backend = 'drugs.backends.EmailBackend'
                 login(request, user)
                 
                 messages.success(request, f'Добро пожаловать, {user.get_full_name()}! Регистрация прошла успешно.')
@@ -179,13 +316,15 @@ def user_login(request):
         return redirect('home')
     
     if request.method == 'POST':
-        form = UserLoginForm(data=request.POST)
+        form = UserLoginForm(request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
             login(request, user)
             messages.success(request, f'Добро пожаловать, {user.get_full_name()}!')
             next_url = request.GET.get('next', 'home')
             return redirect(next_url)
+        elif form.has_error('__all__', 'too_many_attempts'):
+            messages.error(request, 'Слишком много попыток входа. Попробуйте позже.')
         else:
             # Добавляем сообщение об ошибке
             messages.error(request, 'Неверный email или пароль. Попробуйте еще раз.')
@@ -205,7 +344,7 @@ def user_logout(request):
 @login_required
 def my_subscriptions(request):
     """Страница подписок пользователя"""
-    subscriptions = UserSubscription.objects.filter(user=request.user).select_related('drug')
+    subscriptions = UserSubscription.objects.filter(user=request.user).select_related('drug', 'city')
     
     return render(request, 'drugs/my_subscriptions.html', {
         'subscriptions': subscriptions,
@@ -265,18 +404,12 @@ def send_immediate_notification(subscription):
     
     try:
         # Проверяем наличие препарата по критериям подписки
-        availabilities_query = Availability.objects.filter(
-            drug=subscription.drug,
-            is_available=True
-        ).select_related('pharmacy')
-        
-        if subscription.city:
-            availabilities_query = availabilities_query.filter(pharmacy__city=subscription.city)
-        
-        if subscription.max_price:
-            availabilities_query = availabilities_query.filter(price__lte=subscription.max_price)
-        
-        availabilities = list(availabilities_query.order_by('price')[:10])  # Топ 10 самых дешевых
+        offers_cache = OfferBlockCache(IMMEDIATE_OFFERS_TEMPLATE)
+        offers_block, availabilities = offers_cache.get_block(
+            subscription.drug_id,
+            city_id=subscription.city_id,
+            max_price=subscription.max_price,
+        )
         
         if availabilities:
             # Формируем заголовок в зависимости от фильтров
@@ -285,42 +418,7 @@ def send_immediate_notification(subscription):
             else:
                 subject = f'✅ {subscription.drug.trade_name} уже в наличии!'
             
-            message_lines = [
-                f'Здравствуйте, {subscription.user.get_full_name()}!',
-                '',
-                f'Препарат {subscription.drug.trade_name} ({subscription.drug.mnn}) доступен:',
-                '',
-            ]
-            
-            # Добавляем информацию о фильтрах
-            if subscription.city or subscription.max_price:
-                message_lines.append('По вашим критериям:')
-                if subscription.city:
-                    message_lines.append(f'• Город: {subscription.city}')
-                if subscription.max_price:
-                    message_lines.append(f'• Максимальная цена: до {subscription.max_price} руб.')
-                message_lines.append('')
-            
-            message_lines.append('Найдены следующие предложения:')
-            message_lines.append('')
-            
-            for avail in availabilities:
-                message_lines.append(f'🏥 {avail.pharmacy.name}')
-                message_lines.append(f'📍 {avail.pharmacy.address}, {avail.pharmacy.city}')
-                message_lines.append(f'💰 Цена: {avail.price} руб.')
-                if avail.quantity > 0:
-                    message_lines.append(f'📦 В наличии: {avail.quantity} шт.')
-                message_lines.append('')
-            
-            site_url = getattr(settings, 'SITE_URL', 'http://localhost:8000')
-            message_lines.append(f'🔗 Подробнее о препарате: {site_url}/drugs/{subscription.drug.id}/')
-            message_lines.append('')
-            message_lines.append('---')
-            message_lines.append('Это автоматическое уведомление о текущем наличии.')
-            message_lines.append('Вы будете получать уведомления при появлении новых поступлений.')
-            message_lines.append('Чтобы изменить параметры подписки, перейдите в "Мои подписки".')
-            
-            message = '\n'.join(message_lines)
+            message = build_immediate_message(subscription, offers_block)
             
             # Отправляем email
             send_mail(
@@ -334,15 +432,31 @@ def send_immediate_notification(subscription):
             logger.info(f'Немедленное уведомление отправлено {subscription.user.email} о {subscription.drug.trade_name}')
             return True
         
-        else:
-            # Записываем почему не отправили
-            reason = "нет в наличии"
-            if subscription.city:
-                reason = f"нет в городе {subscription.city}"
-            if subscription.max_price:
-                reason = f"нет по цене до {subscription.max_price} руб."
-            logger.info(f'Нет текущего наличия для {subscription.user.email} о {subscription.drug.trade_name} ({reason})')
-            return False
+        # Препарата нет по условиям подписки - предлагаем аналоги в наличии
+        analogues = AnalogueIndex([subscription.drug_id]).get(
+            subscription.drug_id,
+            city_id=subscription.city_id,
+            max_price=subscription.max_price,
+        )
+        if analogues:
+            send_mail(
+                f'Аналоги {subscription.drug.trade_name} в наличии',
+                build_analogue_message(subscription, analogues),
+                settings.DEFAULT_FROM_EMAIL,
+                [subscription.user.email],
+                fail_silently=False,
+            )
+            logger.info(f'Отправлены аналоги {subscription.drug.trade_name} для {subscription.user.email}')
+            return True
+        
+        # Записываем почему не отправили
+        reason = "нет в наличии"
+        if subscription.city:
+            reason = f"нет в городе {subscription.city}"
+        if subscription.max_price:
+            reason = f"нет по цене до {subscription.max_price} руб."
+        logger.info(f'Нет текущего наличия для {subscription.user.email} о {subscription.drug.trade_name} ({reason})')
+        return False
             
     except Exception as e:
         logger.error(f'Ошибка при отправке немедленного уведомления: {e}')
@@ -368,7 +482,7 @@ def edit_subscription(request, subscription_id):
     """Редактирование подписки с проверкой наличия"""
     subscription = get_object_or_404(UserSubscription, id=subscription_id, user=request.user)
     
-    old_city = subscription.city
+    old_city_id = subscription.city_id
     old_max_price = subscription.max_price
     
     if request.method == 'POST':
@@ -378,7 +492,7 @@ def edit_subscription(request, subscription_id):
             
             # Проверяем, изменились ли фильтры
             subscription.refresh_from_db()
-            filters_changed = (old_city != subscription.city) or (old_max_price != subscription.max_price)
+            filters_changed = (old_city_id != subscription.city_id) or (old_max_price != subscription.max_price)
             
             # Если фильтры изменились или подписка стала активной, проверяем наличие
             if filters_changed or subscription.is_active:
@@ -400,7 +514,7 @@ def check_my_subscriptions(request):
     subscriptions = UserSubscription.objects.filter(
         user=request.user,
         is_active=True
-    ).select_related('drug')
+    ).select_related('drug', 'city')
     
     notifications_sent = 0
     
@@ -421,68 +535,55 @@ def send_availability_notifications(drug_id=None):
     Отправка уведомлений о наличии препаратов подписанным пользователям.
     Можно вызывать через management command или cron.
     """
-    subscriptions_query = UserSubscription.objects.filter(is_active=True).select_related('user', 'drug')
+    # Препараты берутся из каталога в памяти (drugs.catalog), JOIN не нужен
+    subscriptions_query = UserSubscription.objects.filter(is_active=True).select_related('user', 'city')
     
     if drug_id:
         subscriptions_query = subscriptions_query.filter(drug_id=drug_id)
     
     notifications_sent = 0
+    # Блок предложений рендерится один раз на (препарат, город, ценовая корзина)
+    offers_cache = OfferBlockCache(DIGEST_OFFERS_TEMPLATE)
+    # Аналоги на случай, когда препарата нет: индекс строится заранее для всей рассылки
+    analogue_index = AnalogueIndex(subscriptions_query.values('drug_id'))
     
     for subscription in subscriptions_query:
-        # Проверяем наличие препарата
-        availabilities_query = Availability.objects.filter(
-            drug=subscription.drug,
-            is_available=True
-        ).select_related('pharmacy', 'drug')
-        
-        # Фильтруем по городу, если указан
-        if subscription.city:
-            availabilities_query = availabilities_query.filter(pharmacy__city=subscription.city)
+        if not subscription.user.email_notifications:
+            continue
         
-        # Фильтруем по максимальной цене, если указана
-        if subscription.max_price:
-            availabilities_query = availabilities_query.filter(price__lte=subscription.max_price)
-        
-        availabilities = list(availabilities_query[:10])  # Ограничиваем до 10 аптек
+        # Проверяем наличие препарата с учетом города и максимальной цены
+        offers_block, availabilities = offers_cache.get_block(
+            subscription.drug_id,
+            city_id=subscription.city_id,
+            max_price=subscription.max_price,
+        )
         
-        if availabilities and subscription.user.email_notifications:
+        if availabilities:
             # Формируем сообщение
-            subject = f'Наличие препарата {subscription.drug.trade_name}'
-            
-            message_parts = [
-                f'Здравствуйте, {subscription.user.get_full_name()}!',
-                '',
-                f'Препарат {subscription.drug.trade_name} ({subscription.drug.mnn}) теперь доступен:',
-                '',
-            ]
-            
-            for availability in availabilities:
-                message_parts.append(
-                    f"• {availability.pharmacy.name} ({availability.pharmacy.address})"
-                )
-                message_parts.append(f"  Цена: {availability.price} руб.")
-                if availability.quantity > 0:
-                    message_parts.append(f"  В наличии: {availability.quantity} шт.")
-                message_parts.append('')
-            
-            message_parts.append(f'Просмотреть подробности: {settings.SITE_URL if hasattr(settings, "SITE_URL") else ""}/drugs/{subscription.drug.id}/')
-            message_parts.append('')
-            message_parts.append('---')
-            message_parts.append('Вы получили это письмо, так как подписаны на уведомления о наличии препаратов.')
-            
-            message = '\n'.join(message_parts)
-            
-            try:
-                subscription.user.email_user(
-                    subject,
-                    message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    fail_silently=False,
-                )
-                notifications_sent += 1
-            except Exception as e:
-                # Логируем ошибку, но продолжаем обработку других подписок
-                print(f"Error sending email to {subscription.user.email}: {e}")
+            subject = f'Наличие препарата {catalog.drugs.get(subscription.drug_id).trade_name}'
+            message = build_digest_message(subscription, offers_block)
+        else:
+            analogues = analogue_index.get(
+                subscription.drug_id,
+                city_id=subscription.city_id,
+                max_price=subscription.max_price,
+            )
+            if not analogues:
+                continue
+            subject = f'Аналоги препарата {catalog.drugs.get(subscription.drug_id).trade_name} в наличии'
+            message = build_analogue_message(subscription, analogues)
+        
+        try:
+            subscription.user.email_user(
+                subject,
+                message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                fail_silently=False,
+            )
+            notifications_sent += 1
+        except Exception as e:
+            # Логируем ошибку, но продолжаем обработку других подписок
+            print(f"Error sending email to {subscription.user.email}: {e}")
     
     return notifications_sent
 
@@ -510,10 +611,7 @@ def create_test_data(request):
         
         drugs = []
         for data in drugs_data:
-            drug, created = Drug.objects.get_or_create(
-                trade_name=data['trade_name'],
-                defaults=data
-            )
+            drug, created = Drug.objects.get_or_create_normalized(**data)
             drugs.append(drug)
         
         # 2. Создаем аналоги
@@ -553,7 +651,10 @@ def create_test_data(request):
             networks.append(network)
         
         # 4. Создаем аптеки
-        cities = ['Москва', 'Санкт-Петербург', 'Казань', 'Екатеринбург']
+        cities = [
+            City.objects.get_or_create_by_name(name)
+            for name in ['Москва', 'Санкт-Петербург', 'Казань', 'Екатеринбург']
+        ]
         pharmacies = []
         
         for i in range(10):
@@ -606,7 +707,7 @@ def create_test_data(request):
                 user=request.user,
                 drug=test_drug,
                 defaults={
-                    'city': 'Москва',
+                    'city': City.objects.get_or_create_by_name('Москва'),
                     'max_price': Decimal('100.00'),
                     'is_active': True
                 }
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pharmacy.settings')
 
 application = get_asgi_application()
+
+# Прогрев каталога препаратов и аптек в памяти воркера (в фоне)
+from drugs import catalog  # noqa: E402
+
+catalog.warm_on_start()
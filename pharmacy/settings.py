@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 
 SECRET_KEY = config("SECRET_KEY")
@@ -29,11 +29,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "drugs.instrumentation.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "drugs.routers.primary_pin_middleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -59,22 +61,191 @@ TEMPLATES = [
 WSGI_APPLICATION = "pharmacy.wsgi.application"
 
 # Database
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE=sqlite (по умолчанию) - один узел, файл SQLite в режиме WAL
+# DB_ENGINE=postgres - PostgreSQL (в docker-compose - со встроенным пулом psycopg)
+DB_ENGINE = config("DB_ENGINE", default="sqlite")
+
+if DB_ENGINE == "postgres":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": config("POSTGRES_DB", default="pharmacy"),
+            "USER": config("POSTGRES_USER", default="pharmacy"),
+            "PASSWORD": config("POSTGRES_PASSWORD", default=""),
+            "HOST": config("POSTGRES_HOST", default="localhost"),
+            "PORT": config("POSTGRES_PORT", default=5432, cast=int),
+            # Соединение на запрос: под ASGI каждый поток sync_to_async держал бы свое
+            # постоянное соединение, и они не закрываются надежно. Переиспользование
+            # соединений - через DB_POOL_MODE=psycopg или pgbouncer
+            "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", default=0, cast=int),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "connect_timeout": config("DB_CONNECT_TIMEOUT", default=5, cast=int),
+            },
+        }
     }
-}
+
+    DB_POOL_MODE = config("DB_POOL_MODE", default="")
+    if DB_POOL_MODE == "pgbouncer":
+        # Внешний пулер в режиме transaction: соединения держит PgBouncer,
+        # серверные курсоры между транзакциями не переживают
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+    elif DB_POOL_MODE == "psycopg":
+        # Встроенный пул psycopg 3 внутри процесса (несовместим с CONN_MAX_AGE)
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": config("DB_POOL_MIN_SIZE", default=2, cast=int),
+            "max_size": config("DB_POOL_MAX_SIZE", default=10, cast=int),
+            "timeout": config("DB_POOL_TIMEOUT", default=10, cast=int),
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": config("SQLITE_PATH", default=str(BASE_DIR / "db.sqlite3")),
+            "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", default=0, cast=int),
+            "OPTIONS": {
+                # Ждем освобождения блокировки вместо мгновенного "database is locked"
+                "timeout": config("SQLITE_TIMEOUT", default=20, cast=int),
+                # Пишущие транзакции сразу берут блокировку, без апгрейда с чтения
+                "transaction_mode": "IMMEDIATE",
+                # WAL: читатели не блокируют писателя и наоборот
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA temp_store=MEMORY;"
+                    "PRAGMA cache_size=-20000;"
+                    "PRAGMA mmap_size=134217728;"
+                ),
+            },
+        }
+    }
+
+# Реплики для чтения каталога (см. drugs.routers.PrimaryReplicaRouter)
+# PostgreSQL: DB_REPLICA_HOSTS=replica1.local,replica2.local
+# SQLite (локальная проверка): DB_REPLICA_PATHS=/path/to/db_replica.sqlite3
+DATABASE_REPLICAS = []
+if DB_ENGINE == "postgres":
+    _replica_sources = [("HOST", host) for host in config("DB_REPLICA_HOSTS", default="", cast=Csv())]
+else:
+    _replica_sources = [("NAME", path) for path in config("DB_REPLICA_PATHS", default="", cast=Csv())]
+
+for _index, (_key, _value) in enumerate(_replica_sources, start=1):
+    _alias = f"replica{_index}"
+    DATABASES[_alias] = {
+        **DATABASES["default"],
+        "OPTIONS": dict(DATABASES["default"]["OPTIONS"]),
+        _key: _value,
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(_alias)
+
+DATABASE_ROUTERS = ["drugs.routers.PrimaryReplicaRouter"]
+# Сколько секунд после записи клиент читает только с primary
+REPLICA_PIN_SECONDS = config("REPLICA_PIN_SECONDS", default=5, cast=int)
+
+# Кэш: общий Redis для нескольких процессов или локальная память для разработки
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Время жизни кэша справочников (города, сети, препараты), сек
+REFERENCE_CACHE_TIMEOUT = config("REFERENCE_CACHE_TIMEOUT", default=600, cast=int)
+
+# Списки админки: начиная с какого размера выборки показывать оценку числа строк вместо COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = config("ADMIN_ESTIMATED_COUNT_THRESHOLD", default=100000, cast=int)
+
+# Каталог препаратов/аптек/сетей в памяти процесса (drugs.catalog)
+CATALOG_CACHE_SIZE = config("CATALOG_CACHE_SIZE", default=5000, cast=int)
+CATALOG_VERSION_CHECK_SECONDS = config("CATALOG_VERSION_CHECK_SECONDS", default=1, cast=float)
+# Сколько секунд запись живет в памяти процесса без проверки (если версия не дошла: нет общего кэша)
+CATALOG_MAX_AGE_SECONDS = config("CATALOG_MAX_AGE_SECONDS", default=300, cast=int)
+CATALOG_WARM_ON_START = config("CATALOG_WARM_ON_START", default=True, cast=bool)
+
+# Корзина: матрицы цен по городам в памяти воркера
+BASKET_MATRIX_TTL = config("BASKET_MATRIX_TTL", default=300, cast=int)
+BASKET_MATRIX_CITIES = config("BASKET_MATRIX_CITIES", default=50, cast=int)
+
+# Аналоги, которые предлагаются вместо отсутствующего препарата: минимальный коэффициент схожести
+ANALOGUE_MIN_SIMILARITY = config("ANALOGUE_MIN_SIMILARITY", default=0.0, cast=float)
+
+# Журнал изменений наличия (drugs.outbox). Пропуск в нумерации событий не истекает
+# по времени: он ждет завершения транзакций, выполнявшихся при его обнаружении;
+# OUTBOX_SETTLE_SECONDS - минимальное ожидание поверх этого
+OUTBOX_SETTLE_SECONDS = config("OUTBOX_SETTLE_SECONDS", default=5, cast=float)
+OUTBOX_RETENTION_DAYS = config("OUTBOX_RETENTION_DAYS", default=7, cast=int)
+
+# Срок актуальности остатков по умолчанию (у сети может быть свой)
+STOCK_FRESHNESS_HOURS = config("STOCK_FRESHNESS_HOURS", default=72, cast=int)
+
+# История цен по месяцам (drugs.history)
+PRICE_HISTORY_HOT_MONTHS = config("PRICE_HISTORY_HOT_MONTHS", default=3, cast=int)
+PRICE_HISTORY_DB_MONTHS = config("PRICE_HISTORY_DB_MONTHS", default=12, cast=int)
+PRICE_HISTORY_RETENTION_MONTHS = config("PRICE_HISTORY_RETENTION_MONTHS", default=36, cast=int)
+PRICE_HISTORY_ARCHIVE_DIR = config("PRICE_HISTORY_ARCHIVE_DIR", default=str(BASE_DIR / "archive" / "pricehistory"))
+
+# Снимки для аналитики (export_snapshot)
+SNAPSHOT_DIR = config("SNAPSHOT_DIR", default=str(BASE_DIR / "snapshots"))
+
+# Загрузка выгрузок аптечных сетей (drugs.feeds)
+FEED_WORKERS = config("FEED_WORKERS", default=4, cast=int)
+FEED_LEASE_SECONDS = config("FEED_LEASE_SECONDS", default=300, cast=int)
+FEED_RETRY_MINUTES = config("FEED_RETRY_MINUTES", default=5, cast=int)
+FEED_TIMEOUT = config("FEED_TIMEOUT", default=60, cast=int)
+FEED_DEFAULT_RATE_LIMIT = config("FEED_DEFAULT_RATE_LIMIT", default=0, cast=int)
+
+# Прием остатков от партнеров (drugs.push)
+INGEST_MAX_CONCURRENT_WRITES = config("INGEST_MAX_CONCURRENT_WRITES", default=2, cast=int)
+INGEST_QUEUE_WAIT_SECONDS = config("INGEST_QUEUE_WAIT_SECONDS", default=1.0, cast=float)
+INGEST_RETRY_AFTER_SECONDS = config("INGEST_RETRY_AFTER_SECONDS", default=5, cast=int)
+INGEST_MAX_ROWS = config("INGEST_MAX_ROWS", default=50000, cast=int)
+INGEST_MAX_BYTES = config("INGEST_MAX_BYTES", default=100 * 1024 * 1024, cast=int)
+INGEST_IDEMPOTENCY_HOURS = config("INGEST_IDEMPOTENCY_HOURS", default=24, cast=int)
+
+# Внешние коды препаратов и аптек (drugs.idmaps): сколько источников держать в памяти процесса
+IDMAP_SOURCES_CACHED = config("IDMAP_SOURCES_CACHED", default=20, cast=int)
 
 # Custom User Model
 AUTH_USER_MODEL = "drugs.CustomUser"
 
 # Authentication Backends
+# EmailBackend наследует ModelBackend и обслуживает в том числе вход в админку;
+# второй backend повторно хэшировал бы пароль при каждой неудачной попытке
 AUTHENTICATION_BACKENDS = [
     "drugs.backends.EmailBackend",  # Кастомный backend для email
-    "django.contrib.auth.backends.ModelBackend",  # Стандартный backend (для админки)
 ]
 
+# Хэширование паролей: число итераций PBKDF2 подбирается под нагрузку на вход.
+# Стандартный PBKDF2PasswordHasher не указывается: у него тот же алгоритм
+# pbkdf2_sha256, и его хэши проверяет первый hasher
+PASSWORD_HASHERS = [
+    "drugs.hashers.ConfigurablePBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+PASSWORD_HASH_ITERATIONS = config("PASSWORD_HASH_ITERATIONS", default=1000000, cast=int)
+
+# Ограничение попыток входа (счетчики в кэше, окно в секундах).
+# Счетчик аккаунта ведется отдельно для каждого IP: чужие неудачные попытки
+# не блокируют вход владельцу аккаунта
+LOGIN_THROTTLE_WINDOW = config("LOGIN_THROTTLE_WINDOW", default=300, cast=int)
+LOGIN_THROTTLE_IP_LIMIT = config("LOGIN_THROTTLE_IP_LIMIT", default=20, cast=int)
+LOGIN_THROTTLE_ACCOUNT_LIMIT = config("LOGIN_THROTTLE_ACCOUNT_LIMIT", default=5, cast=int)
+
 LOGIN_URL = "drugs:login" 
 LOGIN_REDIRECT_URL = "home"
 LOGOUT_REDIRECT_URL = "home"
@@ -139,10 +310,22 @@ LOGGING = {
     },
     "root": {
         "handlers": ["console"],
-        "level": "DEBUG",
+        "level": config("LOG_LEVEL", default="INFO"),
+    },
+    "loggers": {
+        # Лог каждого SQL-запроса включается только явно: DB_LOG_LEVEL=DEBUG
+        "django.db.backends": {
+            "level": config("DB_LOG_LEVEL", default="INFO"),
+        },
     },
 }
 
+# Метрики запросов (drugs.instrumentation): Server-Timing, медленные запросы, /metrics
+REQUEST_METRICS_ENABLED = config("REQUEST_METRICS_ENABLED", default=False, cast=bool)
+REQUEST_METRICS_SLOW_MS = config("REQUEST_METRICS_SLOW_MS", default=500, cast=int)
+REQUEST_METRICS_SLOW_SAMPLE_RATE = config("REQUEST_METRICS_SLOW_SAMPLE_RATE", default=1.0, cast=float)
+REQUEST_METRICS_ALLOWED_IPS = config("REQUEST_METRICS_ALLOWED_IPS", default="127.0.0.1", cast=Csv())
+
 # Временно отключите security settings для разработки
 if DEBUG:
     SECURE_SSL_REDIRECT = False
@@ -4,6 +4,7 @@ from django.views.generic import TemplateView
 from django.conf import settings
 from django.conf.urls.static import static
 from drugs import views
+from drugs.instrumentation import metrics_view
 
 urlpatterns = [
     # Главная страница
@@ -12,6 +13,9 @@ urlpatterns = [
     # Админка Django
     path('admin/', admin.site.urls),
     
+    # Метрики для Prometheus (при REQUEST_METRICS_ENABLED)
+    path('metrics', metrics_view, name='metrics'),
+    
     # Подключаем URL из приложения drugs (включая аутентификацию)
     path('drugs/', include('drugs.urls', namespace='drugs')),
     
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pharmacy.settings')
 
 application = get_wsgi_application()
+
+# Прогрев каталога препаратов и аптек в памяти воркера (в фоне)
+from drugs import catalog  # noqa: E402
+
+catalog.warm_on_start()